@@ -0,0 +1,85 @@
+"""
+    startup.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import argparse
+import resource
+import subprocess
+import sys
+from os import path
+from statistics import median
+from time import perf_counter
+
+PACKAGE_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))), "openweathermap_exporter")
+
+# Import the exporter entry point like `python openweathermap_exporter` does, without starting it
+IMPORT_EXPORTER = (
+    "import runpy, sys;"
+    f"sys.path.insert(0, {PACKAGE_DIR!r});"
+    f"runpy.run_path({path.join(PACKAGE_DIR, '__main__.py')!r}, run_name='benchmark')"
+)
+
+def parse_importtime(stderr: str) -> list[tuple[int, str]]:
+    """Cumulative import time in microseconds per top-level module from -X importtime output."""
+
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented, only keep the top-level ones
+        if not name.startswith("  "):
+            modules.append((int(cumulative_us), name.strip()))
+
+    return sorted(modules, reverse=True)
+
+def main() -> None:
+    """Measure the cold start time and memory of the exporter entry point."""
+
+    parser = argparse.ArgumentParser(description="Benchmark the startup of the exporter.")
+    parser.add_argument("--runs", type=int, default=10, help="number of runs, default 10")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to show, default 10")
+    args = parser.parse_args()
+
+    wall_times = []
+    for _ in range(args.runs):
+        start = perf_counter()
+        subprocess.run([sys.executable, "-c", IMPORT_EXPORTER], check=True)
+        wall_times.append(perf_counter() - start)
+    max_rss_kib = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_EXPORTER],
+        check=True, capture_output=True, text=True
+    )
+
+    print(f"startup wall time: median {median(wall_times) * 1000:.1f} ms, "
+          f"min {min(wall_times) * 1000:.1f} ms over {args.runs} runs")
+    print(f"max resident memory: {max_rss_kib / 1024:.1f} MiB")
+    print("slowest top-level imports (cumulative):")
+    for cumulative_us, name in parse_importtime(result.stderr)[:args.top]:
+        print(f"{cumulative_us / 1000:8.1f} ms  {name}")
+
+if __name__ == "__main__":
+    main()
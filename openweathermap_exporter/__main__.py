@@ -23,383 +23,318 @@
     SPDX-License-Identifier: AGPL-3.0-or-later
 """
 
-from os import environ
-from sys import exit
-from time import sleep
+import atexit
+import signal
+import sys
+from threading import Event, Thread
+from time import monotonic, time
 from typing import Optional
 
-import yaml
-from prometheus_client import Gauge, start_http_server
-
-from openweathermap import OpenWeatherMapLocation, OpenWeatherMap, WeatherInformation
-from openmeteo import OpenMeteo, OpenMeteoLocation
-
-label_names = ["latitude", "longitude", "location_country_code", "location_name"]
-
-gauge_temp = Gauge(
-    "weather_temp",
-    "Outside temperature in degrees Celcius provided by OpenWeatherMap",
-    labelnames=label_names
-    )
-
-gauge_temp_min = Gauge(
-    "weather_temp_min",
-    "Outside minimum temperature in degrees Celcius provided by OpenWeatherMap",
-    labelnames=label_names
-    )
-
-gauge_temp_max = Gauge(
-    "weather_temp_max",
-    "Outside maximum temperature in degrees Celcius provided by OpenWeatherMap",
-    labelnames=label_names
-    )
-
-gauge_temp_feels_like = Gauge(
-    "weather_temp_feels_like",
-    "Outside temperature adjusted to human perception in degrees Celcius provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_pressure = Gauge(
-    "weather_pressure",
-    "Outside pressure in hPa provided by OpenWeatherMap",
-    labelnames=label_names
-    )
-
-gauge_humidity = Gauge(
-    "weather_humidity",
-    "Outside relative humidity in % provided by OpenWeatherMap",
-    labelnames=label_names
-    )
-
-gauge_visibility = Gauge(
-    "weather_visibility",
-    "Visibility in meters provided by OpenWeatherMap. The maximum value of the visibility is 10km.",
-    labelnames=label_names
-    )
-
-gauge_wind_speed = Gauge(
-    "weather_wind_speed",
-    "Outside wind speed in m/s provided by OpenWeatherMap",
-    labelnames=label_names
-    )
-
-gauge_wind_deg = Gauge(
-    "weather_wind_deg",
-    "Wind direction in degrees (meteorological) provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_wind_gust = Gauge(
-    "weather_wind_gust",
-    "Wind gust in m/s",
-    labelnames=label_names
-)
-
-gauge_cloudiness = Gauge(
-    "weather_cloudiness",
-    "Relative cloudiness in percentage provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_rain_volume_1h = Gauge(
-    "weather_rain_volume_1h",
-    "Rain volume for the last 1 hour in mm provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_rain_volume_3h = Gauge(
-    "weather_rain_volume_3h",
-    "Rain volume for the last 3 hours in mm provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_snow_volume_1h = Gauge(
-    "weather_snow_volume_1h",
-    "Snow volume for the last 1 hour in mm provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_snow_volume_3h = Gauge(
-    "weather_snow_volume_3h",
-    "Snow volume for the last 3 hours in mm provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_air_quality_index = Gauge(
-    "air_pollution_air_quality_index",
-    """Air Quality Index provided by OpenWeatherMap. Possible values are: 1, 2, 3, 4, 5.
-    Where 1 = Good, 2 = Fair, 3 = Moderate, 4 = Poor, 5 = Very Poor.""",
-    labelnames=label_names
-)
-
-gauge_co = Gauge(
-    "air_pollution_co",
-    "Concentration of CO (carbon monoxide) in μg/m3 provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_no = Gauge(
-    "air_pollution_no",
-    "Concentration of NO (nitrogen monoxide) in μg/m3 provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_no2 = Gauge(
-    "air_pollution_no2",
-    "Concentration of NO2 (nitrogen dioxide) in μg/m3 provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_o3 = Gauge(
-    "air_pollution_o3",
-    "Concentration of O3 (ozone) in μg/m3 provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_so2 = Gauge(
-    "air_pollution_so2",
-    "Concentration of SO2 (sulphur dioxide) in μg/m3 provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_pm2_5 = Gauge(
-    "air_pollution_pm2_5",
-    "Concentration of PM2.5 (fine particulate matter) in μg/m3 provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_pm10 = Gauge(
-    "air_pollution_pm10",
-    "Concentration of PM10 (coarse particulate matter) in μg/m3 provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-gauge_nh3 = Gauge(
-    "air_pollution_nh3",
-    "Concentration of NH3 (ammonia) in μg/m3 provided by OpenWeatherMap",
-    labelnames=label_names
-)
-
-weather_gauges = {
-    gauge_temp : "temp",
-    gauge_temp_min : "temp_min",
-    gauge_temp_max : "temp_max",
-    gauge_temp_feels_like : "temp_feels_like",
-    gauge_pressure : "pressure",
-    gauge_humidity : "humidity",
-    gauge_visibility : "visibility",
-    gauge_wind_speed : "wind_speed",
-    gauge_wind_deg : "wind_deg",
-    gauge_wind_gust : "wind_gust",
-    gauge_cloudiness : "cloudiness",
-    gauge_rain_volume_1h : "rain_volume_1h",
-    gauge_rain_volume_3h : "rain_volume_3h",
-    gauge_snow_volume_1h : "snow_volume_1h",
-    gauge_snow_volume_3h : "snow_volume_3h"
-}
-
-air_pollution_gauges = {
-    gauge_air_quality_index : "air_quality_index",
-    gauge_co : "co",
-    gauge_no : "no",
-    gauge_no2 : "no2",
-    gauge_o3 : "o3",
-    gauge_so2 : "so2",
-    gauge_pm2_5 : "pm2_5",
-    gauge_pm10 : "pm10",
-    gauge_nh3 : "nh3"
-}
-
-om_gauge_pm10 = Gauge(
-    "open_meteo_air_quality_pm10",
-    "Particulate matter with diameter smaller than 10 µm (PM10) close to surface (10 meter above ground) in μg/m³.",
-    labelnames=label_names
-)
-
-om_gauge_pm2_5 = Gauge(
-    "open_meteo_air_quality_pm2_5",
-    "Particulate matter with diameter smaller than 2.5 µm (PM2.5) close to surface (10 meter above ground) in μg/m³",
-    labelnames=label_names
-)
-
-om_gauge_co = Gauge(
-    "open_meteo_air_quality_co",
-    "Carbon monoxide concentration in μg/m³ close to the surface (10 meter above ground)",
-    labelnames=label_names
-)
-
-om_gauge_no2 = Gauge(
-    "open_meteo_air_quality_no2",
-    "Nitrogen dioxide concentration in μg/m³ close to the surface (10 meter above ground)",
-    labelnames=label_names
-)
-
-om_gauge_so2 = Gauge(
-    "open_meteo_air_quality_so2",
-    "Sulphur dioxide concentration in μg/m³ close to the surface (10 meter above ground)",
-    labelnames=label_names
-)
-
-om_gauge_o3 = Gauge(
-    "open_meteo_air_quality_o3",
-    "Ozone concentration in μg/m³ close to the surface (10 meter above ground)",
-    labelnames=label_names
-)
-
-om_gauge_nh3 = Gauge(
-    "open_meteo_air_quality_nh3",
-    "Ammonia concentration in μg/m³ close to the surface (10 meter above ground)",
-    labelnames=label_names
-)
-
-om_gauge_aerosol_optical_depth = Gauge(
-    "open_meteo_air_quality_aerosol_optical_depth",
-    "Aerosol optical depth at 550 nm of the entire atmosphere to indicate haze.",
-    labelnames=label_names
-)
-
-om_gauge_dust = Gauge(
-    "open_meteo_air_quality_dust",
-    "Saharan dust particles close to surface level (10 meter above ground) in μg/m³.",
-    labelnames=label_names
-)
-
-om_gauge_uv_index = Gauge(
-    "open_meteo_air_quality_uv_index",
-    "UV index considering clouds, conforming to the WHO definition",
-    labelnames=label_names
-)
-
-om_gauge_uv_index_clear_sky = Gauge(
-    "open_meteo_air_quality_uv_index_clear_sky",
-    "UV index considering clear sky, conforming to the WHO definition",
-    labelnames=label_names
-)
-
-om_gauge_alder_pollen = Gauge(
-    "open_meteo_air_quality_alder_pollen",
-    "Alder pollen concentration in grains/m³",
-    labelnames=label_names
-)
-
-om_gauge_birch_pollen = Gauge(
-    "open_meteo_air_quality_birch_pollen",
-    "Birch pollen concentration in grains/m³",
-    labelnames=label_names
-)
-
-om_gauge_grass_pollen = Gauge(
-    "open_meteo_air_quality_grass_pollen",
-    "Grass pollen concentration in grains/m³",
-    labelnames=label_names
-)
-
-om_gauge_mugwort_pollen = Gauge(
-    "open_meteo_air_quality_mugwort_pollen",
-    "Mugwort pollen concentration in grains/m³",
-    labelnames=label_names
-)
-
-om_gauge_olive_pollen = Gauge(
-    "open_meteo_air_quality_olive_pollen",
-    "Olive pollen concentration in grains/m³",
-    labelnames=label_names
-)
-
-om_gauge_ragweed_pollen = Gauge(
-    "open_meteo_air_quality_ragweed_pollen",
-    "Ragweed pollen concentration in grains/m³",
-    labelnames=label_names
-)
-
-om_gauge_eaqi = Gauge(
-    "open_meteo_air_quality_european_aqi",
-    "European Air Quality Index (AQI) calculated for different particulate matter and gases individually. The consolidated european_aqi returns the maximum of all individual indices. Ranges from 0-20 (good), 20-40 (fair), 40-60 (moderate), 60-80 (poor), 80-100 (very poor) and exceeds 100 for extremely poor conditions.",
-    labelnames=label_names
-)
-
-om_gauge_eaqi_pm2_5 = Gauge(
-    "open_meteo_air_quality_european_aqi_pm2_5",
-    "European Air Quality Index (AQI) calculated for different particulate matter and gases individually. The consolidated european_aqi returns the maximum of all individual indices. Ranges from 0-20 (good), 20-40 (fair), 40-60 (moderate), 60-80 (poor), 80-100 (very poor) and exceeds 100 for extremely poor conditions.",
-    labelnames=label_names
-)
-
-om_gauge_eaqi_pm10 = Gauge(
-    "open_meteo_air_quality_european_aqi_pm10",
-    "European Air Quality Index (AQI) calculated for different particulate matter and gases individually. The consolidated european_aqi returns the maximum of all individual indices. Ranges from 0-20 (good), 20-40 (fair), 40-60 (moderate), 60-80 (poor), 80-100 (very poor) and exceeds 100 for extremely poor conditions.",
-    labelnames=label_names
-)
-
-om_gauge_eqai_no2 = Gauge(
-    "open_meteo_air_quality_european_aqi_no2",
-    "European Air Quality Index (AQI) calculated for different particulate matter and gases individually. The consolidated european_aqi returns the maximum of all individual indices. Ranges from 0-20 (good), 20-40 (fair), 40-60 (moderate), 60-80 (poor), 80-100 (very poor) and exceeds 100 for extremely poor conditions.",
-    labelnames=label_names
-)
-
-om_gauge_eqai_o3 = Gauge(
-    "open_meteo_air_quality_european_aqi_o3",
-    "European Air Quality Index (AQI) calculated for different particulate matter and gases individually. The consolidated european_aqi returns the maximum of all individual indices. Ranges from 0-20 (good), 20-40 (fair), 40-60 (moderate), 60-80 (poor), 80-100 (very poor) and exceeds 100 for extremely poor conditions.",
-    labelnames=label_names
-)
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge
+
+from openweathermap import (
+    GeocodingMiss, OpenWeatherMapLocation, OpenWeatherMap, choose_weather_strategy
+)
+from openmeteo import (
+    AIR_QUALITY_VARIABLES, AirQualityGrid, OpenMeteo, OpenMeteoLocation, OpenMeteoWeather
+)
+from config import (
+    configure_transport, get_api_key_pool, get_label_set, get_open_meteo_options,
+    get_probe_options, get_weather_backend, load_config
+)
+from server import register_route, set_ready, start_server
+from location_sources import iter_location_configs, location_key
+from remote_write import RemoteWriter
+from sinks import ObservationSink, location_observations
+from derived import DerivedWeatherMetrics
+from aggregates import RegionalAggregates
+from probe import Prober
+from geocoding import Geocoder
+from profiler import Profiler, refresh_timings
+from lifecycle import LifecycleCollector, diff_locations, swap_remove
+from metrics import (
+    AIR_POLLUTION_METRICS, LOCATION_LABEL_NAMES, OPEN_METEO_AIR_QUALITY_METRICS, WEATHER_METRICS,
+    GaugeSet, LabelSet, SnapshotCollector, config_location_id, set_or_omit
+)
+
+# Upper bounds for the forecast configuration, so that the number of series per location
+# stays bounded
+MAX_FORECAST_HORIZONS: int = 8
+MAX_FORECAST_HOURS: int = 96
+
+class OpenMeteoForecastMetrics:
+    """Gauges for forecast horizons and window statistics of selected Open-Meteo variables.
+
+    All values are computed from the hourly forecast that is already downloaded
+    for the current values, so no additional API calls are done.
+    """
+
+    variables: list[str]
+    horizons: list[int]
+    window_hours: int
+    missing_values: str
+    label_set: LabelSet
+
+    horizon_gauges: dict[str, Gauge]
+    window_max_gauges: dict[str, Gauge]
+    window_mean_gauges: dict[str, Gauge]
+
+    def __init__(
+        self,
+        conf: dict,
+        missing_values: str = "zero",
+        label_set: Optional[LabelSet] = None,
+        registry: CollectorRegistry = REGISTRY
+        ):
+        """Create the forecast gauges from the open_meteo_forecast configuration section.
+
+        Accepted keys:
+        variables: list[str], defaults to ["pm2_5"]
+        horizons: list[int], hours ahead, defaults to [3, 6, 12, 24]
+        window_hours: int, defaults to 24
+
+        missing_values is the mode for missing values, see GaugeSet, label_set the labels of a
+        location and registry the registry of the gauges.
+        """
+        self.variables = conf.get("variables", ["pm2_5"])
+        self.horizons = sorted(set(conf.get("horizons", [3, 6, 12, 24])))
+        self.window_hours = conf.get("window_hours", 24)
+        self.missing_values = missing_values
+        self.label_set = LabelSet() if label_set is None else label_set
+
+        for variable in self.variables:
+            if variable not in AIR_QUALITY_VARIABLES:
+                raise ValueError(f"Unknown Open-Meteo forecast variable: {variable}")
+        if len(self.horizons) > MAX_FORECAST_HORIZONS:
+            raise ValueError(f"At most {MAX_FORECAST_HORIZONS} forecast horizons can be configured")
+        for hours in self.horizons + [self.window_hours]:
+            if not 1 <= hours <= MAX_FORECAST_HOURS:
+                raise ValueError(
+                    f"Forecast hours must be between 1 and {MAX_FORECAST_HOURS}, got {hours}")
+
+        self.horizon_gauges = {}
+        self.window_max_gauges = {}
+        self.window_mean_gauges = {}
+        for variable in self.variables:
+            self.horizon_gauges[variable] = Gauge(
+                f"open_meteo_air_quality_{variable}_forecast",
+                f"Open-Meteo forecast of {variable} the number of hours in the horizon label "
+                "from now",
+                labelnames=self.label_set.names + ["horizon"],
+                registry=registry
+            )
+            self.window_max_gauges[variable] = Gauge(
+                f"open_meteo_air_quality_{variable}_forecast_max",
+                f"Maximum Open-Meteo forecast of {variable} over the window label from now",
+                labelnames=self.label_set.names + ["window"],
+                registry=registry
+            )
+            self.window_mean_gauges[variable] = Gauge(
+                f"open_meteo_air_quality_{variable}_forecast_mean",
+                f"Mean Open-Meteo forecast of {variable} over the window label from now",
+                labelnames=self.label_set.names + ["window"],
+                registry=registry
+            )
 
-om_gauge_eqai_so2 = Gauge(
-    "open_meteo_air_quality_european_aqi_so2",
-    "European Air Quality Index (AQI) calculated for different particulate matter and gases individually. The consolidated european_aqi returns the maximum of all individual indices. Ranges from 0-20 (good), 20-40 (fair), 40-60 (moderate), 60-80 (poor), 80-100 (very poor) and exceeds 100 for extremely poor conditions.",
-    labelnames=label_names
-)
+    def set_metrics(self, locations: list[OpenMeteoLocation]) -> None:
+        """Set all forecast metrics to the values of the most recent forecast."""
+
+        horizon_labels = [f"+{h}h" for h in self.horizons]
+        window_label = f"{self.window_hours}h"
+
+        for loc in locations:
+            forecast = loc.get_air_quality_forecast()
+            index = forecast.index_of(time())
+            labelvalues = self.label_set.values(loc)
+
+            for variable in self.variables:
+                values = forecast.horizon_values(variable, index, self.horizons)
+                for horizon, val in zip(horizon_labels, values):
+                    set_or_omit(self.horizon_gauges[variable], labelvalues + (horizon,),
+                                val, self.missing_values)
+
+                window_max, window_mean = forecast.window_statistics(
+                    variable, index, self.window_hours)
+                set_or_omit(self.window_max_gauges[variable], labelvalues + (window_label,),
+                            window_max, self.missing_values)
+                set_or_omit(self.window_mean_gauges[variable], labelvalues + (window_label,),
+                            window_mean, self.missing_values)
+
+    def remove(self, labelvalues: tuple) -> None:
+        """Remove the forecast series of the location with labelvalues."""
+
+        window = (f"{self.window_hours}h",)
+        series = []
+        for variable in self.variables:
+            series += [
+                (self.horizon_gauges[variable], labelvalues + (f"+{h}h",)) for h in self.horizons
+            ]
+            series.append((self.window_max_gauges[variable], labelvalues + window))
+            series.append((self.window_mean_gauges[variable], labelvalues + window))
+        for gauge, values in series:
+            try:
+                gauge.remove(*values)
+            except KeyError:
+                pass
+
+class ObservationMetrics:
+    """Gauges for the weather conditions, sunrise, sunset and the observation time of each source.
+
+    Only the condition series of the current conditions of a location are kept, the series of
+    previous conditions are removed.
+    """
+
+    label_set: LabelSet
+
+    condition_info: Gauge
+    condition_id: Gauge
+    sunrise: Gauge
+    sunset: Gauge
+    weather_timestamp: Gauge
+    air_pollution_timestamp: Gauge
+    open_meteo_timestamp: Optional[Gauge] = None
+
+    # Condition label values exported per location
+    conditions: dict[tuple, list[tuple]]
+
+    def __init__(
+        self,
+        label_set: LabelSet,
+        open_meteo_enabled: bool = False,
+        registry: CollectorRegistry = REGISTRY
+        ):
+        self.label_set = label_set
+        self.conditions = {}
+
+        labelnames = label_set.names
+        self.condition_info = Gauge(
+            "weather_condition_info",
+            "Current weather conditions provided by OpenWeatherMap, always 1",
+            labelnames=labelnames + ["condition_id", "condition_main", "condition_description"],
+            registry=registry
+        )
+        self.condition_id = Gauge(
+            "weather_condition_id",
+            "ID of the primary weather condition provided by OpenWeatherMap, "
+            "see https://openweathermap.org/weather-conditions",
+            labelnames=labelnames,
+            registry=registry
+        )
+        self.sunrise = Gauge("weather_sunrise_timestamp_seconds", "Unix timestamp of sunrise today",
+                             labelnames=labelnames, registry=registry)
+        self.sunset = Gauge("weather_sunset_timestamp_seconds", "Unix timestamp of sunset today",
+                            labelnames=labelnames, registry=registry)
+        self.weather_timestamp = Gauge(
+            "weather_observation_timestamp_seconds",
+            "Unix timestamp of the weather observation provided by OpenWeatherMap",
+            labelnames=labelnames,
+            registry=registry
+        )
+        self.air_pollution_timestamp = Gauge(
+            "air_pollution_observation_timestamp_seconds",
+            "Unix timestamp of the air pollution data provided by OpenWeatherMap",
+            labelnames=labelnames,
+            registry=registry
+        )
+        if open_meteo_enabled:
+            self.open_meteo_timestamp = Gauge(
+                "open_meteo_air_quality_timestamp_seconds",
+                "Unix timestamp of the hourly Open-Meteo air quality forecast values",
+                labelnames=labelnames,
+                registry=registry
+            )
 
-open_meteo_air_quality_gauges = {
-    om_gauge_pm10: "pm10",
-    om_gauge_pm2_5: "pm2_5",
-    om_gauge_co: "co",
-    om_gauge_no2: "no2",
-    om_gauge_so2: "so2",
-    om_gauge_o3: "o3",
-    om_gauge_nh3: "nh3",
-    om_gauge_aerosol_optical_depth: "aerosol_optical_depth",
-    om_gauge_dust: "dust",
-    om_gauge_uv_index: "uv_index",
-    om_gauge_uv_index_clear_sky: "uv_index_clear_sky",
-    om_gauge_alder_pollen: "alder_pollen",
-    om_gauge_birch_pollen: "birch_pollen",
-    om_gauge_grass_pollen: "grass_pollen",
-    om_gauge_mugwort_pollen: "mugwort_pollen",
-    om_gauge_olive_pollen: "olive_pollen",
-    om_gauge_ragweed_pollen: "ragweed_pollen",
-    om_gauge_eaqi: "european_aqi",
-    om_gauge_eaqi_pm2_5: "european_aqi_pm2_5",
-    om_gauge_eaqi_pm10: "european_aqi_pm10",
-    om_gauge_eqai_no2: "european_aqi_no2",
-    om_gauge_eqai_o3: "european_aqi_o3",
-    om_gauge_eqai_so2: "european_aqi_so2"
-}
+    def set_metrics(self, locations: list[OpenWeatherMapLocation]) -> None:
+        """Set the condition, sun and observation time metrics to the newest weather of all
+        locations."""
+
+        for loc in locations:
+            labelvalues = self.label_set.values(loc)
+            weather = loc.get_current_weather()
+
+            conditions = [
+                labelvalues + (sys.intern(str(c.id)), c.main, c.description)
+                for c in weather.weather_conditions
+            ]
+            for condition in self.conditions.get(labelvalues, []):
+                if condition not in conditions:
+                    self.condition_info.remove(*condition)
+            for condition in conditions:
+                self.condition_info.labels(*condition).set(1)
+            self.conditions[labelvalues] = conditions
+            if weather.weather_conditions:
+                self.condition_id.labels(*labelvalues).set(weather.weather_conditions[0].id)
+
+            self.sunrise.labels(*labelvalues).set(weather.sunrise.timestamp())
+            self.sunset.labels(*labelvalues).set(weather.sunset.timestamp())
+            self.weather_timestamp.labels(*labelvalues).set(weather.timestamp.timestamp())
+            self.air_pollution_timestamp.labels(*labelvalues).set(
+                loc.get_current_air_pollution().timestamp.timestamp())
+
+    def set_open_meteo_metrics(self, locations: list[OpenMeteoLocation]) -> None:
+        """Set the time of the current Open-Meteo air quality values of all locations."""
+
+        if self.open_meteo_timestamp is None:
+            return
+        for loc in locations:
+            timestamp = loc.get_current_air_quality().timestamp
+            if timestamp is not None:
+                self.open_meteo_timestamp.labels(*self.label_set.values(loc)).set(timestamp)
+
+    def remove(self, labelvalues: tuple) -> None:
+        """Remove all series of the location with labelvalues."""
+
+        for condition in self.conditions.pop(labelvalues, []):
+            self.condition_info.remove(*condition)
+        gauges = [self.condition_id, self.sunrise, self.sunset,
+                  self.weather_timestamp, self.air_pollution_timestamp]
+        if self.open_meteo_timestamp is not None:
+            gauges.append(self.open_meteo_timestamp)
+        for gauge in gauges:
+            try:
+                gauge.remove(*labelvalues)
+            except KeyError:
+                pass
 
 class Location:
     """Wrapper location class for access to both OpenWeatherMap and Open-Meteo data"""
 
     location_name: str
     country_code: str
+    location_id: Optional[str] = None
 
     provided_lat: Optional[float] = None
     provided_lon: Optional[float] = None
 
     owml: OpenWeatherMapLocation
     oml: Optional[OpenMeteoLocation] = None
+
+    # location_key of the configuration the location was created from
+    config_key: Optional[tuple] = None
     open_meteo_enabled: bool = False
 
-    def __init__(self, owm, **kwargs):
+    def __init__(self, owm, om: Optional[OpenMeteo] = None, **kwargs):
         """Create a generic Location class with support for all weather backends.
 
+        om is the shared Open-Meteo client, a new one is created if not given.
+
         Accepted keyword arguments:
         location_name: str
         country_code: str
+        location_id: str, defaults to an identifier made from the name and country code
         lat: float
         lon: float
+        city_id: int
+        weather_backend: str, see WEATHER_BACKENDS
         open_meteo_enabled: bool
+        open_meteo_options: dict, extra keyword arguments for OpenMeteoLocation
+        geocoder: Geocoder, used for both backends when lat and lon are not given
+
+        Raises GeocodingMiss if the location can not be geocoded.
         """
         self.location_name = kwargs["location_name"]
         self.country_code = kwargs["country_code"]
+        self.location_id = kwargs.get("location_id")
 
         try:
             self.provided_lat = kwargs["lat"]
@@ -407,13 +342,32 @@ class Location:
         except KeyError:
             pass
 
+        geocoder: Optional[Geocoder] = kwargs.get("geocoder")
+        if self.provided_lat is None and geocoder is not None:
+            result = geocoder.geocode(self.location_name, self.country_code)
+            if result.coord is None:
+                raise GeocodingMiss(f"{self.location_name},{self.country_code} could not be "
+                                    f"geocoded: {result.status}")
+            self.provided_lat = result.coord.lat
+            self.provided_lon = result.coord.lon
+
         if self.provided_lat is None:
-            self.owml = OpenWeatherMapLocation(owm, location_name=self.location_name, country_code=self.country_code)
+            self.owml = OpenWeatherMapLocation(
+                owm,
+                location_name=self.location_name,
+                country_code=self.country_code,
+                location_id=self.location_id,
+                city_id=kwargs.get("city_id"),
+                weather_backend=kwargs.get("weather_backend")
+            )
         else:
             self.owml = OpenWeatherMapLocation(
                 owm,
                 location_name=self.location_name,
                 country_code=self.country_code,
+                location_id=self.location_id,
+                city_id=kwargs.get("city_id"),
+                weather_backend=kwargs.get("weather_backend"),
                 lat=self.provided_lat,
                 lon=self.provided_lon
             )
@@ -424,105 +378,141 @@ class Location:
             pass
 
         if self.open_meteo_enabled:
-            om = OpenMeteo()
+            if om is None:
+                om = OpenMeteo()
+            open_meteo_options = kwargs.get("open_meteo_options", {})
             if self.provided_lat is None:
                 self.oml = OpenMeteoLocation(
                     om,
                     location_name=self.location_name,
-                    country_code=self.country_code
+                    country_code=self.country_code,
+                    location_id=self.location_id,
+                    **open_meteo_options
                 )
             else:
                 self.oml = OpenMeteoLocation(
                     om,
                     location_name=self.location_name,
                     country_code=self.country_code,
+                    location_id=self.location_id,
                     lat=self.provided_lat,
-                    lon=self.provided_lon
+                    lon=self.provided_lon,
+                    **open_meteo_options
                 )
 
-# TODO: Maybe add a metric for total api calls done?
-# meta_metrics = {}
+def location_open_meteo_options(
+    config: dict,
+    conf_location: dict,
+    forecast_metrics: Optional[OpenMeteoForecastMetrics]
+    ) -> dict:
+    """Open-Meteo options of a location, the forecast metric variables are always requested."""
+
+    open_meteo_options = get_open_meteo_options(config, conf_location)
+    if forecast_metrics is not None and "variables" in open_meteo_options:
+        open_meteo_options["variables"] = list(
+            dict.fromkeys(open_meteo_options["variables"] + forecast_metrics.variables))
+    return open_meteo_options
+
+def create_location(
+    owm: OpenWeatherMap,
+    om: Optional[OpenMeteo],
+    geocoder: Geocoder,
+    conf_location: dict,
+    open_meteo_enabled: bool,
+    open_meteo_options: dict,
+    weather_backend: str = "owm"
+    ) -> Location:
+    """Create a Location from a location configuration.
+
+    Raises GeocodingMiss if the location can not be geocoded."""
 
-def get_location_current_weather(location: OpenWeatherMapLocation, attr: str) -> float:
-    """Helper function to easily get current weather data."""
-    val = getattr(location.get_current_weather(), attr)
-    if val is None:
-        return 0
-
-    return val
-
-def get_location_current_air_pollution(location: OpenWeatherMapLocation, attr: str) -> float:
-    """Helper function to easily get current air pollution data."""
-    val = getattr(location.get_current_air_pollution(), attr)
-    if val is None:
-        return 0
-
-    return val
-
-def get_location_current_open_meteo_air_quality(location: OpenMeteoLocation, attr: str) -> float:
-    val = getattr(location.get_current_air_quality(), attr)
-    if val is None:
-        return 0
-
-    return val
-
-def set_openweathermap_metrics(locations: list[OpenWeatherMapLocation]):
-    """Set all defined OpenWeatherMap metrics to their newest value"""
-    for loc in locations:
-        # pylint: disable=C0206
-        for gauge in weather_gauges:
-            gauge.labels(
-                location_name=loc.location_name,
-                latitude=loc.coord.lat,
-                longitude=loc.coord.lon,
-                location_country_code=loc.country_code
-            ).set(get_location_current_weather(loc, weather_gauges[gauge]))
-
-        for gauge in air_pollution_gauges:
-            gauge.labels(
-                location_name=loc.location_name,
-                latitude=loc.coord.lat,
-                longitude=loc.coord.lon,
-                location_country_code=loc.country_code
-            ).set(get_location_current_air_pollution(loc, air_pollution_gauges[gauge]))
-
-def set_openmeteo_metrics(locations: list[OpenMeteoLocation]) -> None:
-    """Set all defined Open-Meteo metrics to their newest value"""
-
-    for loc in locations:
-        # pylint: disable=C0206
-        for gauge in open_meteo_air_quality_gauges:
-            gauge.labels(
-                location_name=loc.location_name,
-                latitude=loc.coord.lat,
-                longitude=loc.coord.lon,
-                location_country_code=loc.country_code
-            ).set(get_location_current_open_meteo_air_quality(loc, open_meteo_air_quality_gauges[gauge]))
-
-if __name__ == "__main__":
-
-    config_filepath: str
     try:
-        config_filepath = environ["OPENWEATHERMAP_EXPORTER_CONFIGURATION_FILE"]
-    except:
-        config_filepath = "openweathermap_exporter.yml"
-    print(f"Reading config from {config_filepath}")
-
-    with open(config_filepath, 'r') as f:
-        config = yaml.load(f, Loader=yaml.SafeLoader)
+        loc = Location(
+            owm,
+            om,
+            geocoder=geocoder,
+            open_meteo_enabled=open_meteo_enabled,
+            open_meteo_options=open_meteo_options,
+            city_id=conf_location.get("id"),
+            weather_backend=weather_backend,
+            location_id=conf_location.get("location_id"),
+            location_name=conf_location["name"],
+            country_code=conf_location["cc"],
+            lat=conf_location["lat"],
+            lon=conf_location["lon"]
+        )
+    except KeyError:
+        loc = Location(
+            owm,
+            om,
+            geocoder=geocoder,
+            open_meteo_enabled=open_meteo_enabled,
+            open_meteo_options=open_meteo_options,
+            city_id=conf_location.get("id"),
+            weather_backend=weather_backend,
+            location_id=conf_location.get("location_id"),
+            location_name=conf_location["name"],
+            country_code=conf_location["cc"]
+        )
+
+    loc.config_key = location_key(conf_location)
+    return loc
 
-    api_key: str
-    try:
-        api_key = config["owm"]["api_key"]
-    except (KeyError, TypeError):
-        try:
-            api_key = environ["OPENWEATHERMAP_API_KEY"]
-        except KeyError:
-            exit("Fatal error: no OpenWeatherMap API key provided."
-            " Please set the environment variable OPENWEATHERMAP_API_KEY or provide the API key"
-            " via the configuration file.")
+# TODO: Maybe add a metric for total api calls done?
+# meta_metrics = {}
 
-    owm = OpenWeatherMap(api_key)
+def set_openweathermap_metrics(
+    locations: list[OpenWeatherMapLocation],
+    weather_gauges: GaugeSet,
+    air_pollution_gauges: GaugeSet,
+    label_set: LabelSet,
+    aggregates: Optional[RegionalAggregates] = None
+    ) -> None:
+    """Set all defined OpenWeatherMap metrics to their newest value
+
+    If aggregates is given, the values are also stored in the slot of the location."""
+    for slot, loc in enumerate(locations):
+        labelvalues = label_set.values(loc)
+        weather = loc.get_current_weather()
+        weather_gauges.set(weather.values, weather.presence, labelvalues)
+        air_pollution = loc.get_current_air_pollution()
+        air_pollution_gauges.set(air_pollution.values, air_pollution.presence, labelvalues)
+        if aggregates is not None:
+            aggregates.update("weather", slot, weather.values)
+            aggregates.update("air_pollution", slot, air_pollution.values)
+
+def set_openmeteo_metrics(
+    locations: list[OpenMeteoLocation],
+    gauges: GaugeSet,
+    label_set: LabelSet,
+    aggregates: Optional[RegionalAggregates] = None
+    ) -> None:
+    """Set all defined Open-Meteo metrics to their newest value
+
+    Gauges for variables which are not requested for a location are skipped."""
+
+    for slot, loc in enumerate(locations):
+        air_quality = loc.get_current_air_quality()
+        gauges.set(air_quality.values, air_quality.presence, label_set.values(loc),
+                   loc.variables_mask)
+        if aggregates is not None:
+            aggregates.update("open_meteo", slot, air_quality.values)
+
+def main() -> None:
+    """Refresh the configured locations every 10 minutes and export their metrics."""
+
+    config = load_config()
+    configure_transport(config)
+    api_key_pool = get_api_key_pool(config)
+    REGISTRY.register(api_key_pool)
+    print(f"api_keys: {[key.name for key in api_key_pool.keys]}")
+
+    # Start serving right away, geocoding and the first refresh can take a long time for many
+    # locations.
+    # Until the first refresh is done, /ready answers 503 and exporter_ready is 0.
+    start_server(config["prometheus_exporter"]["port"], config["prometheus_exporter"]["host"])
+
+    owm = OpenWeatherMap(api_key_pool)
     open_meteo_enabled: bool = False
     try:
         open_meteo_enabled = config["prometheus_exporter"]["open_meteo_additional_data"]
@@ -537,46 +527,397 @@ if __name__ == "__main__":
         pass
     print(f"ignore_failure: {ignore_failure}")
 
+    missing_values: str = "zero"
+    try:
+        missing_values = config["prometheus_exporter"]["missing_values"]
+    except KeyError:
+        pass
+    print(f"missing_values: {missing_values}")
+
+    label_set = get_label_set(config)
+    print(f"labels: {label_set.names}")
+
+    # With per_location false in the aggregates section, only the aggregates of the locations are
+    # exported and no per location gauges are created at all
+    per_location: bool = True
+    try:
+        per_location = config["prometheus_exporter"]["aggregates"]["per_location"]
+    except KeyError:
+        pass
+    print(f"per_location: {per_location}")
+
+    # Gauges of the locations that are set one series at a time are registered here, and
+    # published in the snapshot together with the gauge sets
+    staging = CollectorRegistry()
+
+    # Optionally share Open-Meteo air quality forecasts between locations in the same model grid
+    # cell
+    grid: Optional[AirQualityGrid] = None
+    try:
+        if config["prometheus_exporter"]["open_meteo_grid_deduplication"]:
+            grid = AirQualityGrid()
+    except KeyError:
+        pass
+
     om: Optional[OpenMeteo] = None
     if open_meteo_enabled:
-        om = OpenMeteo()
+        om = OpenMeteo(grid)
+
+    forecast_metrics: Optional[OpenMeteoForecastMetrics] = None
+    try:
+        if open_meteo_enabled and per_location:
+            forecast_metrics = OpenMeteoForecastMetrics(
+                config["prometheus_exporter"]["open_meteo_forecast"], missing_values, label_set,
+                staging)
+    except KeyError:
+        pass
+
+    derived_metrics: Optional[DerivedWeatherMetrics] = None
+    try:
+        if per_location:
+            derived_metrics = DerivedWeatherMetrics(
+                config["prometheus_exporter"]["derived_metrics"], missing_values, label_set.names)
+            print(f"derived_metrics: {derived_metrics.metrics}")
+    except KeyError:
+        pass
 
+    # Locations are geocoded with the providers in the configured order, misses are retried after
+    # miss_ttl and errors after error_ttl with backoff
+    geocoding_config: dict = {}
+    try:
+        geocoding_config = config["prometheus_exporter"]["geocoding"]
+    except KeyError:
+        pass
+    geocoding_providers = {
+        "owm": owm.geocode,
+        "open_meteo": (om if om is not None else OpenMeteo()).geocode
+    }
+    geocoder = Geocoder(
+        [(name, geocoding_providers[name])
+         for name in geocoding_config.get("providers", ["owm", "open_meteo"])],
+        geocoding_config.get("hit_ttl"),
+        geocoding_config.get("miss_ttl", 3600),
+        geocoding_config.get("max_entries", 10000),
+        geocoding_config.get("error_ttl", 60)
+    )
+
+    # Probed coordinates get their own Open-Meteo client, so they are not added to the grid
+    prober: Optional[Prober] = None
+    probe_options = get_probe_options(config)
+    if probe_options is not None:
+        prober = Prober(owm, OpenMeteo() if open_meteo_enabled else None,
+                        missing_values=missing_values, geocoder=geocoder, **probe_options)
+        register_route("/probe", prober.route)
+        print(f"probe: caching {prober.cache.max_entries} coordinates "
+              f"for {prober.cache.ttl} seconds")
+
+    # Profiling is opt-in, sampling costs a little CPU while a profile is taken
+    try:
+        profiler = Profiler(**config["prometheus_exporter"]["debug"])
+        register_route("/debug/profile", profiler.profile_route)
+        register_route("/debug/timings", profiler.timings_route)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, profiler.handle_signal)
+        print("debug: /debug/profile and /debug/timings enabled")
+    except KeyError:
+        pass
+
+    # Locations can be reloaded from the configuration, periodically or on SIGHUP, and limited in
+    # number
+    lifecycle_config: dict = {}
+    try:
+        lifecycle_config = config["prometheus_exporter"]["lifecycle"]
+    except KeyError:
+        pass
+    reload_interval: Optional[float] = lifecycle_config.get("reload_interval")
+    max_locations: Optional[int] = lifecycle_config.get("max_locations")
+    reload_requested = Event()
+    if hasattr(signal, "SIGHUP"):
+        # Set from another thread, the main thread may hold the lock of the event when the signal
+        # arrives
+        signal.signal(
+            signal.SIGHUP,
+            lambda _signum, _frame: Thread(target=reload_requested.set, daemon=True).start())
+    # Exit normally on SIGTERM, as sent by docker stop and systemd, so the atexit handlers run
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+
+    selected_variables: set[str] = set()
     locations: list[Location] = []
-    for conf_location in config["prometheus_exporter"]["locations"]:
+    # Locations which could not be geocoded yet, with their Open-Meteo options
+    pending_locations: list[tuple[dict, dict]] = []
+    location_ids: set[str] = set()
+    for conf_location in iter_location_configs(config):
+        label_set.require_location_id(conf_location, location_ids)
+        open_meteo_options = location_open_meteo_options(config, conf_location, forecast_metrics)
+        selected_variables.update(open_meteo_options.get("variables", AIR_QUALITY_VARIABLES))
+
+        if max_locations is not None and len(locations) >= max_locations:
+            print(f"Not adding {conf_location['name']},{conf_location['cc']}, "
+                  "max_locations reached")
+            pending_locations.append((conf_location, open_meteo_options))
+            continue
         try:
-            locations.append(Location(
-                owm,
-                open_meteo_enabled=open_meteo_enabled,
-                location_name=conf_location["name"],
-                country_code=conf_location["cc"],
-                lat=conf_location["lat"],
-                lon=conf_location["lon"]
-            ))
-        except KeyError:
-            locations.append(Location(
-                owm,
-                open_meteo_enabled=open_meteo_enabled,
-                location_name=conf_location["name"],
-                country_code=conf_location["cc"]
-            ))
+            locations.append(create_location(
+                owm, om, geocoder, conf_location, open_meteo_enabled, open_meteo_options,
+                get_weather_backend(config, conf_location)))
+        except GeocodingMiss as exc:
+            print(f"Skipping location for now, {exc}")
+            pending_locations.append((conf_location, open_meteo_options))
+
+    aggregates: Optional[RegionalAggregates] = None
+    try:
+        aggregates_config = config["prometheus_exporter"]["aggregates"]
+        aggregates = RegionalAggregates(
+            aggregates_config, [(l.owml.country_code, l.owml.location_name) for l in locations],
+            missing_values, staging)
+        print(f"aggregates: {aggregates.metrics} over {len(aggregates.groups)} groups")
+    except KeyError:
+        pass
+
+    weather_gauges = GaugeSet([], missing_values=missing_values)
+    air_pollution_gauges = GaugeSet([], missing_values=missing_values)
+    if per_location:
+        weather_gauges = GaugeSet(WEATHER_METRICS, label_set.names, missing_values=missing_values)
+        air_pollution_gauges = GaugeSet(AIR_POLLUTION_METRICS, label_set.names,
+                                        missing_values=missing_values)
+    # Only create the Open-Meteo gauges for variables which are requested for any location
+    open_meteo_air_quality_gauges = GaugeSet([], missing_values=missing_values)
+    if open_meteo_enabled and per_location:
+        open_meteo_air_quality_gauges = GaugeSet(
+            OPEN_METEO_AIR_QUALITY_METRICS, label_set.names, selected_variables, missing_values)
 
     openweathermap_locations = [ l.owml for l in locations ]
 
+    # With only a location_id label, the other labels of a location are kept in one info series
+    location_info: Optional[Gauge] = None
+    if label_set.info_enabled and per_location:
+        location_info = Gauge("weather_location_info", "Labels of a location, always 1",
+                              labelnames=LOCATION_LABEL_NAMES, registry=staging)
+        for l in openweathermap_locations:
+            location_info.labels(*label_set.all_labels(l).values()).set(1)
+
+    remote_writer: Optional[RemoteWriter] = None
+    try:
+        remote_write_config = dict(config["prometheus_exporter"]["remote_write"])
+        remote_writer = RemoteWriter(remote_write_config.pop("url"), **remote_write_config)
+        print(f"remote_write: {remote_writer.url}")
+    except KeyError:
+        pass
+
+    # Archive the observations of every refresh, written by a background thread
+    observation_sink: Optional[ObservationSink] = None
+    try:
+        sink_config = dict(config["prometheus_exporter"]["sink"])
+        observation_sink = ObservationSink(sink_config.pop("directory"), **sink_config)
+        print(f"sink: {observation_sink.format_name} in {observation_sink.directory}")
+    except KeyError:
+        pass
+    if observation_sink is not None:
+        # Write the buffered observations when the exporter exits
+        atexit.register(observation_sink.close)
+
+    observation_metrics: Optional[ObservationMetrics] = None
+    if per_location:
+        observation_metrics = ObservationMetrics(label_set, open_meteo_enabled, staging)
+
+    # The location gauges are published together after each refresh, so scrapes never see a
+    # partial refresh. Registered once all gauges exist, so all their names are checked for
+    # duplicates
+    gauge_sets = [weather_gauges, air_pollution_gauges, open_meteo_air_quality_gauges]
+    if derived_metrics is not None:
+        gauge_sets.append(derived_metrics.gauges)
+    snapshot = SnapshotCollector(gauge_sets, staging)
+    REGISTRY.register(snapshot)
+
+    if grid is not None:
+        print(f"open_meteo_grid_deduplication: {len(locations)} locations "
+              f"in {len(grid.cells)} grid cells")
+
+    # Use the weather endpoint with the fewest API calls per refresh for the configured locations
+    weather_endpoints: list[str] = ["current", "group"]
+    try:
+        weather_endpoints = config["owm"]["weather_endpoints"]
+    except (KeyError, TypeError):
+        pass
+    owm_weather_locations = [l for l in openweathermap_locations if l.weather_backend == "owm"]
+    weather_strategy = choose_weather_strategy(weather_endpoints, owm_weather_locations)
+    print(f"weather_endpoint: {weather_strategy.name}, "
+          f"{weather_strategy.calls_per_refresh(owm_weather_locations)} calls per refresh")
+
+    # Locations with the open_meteo weather backend get their weather in batches from the
+    # Open-Meteo Forecast API
+    open_meteo_weather = OpenMeteoWeather(om)
+    open_meteo_weather_locations = [
+        l for l in openweathermap_locations if l.weather_backend == "open_meteo"
+    ]
+    if open_meteo_weather_locations:
+        calls = open_meteo_weather.calls_per_refresh(open_meteo_weather_locations)
+        print(f"open_meteo_weather: {len(open_meteo_weather_locations)} locations, "
+              f"{calls} calls per refresh")
+
+    openmeteo_locations: list[OpenMeteoLocation] = []
     if open_meteo_enabled:
         openmeteo_locations = [ l.oml for l in locations ]
 
-    start_http_server(config["prometheus_exporter"]["port"], config["prometheus_exporter"]["host"])
+    # Components with series per location, which are removed together with a location
+    location_series: list = [weather_gauges, air_pollution_gauges, open_meteo_air_quality_gauges]
+    for component in [derived_metrics, observation_metrics, forecast_metrics]:
+        if component is not None:
+            location_series.append(component)
+
+    lifecycle_collector = LifecycleCollector()
+    lifecycle_collector.add("locations", lambda: len(locations))
+    lifecycle_collector.add("pending_locations", lambda: len(pending_locations))
+    lifecycle_collector.add("location_series",
+                            lambda: sum(len(g.rows) for g in snapshot.gauge_sets))
+    lifecycle_collector.add("geocoder_cache", lambda: len(geocoder.cache))
+    if prober is not None:
+        lifecycle_collector.add("probe_cache", lambda: len(prober.cache.entries))
+    if grid is not None:
+        lifecycle_collector.add("grid_forecasts", lambda: len(grid.forecasts))
+    if derived_metrics is not None and derived_metrics.precipitation is not None:
+        lifecycle_collector.add("precipitation_totals",
+                                lambda: len(derived_metrics.precipitation.totals))
+    if remote_writer is not None:
+        lifecycle_collector.add("remote_write_series", lambda: len(remote_writer.sent))
+    REGISTRY.register(lifecycle_collector)
+
+    next_reload: Optional[float] = None
+    if reload_interval is not None:
+        next_reload = monotonic() + reload_interval
 
     while True:
+        # API requests of the refresh are timed as fetch and decode, the remaining time of
+        # refreshing the locations and setting their metrics as parse
+        refresh_timings.start()
         try:
-            set_openweathermap_metrics(openweathermap_locations)
-
-            if open_meteo_enabled:
-                set_openmeteo_metrics(openmeteo_locations)
+            reload_due = next_reload is not None and monotonic() >= next_reload
+            if reload_requested.is_set() or reload_due:
+                reload_requested.clear()
+                if reload_interval is not None:
+                    next_reload = monotonic() + reload_interval
+
+                # Only the locations are reloaded, other settings take effect after a restart
+                added, removed = diff_locations(
+                    [l.config_key for l in locations]
+                    + [location_key(c) for c, _ in pending_locations],
+                    list(iter_location_configs(load_config())))
+                pending_locations = [
+                    p for p in pending_locations if location_key(p[0]) not in removed
+                ]
+
+                # Going backwards, the location moved into a removed slot has already been kept
+                for slot in reversed(range(len(locations))):
+                    loc = locations[slot]
+                    if loc.config_key not in removed:
+                        continue
+                    print(f"Removing location {loc.location_name},{loc.country_code}")
+                    labelvalues = label_set.values(loc.owml)
+                    for component in location_series:
+                        component.remove(labelvalues)
+                    if location_info is not None:
+                        location_info.remove(*label_set.all_labels(loc.owml).values())
+                    if aggregates is not None:
+                        aggregates.remove_location(slot)
+                    swap_remove(locations, slot)
+                    swap_remove(openweathermap_locations, slot)
+                    if open_meteo_enabled:
+                        swap_remove(openmeteo_locations, slot)
+                        if grid is not None and loc.oml is not None:
+                            grid.remove(loc.oml.coord)
+                    if loc.owml.weather_backend == "open_meteo":
+                        open_meteo_weather_locations.remove(loc.owml)
+                    else:
+                        owm_weather_locations.remove(loc.owml)
+
+                location_ids = {l.owml.location_id for l in locations}
+                location_ids.update(config_location_id(c) for c, _ in pending_locations)
+                for conf_location in added:
+                    if not label_set.claim_location_id(conf_location, location_ids):
+                        print(f"Skipping location {conf_location['name']},{conf_location['cc']}, "
+                              f"location_id {config_location_id(conf_location)} is already used")
+                        continue
+                    pending_locations.append((conf_location, location_open_meteo_options(
+                        config, conf_location, forecast_metrics)))
+                print(f"Reloaded locations: {len(added)} added, {len(removed)} removed")
+
+            # The geocoder limits the retries of pending locations to one call per provider per
+            # miss_ttl
+            for conf_location, open_meteo_options in list(pending_locations):
+                if max_locations is not None and len(locations) >= max_locations:
+                    break
+                try:
+                    loc = create_location(
+                        owm, om, geocoder, conf_location, open_meteo_enabled, open_meteo_options,
+                        get_weather_backend(config, conf_location))
+                except GeocodingMiss:
+                    continue
+                print(f"Adding location {loc.location_name},{loc.country_code}")
+                pending_locations.remove((conf_location, open_meteo_options))
+                locations.append(loc)
+                openweathermap_locations.append(loc.owml)
+                if loc.owml.weather_backend == "open_meteo":
+                    open_meteo_weather_locations.append(loc.owml)
+                else:
+                    owm_weather_locations.append(loc.owml)
+                if open_meteo_enabled:
+                    openmeteo_locations.append(loc.oml)
+                if aggregates is not None:
+                    aggregates.add_location(loc.country_code, loc.location_name)
+                if location_info is not None:
+                    location_info.labels(*label_set.all_labels(loc.owml).values()).set(1)
+
+            with refresh_timings.phase("parse"):
+                weather_strategy.refresh(owm, owm_weather_locations)
+                open_meteo_weather.refresh(open_meteo_weather_locations)
+                set_openweathermap_metrics(openweathermap_locations, weather_gauges,
+                                           air_pollution_gauges, label_set, aggregates)
+                if observation_metrics is not None:
+                    observation_metrics.set_metrics(openweathermap_locations)
+
+                if derived_metrics is not None:
+                    derived_metrics.set_metrics(
+                        [label_set.values(l) for l in openweathermap_locations],
+                        [l.get_current_weather() for l in openweathermap_locations])
+
+                if open_meteo_enabled:
+                    set_openmeteo_metrics(openmeteo_locations, open_meteo_air_quality_gauges,
+                                          label_set, aggregates)
+                    if observation_metrics is not None:
+                        observation_metrics.set_open_meteo_metrics(openmeteo_locations)
+
+                    if forecast_metrics is not None:
+                        forecast_metrics.set_metrics(openmeteo_locations)
+
+            with refresh_timings.phase("publish"):
+                if aggregates is not None:
+                    aggregates.set_metrics()
+
+                snapshot.publish()
+                set_ready()
+
+                if remote_writer is not None:
+                    remote_writer.submit()
+
+                if observation_sink is not None:
+                    observations = []
+                    for i, l in enumerate(openweathermap_locations):
+                        oml = openmeteo_locations[i] if open_meteo_enabled else None
+                        observations.extend(location_observations(l, oml, label_set.labels(l)))
+                    observation_sink.submit(observations)
+
+            refresh_timings.finish()
         except Exception as exc:
             if ignore_failure:
                 print(f"Failed to get metrics from API {exc}")
+                # Publish the locations which were refreshed before the failure
+                snapshot.publish()
+                refresh_timings.finish()
             else:
                 raise exc
 
-        sleep(600)
+        # SIGHUP ends the wait, so a reload takes effect right away
+        reload_requested.wait(600)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+    aggregates.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+from array import array
+from math import isnan, nan
+from typing import Optional
+
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge
+
+from metrics import (
+    AIR_POLLUTION_METRICS, OPEN_METEO_AIR_QUALITY_METRICS, WEATHER_METRICS, MetricSpec, set_or_omit
+)
+
+# Spec tables of the values tuples which can be passed to RegionalAggregates.update
+AGGREGATE_SOURCES: dict[str, list[MetricSpec]] = {
+    "weather": WEATHER_METRICS,
+    "air_pollution": AIR_POLLUTION_METRICS,
+    "open_meteo": OPEN_METEO_AIR_QUALITY_METRICS
+}
+
+AGGREGATE_LABEL_NAMES = ["aggregate_by", "group", "statistic"]
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Percentile q (0-100) of sorted values, linearly interpolated between the closest ranks."""
+
+    rank = (len(sorted_values) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+def compute_statistic(statistic: str, sorted_values: list[float]) -> float:
+    """Compute min, max, mean or a percentile written as pNN over sorted values."""
+
+    if statistic == "min":
+        return sorted_values[0]
+    if statistic == "max":
+        return sorted_values[-1]
+    if statistic == "mean":
+        return sum(sorted_values) / len(sorted_values)
+    return percentile(sorted_values, float(statistic[1:]))
+
+def value_changed(val: float, old: float) -> bool:
+    """Whether val differs from old, where NaN, a missing value, equals NaN."""
+    return val != old and not (isnan(val) and isnan(old))
+
+def validate_statistic(statistic: str) -> None:
+    """Raise ValueError if statistic is not min, max, mean or pNN with NN between 0 and 100."""
+
+    if statistic in ["min", "max", "mean"]:
+        return
+    try:
+        if statistic.startswith("p") and 0 <= float(statistic[1:]) <= 100:
+            return
+    except ValueError:
+        pass
+    raise ValueError(f"Unknown aggregate statistic: {statistic}")
+
+class RegionalAggregates:
+    """Statistics of selected metrics over groups of locations.
+
+    Every location has a fixed slot in an array per metric. After each refresh the values of all
+    locations are written to their slot and only the groups with a changed member are computed
+    again.
+    """
+
+    metrics: list[str]
+    statistics: list[str]
+    missing_values: str
+
+    group_by_country: bool
+    # Named group to the location names in it
+    named_groups: dict[str, list[str]]
+
+    # Metric name to its source and position in the values tuple of that source
+    positions: dict[str, tuple[str, int]]
+    values: dict[str, array]
+    # (aggregate_by, group) to the slots of the member locations
+    groups: dict[tuple[str, str], list[int]]
+    groups_of_slot: list[list[tuple[str, str]]]
+    dirty: set[tuple[str, str]]
+    gauges: dict[str, Gauge]
+
+    def __init__(
+        self,
+        conf: dict,
+        locations: list[tuple[str, str]],
+        missing_values: str = "zero",
+        registry: CollectorRegistry = REGISTRY
+        ):
+        """Create the aggregate gauges from the aggregates configuration section.
+
+        locations are the (country code, location name) of every slot.
+
+        Accepted keys:
+        metrics: list[str], names of the metrics to aggregate, defaults to ["weather_temp"]
+        statistics: list[str], min, max, mean or a percentile like p90,
+            defaults to ["min", "max", "mean"]
+        group_by_country: bool, defaults to true
+        groups: dict[str, list[str]], named groups of location names, defaults to none
+
+        missing_values is the mode for groups without any value, see GaugeSet.
+        """
+        self.metrics = conf.get("metrics", ["weather_temp"])
+        self.statistics = conf.get("statistics", ["min", "max", "mean"])
+        self.missing_values = missing_values
+
+        specs = {
+            spec.name: (source, index, spec)
+            for source, source_specs in AGGREGATE_SOURCES.items()
+            for index, spec in enumerate(source_specs)
+        }
+        for metric in self.metrics:
+            if metric not in specs:
+                raise ValueError(f"Unknown aggregate metric: {metric}")
+        for statistic in self.statistics:
+            validate_statistic(statistic)
+
+        self.group_by_country = conf.get("group_by_country", True)
+        self.named_groups = conf.get("groups", {})
+        self.positions = {metric: specs[metric][:2] for metric in self.metrics}
+        self.values = {metric: array("d") for metric in self.metrics}
+        self.groups = {("region", group): [] for group in self.named_groups}
+        self.groups_of_slot = []
+        self.dirty = set(self.groups)
+        for country_code, location_name in locations:
+            self.add_location(country_code, location_name)
+
+        self.gauges = {
+            metric: Gauge(
+                f"{metric}_aggregate",
+                f"{specs[metric][2].help}, aggregated over the locations in a group",
+                labelnames=AGGREGATE_LABEL_NAMES,
+                registry=registry
+            )
+            for metric in self.metrics
+        }
+
+    def add_location(self, country_code: str, location_name: str) -> int:
+        """Add a location in the next slot, returns the slot."""
+
+        slot = len(self.groups_of_slot)
+        groups = [
+            ("region", group) for group, names in self.named_groups.items()
+            if location_name in names
+        ]
+        if self.group_by_country:
+            groups.insert(0, ("country", country_code))
+
+        for group in groups:
+            self.groups.setdefault(group, []).append(slot)
+        self.groups_of_slot.append(groups)
+        for column in self.values.values():
+            column.append(nan)
+        self.dirty.update(groups)
+
+        return slot
+
+    def remove_location(self, slot: int) -> None:
+        """Remove the location in slot by moving the location in the last slot into it.
+
+        The caller must move its last location to slot as well. Country groups without
+        locations are removed together with their series.
+        """
+
+        last = len(self.groups_of_slot) - 1
+        for group in self.groups_of_slot[slot]:
+            self.groups[group].remove(slot)
+            self.dirty.add(group)
+        if slot != last:
+            for group in self.groups_of_slot[last]:
+                members = self.groups[group]
+                members[members.index(last)] = slot
+            self.groups_of_slot[slot] = self.groups_of_slot[last]
+            for column in self.values.values():
+                column[slot] = column[last]
+        self.groups_of_slot.pop()
+        for column in self.values.values():
+            column.pop()
+
+        for group in [g for g in self.dirty if g[0] == "country" and not self.groups[g]]:
+            del self.groups[group]
+            self.dirty.discard(group)
+            for gauge in self.gauges.values():
+                for statistic in self.statistics:
+                    try:
+                        gauge.remove(*group, statistic)
+                    except KeyError:
+                        pass
+
+    def update(self, source: str, slot: int, values: tuple) -> None:
+        """Store the values tuple of source for the location in slot."""
+
+        for metric, (metric_source, index) in self.positions.items():
+            if metric_source != source:
+                continue
+            val = values[index]
+            val = nan if val is None else float(val)
+            old = self.values[metric][slot]
+            if value_changed(val, old):
+                self.values[metric][slot] = val
+                self.dirty.update(self.groups_of_slot[slot])
+
+    def set_metrics(self) -> None:
+        """Compute the statistics of all groups with changed values."""
+
+        for group in self.dirty:
+            slots = self.groups[group]
+            for metric, gauge in self.gauges.items():
+                column = self.values[metric]
+                group_values = sorted(column[slot] for slot in slots if not isnan(column[slot]))
+                for statistic in self.statistics:
+                    val: Optional[float] = None
+                    if group_values:
+                        val = compute_statistic(statistic, group_values)
+                    set_or_omit(gauge, group + (statistic,), val, self.missing_values)
+
+        self.dirty = set()
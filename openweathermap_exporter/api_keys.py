@@ -0,0 +1,199 @@
+"""
+    api_keys.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+from threading import Lock
+from time import sleep, time
+from typing import Callable, Iterator, Optional
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+
+# Seconds a key is taken out of rotation after a response with these status codes,
+# doubled for every further failure up to MAX_COOLDOWN_SECONDS
+KEY_FAILURE_COOLDOWN_SECONDS: dict[int, float] = {
+    401: 600,
+    429: 60
+}
+MAX_COOLDOWN_SECONDS: float = 6 * 3600
+
+class ApiKeyPoolExhausted(RuntimeError):
+    """Raised when no API key becomes available within the maximum wait."""
+
+class ApiKey:
+    """One API key with its optional quotas and usage.
+
+    name is used in metrics and log messages, the key itself is never exposed.
+    """
+
+    name: str
+    key: str
+    calls_per_minute: Optional[int]
+    calls_per_day: Optional[int]
+
+    minute: int = -1
+    minute_calls: int = 0
+    day: int = -1
+    day_calls: int = 0
+    cooldown_until: float = 0
+    failures: int = 0
+    # Responses per status code
+    responses: dict[int, int]
+
+    def __init__(self, key: str, **kwargs):
+        """Create an API key.
+
+        Accepted keyword arguments:
+        name: str, defaults to "default"
+        calls_per_minute: int, defaults to unlimited
+        calls_per_day: int, defaults to unlimited
+        """
+        self.key = key
+        self.name = kwargs.get("name", "default")
+        self.calls_per_minute = kwargs.get("calls_per_minute")
+        self.calls_per_day = kwargs.get("calls_per_day")
+        self.responses = {}
+
+    def roll_windows(self, now: float) -> None:
+        """Reset the call counts when a new minute or UTC day started."""
+
+        if int(now // 60) != self.minute:
+            self.minute = int(now // 60)
+            self.minute_calls = 0
+        if int(now // 86400) != self.day:
+            self.day = int(now // 86400)
+            self.day_calls = 0
+
+    def remaining_fraction(self) -> float:
+        """Smallest fraction of the minute and day quota which is left, 1 without quotas."""
+
+        fraction = 1.0
+        if self.calls_per_minute is not None:
+            fraction = min(fraction, 1 - self.minute_calls / self.calls_per_minute)
+        if self.calls_per_day is not None:
+            fraction = min(fraction, 1 - self.day_calls / self.calls_per_day)
+        return fraction
+
+    def available_at(self, now: float) -> float:
+        """Earliest time at which the key can be used."""
+
+        available = max(now, self.cooldown_until)
+        if self.calls_per_day is not None and self.day_calls >= self.calls_per_day:
+            available = max(available, (self.day + 1) * 86400)
+        if self.calls_per_minute is not None and self.minute_calls >= self.calls_per_minute:
+            available = max(available, (self.minute + 1) * 60)
+        return available
+
+class ApiKeyPool:
+    """Spread requests over API keys by their remaining quota.
+
+    Keys are taken out of rotation for a while after 401 and 429 responses. When all keys are
+    out of quota or cooling down, acquire waits for the first key to become available.
+    The pool is a collector of the usage metrics per key.
+    """
+
+    keys: list[ApiKey]
+    max_wait: float
+    clock: Callable[[], float]
+    lock: Lock
+
+    def __init__(self, keys: list[ApiKey], max_wait: float = 60, clock: Callable[[], float] = time):
+        if not keys:
+            raise ValueError("At least one API key is required")
+        if len({key.name for key in keys}) != len(keys):
+            raise ValueError("API key names must be unique")
+
+        self.keys = keys
+        self.max_wait = max_wait
+        self.clock = clock
+        self.lock = Lock()
+
+    def acquire(self) -> ApiKey:
+        """Take the available key with the most remaining quota and count a call on it."""
+
+        while True:
+            with self.lock:
+                now = self.clock()
+                for key in self.keys:
+                    key.roll_windows(now)
+
+                available = [key for key in self.keys if key.available_at(now) <= now]
+                if available:
+                    key = max(available, key=lambda k: (k.remaining_fraction(), -k.minute_calls))
+                    key.minute_calls += 1
+                    key.day_calls += 1
+                    return key
+
+                wait = min(key.available_at(now) for key in self.keys) - now
+
+            if wait > self.max_wait:
+                raise ApiKeyPoolExhausted(
+                    f"No OpenWeatherMap API key available for {wait:.0f} seconds")
+            sleep(wait)
+
+    def report(self, key: ApiKey, status_code: int) -> None:
+        """Record the response status of a call done with key."""
+
+        with self.lock:
+            key.responses[status_code] = key.responses.get(status_code, 0) + 1
+            try:
+                cooldown = KEY_FAILURE_COOLDOWN_SECONDS[status_code]
+            except KeyError:
+                key.failures = 0
+                return
+
+            key.failures += 1
+            cooldown = min(cooldown * 2 ** (key.failures - 1), MAX_COOLDOWN_SECONDS)
+            key.cooldown_until = self.clock() + cooldown
+            print(f"OpenWeatherMap API key {key.name} got status {status_code}, "
+                  f"not used for {cooldown:.0f} seconds")
+
+    def collect(self) -> Iterator[Metric]:
+        """Usage metrics per key, labelled with the key name."""
+
+        responses = CounterMetricFamily(
+            "openweathermap_api_key_responses",
+            "Responses of the OpenWeatherMap API per key and status code",
+            labels=["key", "status"])
+        calls = GaugeMetricFamily(
+            "openweathermap_api_key_calls",
+            "Calls done with an OpenWeatherMap API key in the current window",
+            labels=["key", "window"])
+        available = GaugeMetricFamily(
+            "openweathermap_api_key_available",
+            "Whether an OpenWeatherMap API key is in rotation, 1 if it is",
+            labels=["key"])
+
+        with self.lock:
+            now = self.clock()
+            for key in self.keys:
+                key.roll_windows(now)
+                for status_code, count in sorted(key.responses.items()):
+                    responses.add_metric([key.name, str(status_code)], count)
+                calls.add_metric([key.name, "minute"], key.minute_calls)
+                calls.add_metric([key.name, "day"], key.day_calls)
+                available.add_metric([key.name], 1 if key.available_at(now) <= now else 0)
+
+        yield responses
+        yield calls
+        yield available
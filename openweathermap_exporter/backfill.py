@@ -0,0 +1,207 @@
+"""
+    backfill.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import argparse
+import re
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from math import ceil
+from os import makedirs, path
+from tempfile import SpooledTemporaryFile
+from typing import Iterable, Iterator, Optional
+
+from openweathermap import (
+    AirPollutionInformation, Coordinate, GeocodingMiss, OpenWeatherMap, OpenWeatherMapLocation
+)
+from openmeteo import OpenMeteo, OpenMeteoAirQualityForecast, OpenMeteoLocation
+from config import (
+    configure_transport, get_api_key_pool, get_label_set, get_open_meteo_options, load_config
+)
+from location_sources import iter_location_configs
+from metrics import (
+    AIR_POLLUTION_METRICS, OPEN_METEO_AIR_QUALITY_METRICS, LabelSet, config_location_id,
+    family_header, format_labels
+)
+
+# Open-Meteo provides at most 92 past days
+MAX_OPEN_METEO_PAST_DAYS: int = 92
+
+# Lines of a metric family kept in memory before they are spooled to a temporary file, about
+# a week of hourly samples
+SPOOL_MAX_BYTES: int = 64 * 1024
+
+def iter_air_pollution_openmetrics(
+    labels: dict,
+    history: Iterable[AirPollutionInformation]
+    ) -> Iterator[str]:
+    """Generate OpenMetrics lines with timestamps for an air pollution history of one location.
+
+    Samples of one metric family must not be interleaved with other families. The history is
+    read once, as it is streamed per chunk, and the lines of every family are spooled to a
+    temporary file beyond SPOOL_MAX_BYTES. So at most one chunk and SPOOL_MAX_BYTES per family
+    are held in memory, however long the backfilled period is.
+
+    Missing values are skipped instead of written as None.
+    """
+
+    label_str = format_labels(labels)
+
+    with ExitStack() as stack:
+        spools = [
+            stack.enter_context(SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+"))
+            for _ in AIR_POLLUTION_METRICS
+        ]
+        for row in history:
+            timestamp = int(row.timestamp.timestamp())
+            for spec, val, spool in zip(AIR_POLLUTION_METRICS, row.values, spools):
+                if val is not None:
+                    spool.write(f"{spec.name}{label_str} {val} {timestamp}\n")
+
+        for spec, spool in zip(AIR_POLLUTION_METRICS, spools):
+            yield from family_header(spec)
+            spool.seek(0)
+            yield from spool
+
+def iter_open_meteo_openmetrics(
+    labels: dict,
+    forecast: OpenMeteoAirQualityForecast,
+    start: datetime,
+    end: datetime
+    ) -> Iterator[str]:
+    """Generate OpenMetrics lines with timestamps for the Open-Meteo hourly values between start
+    and end.
+
+    Missing values are skipped instead of written as 0.
+    """
+
+    label_str = format_labels(labels)
+    start_epoch = start.timestamp()
+    end_epoch = end.timestamp()
+    indices = [i for i in range(len(forecast.timestamps))
+               if start_epoch <= forecast.epoch_at(i) <= end_epoch]
+
+    for spec in OPEN_METEO_AIR_QUALITY_METRICS:
+        values = forecast.air_quality_values[spec.attr]
+        if not values:
+            continue
+        yield from family_header(spec)
+        for i in indices:
+            if values[i] is not None:
+                yield f"{spec.name}{label_str} {values[i]} {int(forecast.epoch_at(i))}\n"
+
+def iter_location_backfill(
+    owml: OpenWeatherMapLocation,
+    oml: Optional[OpenMeteoLocation],
+    start: datetime,
+    end: datetime,
+    label_set: Optional[LabelSet] = None
+    ) -> Iterator[str]:
+    """Generate the backfill of one location as the lines of a complete OpenMetrics file.
+
+    label_set must be equal to the labels of the live exporter."""
+
+    if label_set is None:
+        label_set = LabelSet()
+
+    history = owml.owm.iter_air_pollution_history(owml.coord, start, end)
+    labels = label_set.labels(owml)
+    yield from iter_air_pollution_openmetrics(labels, history)
+
+    if oml is not None:
+        past_days = min(ceil((datetime.now() - start) / timedelta(days=1)),
+                        MAX_OPEN_METEO_PAST_DAYS)
+        forecast = oml.om.get_air_quality(oml.coord, oml.variables,
+                                          forecast_days=1, past_days=past_days)
+        labels = label_set.labels(oml)
+        yield from iter_open_meteo_openmetrics(labels, forecast, start, end)
+
+    yield "# EOF\n"
+
+def backfill_filename(location_id: str, coord: Coordinate) -> str:
+    """File name of the backfill of a location.
+
+    The coordinate is part of the name, so places with the same name in one country do not
+    overwrite each other's file."""
+
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{location_id}_{coord.lat}_{coord.lon}") + ".om"
+
+def main() -> None:
+    """Write the air pollution history of all configured locations as OpenMetrics files.
+
+    Every location is written to its own file, which can be imported with
+    `promtool tsdb create-blocks-from openmetrics <file> <data directory>`.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Backfill missed air pollution data as OpenMetrics files.")
+    parser.add_argument("--output-dir", required=True,
+                        help="directory to write the OpenMetrics files to")
+    parser.add_argument("--hours", type=int, default=24,
+                        help="number of hours to backfill, default 24")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+                        help="backfill since this ISO 8601 datetime instead of --hours")
+    args = parser.parse_args()
+
+    end = datetime.now().replace(minute=0, second=0, microsecond=0)
+    start: datetime = args.since if args.since is not None else end - timedelta(hours=args.hours)
+
+    config = load_config()
+    configure_transport(config)
+    owm = OpenWeatherMap(get_api_key_pool(config))
+    om: Optional[OpenMeteo] = None
+    if config["prometheus_exporter"].get("open_meteo_additional_data", False):
+        om = OpenMeteo()
+
+    label_set = get_label_set(config)
+    makedirs(args.output_dir, exist_ok=True)
+
+    location_ids: set[str] = set()
+    for conf_location in iter_location_configs(config):
+        label_set.require_location_id(conf_location, location_ids)
+        kwargs = {"location_name": conf_location["name"], "country_code": conf_location["cc"],
+                  "location_id": conf_location.get("location_id")}
+        if "lat" in conf_location and "lon" in conf_location:
+            kwargs["lat"] = conf_location["lat"]
+            kwargs["lon"] = conf_location["lon"]
+
+        try:
+            owml = OpenWeatherMapLocation(owm, **kwargs)
+        except GeocodingMiss as exc:
+            print(f"Skipping location, {exc}")
+            continue
+        # Use the same coordinate for Open-Meteo as the live exporter does
+        kwargs["lat"], kwargs["lon"] = owml.coord.lat, owml.coord.lon
+        oml: Optional[OpenMeteoLocation] = None
+        if om is not None:
+            oml = OpenMeteoLocation(om, **kwargs, **get_open_meteo_options(config, conf_location))
+
+        filename = path.join(args.output_dir,
+                             backfill_filename(config_location_id(conf_location), owml.coord))
+        print(f"Writing backfill of {conf_location['name']} to {filename}")
+        with open(filename, 'w') as f:
+            f.writelines(iter_location_backfill(owml, oml, start, end, label_set))
+
+if __name__ == "__main__":
+    main()
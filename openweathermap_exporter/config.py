@@ -0,0 +1,197 @@
+"""
+    config.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import atexit
+import sys
+from os import environ
+from typing import Optional
+
+from api_keys import ApiKey, ApiKeyPool
+from metrics import LabelSet
+from openweathermap import WEATHER_BACKENDS
+from transport import RecordingTransport, ReplayTransport, set_transport
+
+OPEN_METEO_OPTIONS: list[str] = ["variables", "forecast_days", "past_days"]
+
+# Options of the probe section, passed to probe.Prober
+PROBE_OPTIONS: list[str] = ["cache_size", "ttl", "coordinate_precision"]
+
+def load_config(config_filepath: Optional[str] = None) -> dict:
+    """Read the YAML configuration file.
+
+    If no path is given, the OPENWEATHERMAP_EXPORTER_CONFIGURATION_FILE environment
+    variable is used, falling back to openweathermap_exporter.yml.
+    """
+
+    if config_filepath is None:
+        try:
+            config_filepath = environ["OPENWEATHERMAP_EXPORTER_CONFIGURATION_FILE"]
+        except KeyError:
+            config_filepath = "openweathermap_exporter.yml"
+    print(f"Reading config from {config_filepath}")
+
+    # Imported here, like requests, so importing the exporter modules does not load PyYAML
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    # Prefer the much faster LibYAML based loader when PyYAML is built with it
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(config_filepath, 'r') as f:
+        return yaml.load(f, Loader=loader)
+
+def get_api_key(config: dict) -> str:
+    """Get the OpenWeatherMap API key from the configuration or the environment, or exit."""
+
+    try:
+        return config["owm"]["api_key"]
+    except (KeyError, TypeError):
+        try:
+            return environ["OPENWEATHERMAP_API_KEY"]
+        except KeyError:
+            sys.exit("Fatal error: no OpenWeatherMap API key provided."
+            " Please set the environment variable OPENWEATHERMAP_API_KEY or provide the API key"
+            " via the configuration file.")
+
+def get_api_key_pool(config: dict) -> ApiKeyPool:
+    """Get the pool of OpenWeatherMap API keys.
+
+    The keys are listed under api_keys in the owm section, each with a key, name and optional
+    calls_per_minute and calls_per_day quota. Without api_keys, the single key of get_api_key is
+    used with the calls_per_minute and calls_per_day of the owm section.
+    """
+
+    owm_config: dict = {}
+    try:
+        owm_config = config["owm"] or {}
+    except KeyError:
+        pass
+
+    max_wait = owm_config.get("max_key_wait", 60)
+    try:
+        conf_keys = owm_config["api_keys"]
+    except KeyError:
+        return ApiKeyPool([ApiKey(get_api_key(config),
+                                  calls_per_minute=owm_config.get("calls_per_minute"),
+                                  calls_per_day=owm_config.get("calls_per_day"))], max_wait)
+
+    keys = [
+        ApiKey(conf_key["key"], name=conf_key.get("name", f"key{i}"),
+               calls_per_minute=conf_key.get("calls_per_minute"),
+               calls_per_day=conf_key.get("calls_per_day"))
+        for i, conf_key in enumerate(conf_keys)
+    ]
+    return ApiKeyPool(keys, max_wait)
+
+def get_label_set(config: dict) -> LabelSet:
+    """Labels of the location series from the labels and coordinate_precision options."""
+
+    names: Optional[list[str]] = None
+    try:
+        names = config["prometheus_exporter"]["labels"]
+    except KeyError:
+        pass
+
+    coordinate_precision: Optional[int] = None
+    try:
+        coordinate_precision = config["prometheus_exporter"]["coordinate_precision"]
+    except KeyError:
+        pass
+
+    return LabelSet(names, coordinate_precision)
+
+def get_probe_options(config: dict) -> Optional[dict]:
+    """Options of the /probe endpoint, or None if there is no probe section.
+
+    An empty probe section enables the endpoint with the default options.
+    """
+
+    try:
+        probe_config = config["prometheus_exporter"]["probe"]
+    except KeyError:
+        return None
+
+    if probe_config is None:
+        return {}
+    if not isinstance(probe_config, dict):
+        raise ValueError(f"probe must be a mapping with the options {PROBE_OPTIONS}")
+    for option in probe_config:
+        if option not in PROBE_OPTIONS:
+            raise ValueError(f"Unknown probe option {option}, expected one of {PROBE_OPTIONS}")
+    return probe_config
+
+def configure_transport(config: dict) -> None:
+    """Record or replay the API requests if the transport option sets record or replay."""
+
+    try:
+        transport_config = config["prometheus_exporter"]["transport"]
+    except KeyError:
+        return
+
+    if "replay" in transport_config:
+        set_transport(ReplayTransport(transport_config["replay"],
+                                      transport_config.get("latency_scale", 1.0)))
+        print(f"transport: replaying {transport_config['replay']}")
+    elif "record" in transport_config:
+        recorder = RecordingTransport(transport_config["record"],
+                                      flush_records=transport_config.get("flush_records", 100),
+                                      flush_interval=transport_config.get("flush_interval", 60))
+        # Write the requests since the last flush and the end of the gzip stream at exit
+        atexit.register(recorder.close)
+        set_transport(recorder)
+        print(f"transport: recording to {transport_config['record']}")
+
+def get_weather_backend(config: dict, conf_location: dict) -> str:
+    """Weather backend of a location, set per location or globally with weather_backend."""
+
+    try:
+        weather_backend = conf_location["weather_backend"]
+    except KeyError:
+        try:
+            weather_backend = config["prometheus_exporter"]["weather_backend"]
+        except KeyError:
+            weather_backend = "owm"
+
+    if weather_backend not in WEATHER_BACKENDS:
+        raise ValueError(
+            f"Unknown weather_backend {weather_backend}, expected one of {WEATHER_BACKENDS}")
+    return weather_backend
+
+def get_open_meteo_options(config: dict, conf_location: dict) -> dict:
+    """Open-Meteo options for a location.
+
+    variables, forecast_days and past_days can be set globally as open_meteo_<option>
+    in the prometheus_exporter section and overridden per location.
+    """
+
+    open_meteo_options: dict = {}
+    for option in OPEN_METEO_OPTIONS:
+        try:
+            open_meteo_options[option] = conf_location[f"open_meteo_{option}"]
+        except KeyError:
+            try:
+                open_meteo_options[option] = config["prometheus_exporter"][f"open_meteo_{option}"]
+            except KeyError:
+                pass
+
+    return open_meteo_options
@@ -0,0 +1,247 @@
+"""
+    derived.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import json
+import os
+from math import exp, log, sqrt
+from time import time
+from typing import Optional
+
+from metrics import DERIVED_WEATHER_METRICS, GaugeSet, presence_bitmap
+from openweathermap import WeatherInformation
+
+DERIVED_WEATHER_ATTRS: list[str] = [spec.attr for spec in DERIVED_WEATHER_METRICS]
+
+# Magnus formula coefficients over water (Alduchov and Eskridge, 1996)
+MAGNUS_A = 17.625
+MAGNUS_B = 243.04
+
+# Longest interval between two observations over which precipitation is integrated. Over longer
+# gaps, for example when the exporter was stopped, the precipitation is unknown and not added.
+MAX_INTEGRATION_SECONDS = 3 * 3600
+
+# Totals without an observation for this long are dropped, the day they belong to is over
+MAX_STATE_AGE_SECONDS = 2 * 86400
+
+def dew_point(temp: float, humidity: float) -> Optional[float]:
+    """Dew point in degrees Celcius using the Magnus formula."""
+
+    if humidity <= 0:
+        return None
+    gamma = log(humidity / 100) + MAGNUS_A * temp / (MAGNUS_B + temp)
+    return MAGNUS_B * gamma / (MAGNUS_A - gamma)
+
+def heat_index(temp: float, humidity: float) -> float:
+    """Heat index in degrees Celcius using the algorithm of the US National Weather Service.
+
+    https://www.wpc.ncep.noaa.gov/html/heatindex_equation.shtml
+    """
+
+    temp_f = temp * 9 / 5 + 32
+    index = 0.5 * (temp_f + 61 + (temp_f - 68) * 1.2 + humidity * 0.094)
+
+    if (index + temp_f) / 2 >= 80:
+        index = (-42.379 + 2.04901523 * temp_f + 10.14333127 * humidity
+                 - 0.22475541 * temp_f * humidity - 0.00683783 * temp_f * temp_f
+                 - 0.05481717 * humidity * humidity + 0.00122874 * temp_f * temp_f * humidity
+                 + 0.00085282 * temp_f * humidity * humidity
+                 - 0.00000199 * temp_f * temp_f * humidity * humidity)
+        if humidity < 13 and 80 <= temp_f <= 112:
+            index -= (13 - humidity) / 4 * sqrt((17 - abs(temp_f - 95)) / 17)
+        elif humidity > 85 and 80 <= temp_f <= 87:
+            index += (humidity - 85) / 10 * (87 - temp_f) / 5
+
+    return (index - 32) * 5 / 9
+
+def wind_chill(temp: float, wind_speed: float) -> float:
+    """Wind chill temperature in degrees Celcius using the North American and UK formula.
+
+    Wind chill is only defined for temperatures up to 10 degrees and wind speeds above 4.8 km/h,
+    otherwise the temperature is returned.
+    """
+
+    wind_kmh = wind_speed * 3.6
+    if temp > 10 or wind_kmh <= 4.8:
+        return temp
+    factor = wind_kmh ** 0.16
+    return 13.12 + 0.6215 * temp - 11.37 * factor + 0.3965 * temp * factor
+
+def absolute_humidity(temp: float, humidity: float) -> float:
+    """Absolute humidity in g/m3 from the temperature in degrees Celcius and relative humidity."""
+
+    saturation_pressure = 6.112 * exp(17.67 * temp / (temp + 243.5))
+    return saturation_pressure * humidity * 2.1674 / (273.15 + temp)
+
+class DailyPrecipitation:
+    """Running totals of precipitation since local midnight per location.
+
+    The 1 hour rain and snow volumes are used as a rate in mm/h and integrated over the time
+    between observations with the trapezoidal rule. At local midnight the total is reset. The
+    totals are saved to state_file, so they survive a restart of the exporter.
+    """
+
+    state_file: Optional[str]
+    # Per location: local day number, total in mm, timestamp and rate of the last observation
+    totals: dict[str, dict]
+
+    def __init__(self, state_file: Optional[str] = None):
+        self.state_file = state_file
+        self.totals = {}
+
+        if state_file is not None and os.path.exists(state_file):
+            with open(state_file, encoding="utf-8") as f:
+                self.totals = json.load(f)
+
+    def update(self, key: str, timestamp: int, utc_offset_seconds: int, rate: float) -> float:
+        """Add the precipitation up to the observation at timestamp.
+
+        Returns the total of the day."""
+
+        day = (timestamp + utc_offset_seconds) // 86400
+        prev = self.totals.get(key)
+        if prev is not None and timestamp <= prev["timestamp"]:
+            return prev["total"]
+
+        total = 0.0
+        if prev is not None and prev["day"] == day:
+            total = prev["total"]
+
+        if prev is not None and timestamp - prev["timestamp"] <= MAX_INTEGRATION_SECONDS:
+            # Only the part after midnight counts for a new day
+            midnight = day * 86400 - utc_offset_seconds
+            start = max(prev["timestamp"], midnight)
+            total += (prev["rate"] + rate) / 2 * (timestamp - start) / 3600
+
+        self.totals[key] = {"day": day, "total": total, "timestamp": timestamp, "rate": rate}
+        return total
+
+    def forget(self, key: str) -> None:
+        """Drop the total of a location which is no longer exported."""
+        self.totals.pop(key, None)
+
+    def prune(self, now: float) -> None:
+        """Drop the totals of locations without an observation in MAX_STATE_AGE_SECONDS before now.
+
+        These can be left in the state file by locations which were removed while the exporter was
+        stopped.
+        """
+
+        expired = [
+            key for key, total in self.totals.items()
+            if now - total["timestamp"] > MAX_STATE_AGE_SECONDS
+        ]
+        for key in expired:
+            del self.totals[key]
+
+    def save(self) -> None:
+        """Atomically write the totals to the state file."""
+
+        if self.state_file is None:
+            return
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.totals, f)
+        os.replace(tmp_file, self.state_file)
+
+class DerivedWeatherMetrics:
+    """Gauges for metrics derived from the weather of all locations during each refresh."""
+
+    metrics: list[str]
+    gauges: GaugeSet
+    precipitation: Optional[DailyPrecipitation]
+
+    def __init__(
+        self,
+        conf: dict,
+        missing_values: str = "zero",
+        labelnames: Optional[list[str]] = None
+        ):
+        """Create the derived gauges from the derived_metrics configuration section.
+
+        Accepted keys:
+        metrics: list[str], defaults to all derived metrics
+        state_file: str, file to keep the daily precipitation totals in, defaults to only in memory
+
+        missing_values is the mode for missing values, see GaugeSet, and labelnames the labels of a
+        location.
+        """
+        self.metrics = conf.get("metrics", DERIVED_WEATHER_ATTRS)
+        for metric in self.metrics:
+            if metric not in DERIVED_WEATHER_ATTRS:
+                raise ValueError(f"Unknown derived metric: {metric}")
+
+        self.gauges = GaugeSet(
+            DERIVED_WEATHER_METRICS, labelnames, set(self.metrics), missing_values)
+
+        self.precipitation = None
+        if "precipitation_today" in self.metrics:
+            self.precipitation = DailyPrecipitation(conf.get("state_file"))
+
+    def compute(self, keys: list[str], weathers: list[WeatherInformation]) -> list[tuple]:
+        """Derived values in the order of DERIVED_WEATHER_METRICS for every weather.
+
+        Every metric is computed as a column over all locations at once.
+        """
+
+        temps = [w.temp for w in weathers]
+        humidities = [w.humidity for w in weathers]
+        wind_speeds = [w.wind_speed for w in weathers]
+
+        columns: list[list] = [
+            list(map(dew_point, temps, humidities)),
+            list(map(heat_index, temps, humidities)),
+            list(map(wind_chill, temps, wind_speeds)),
+            list(map(absolute_humidity, temps, humidities)),
+            [None] * len(weathers)
+        ]
+        if self.precipitation is not None:
+            columns[4] = [
+                self.precipitation.update(key, int(w.timestamp.timestamp()), w.utc_offset_seconds,
+                                          w.rain_volume_1h + w.snow_volume_1h)
+                for key, w in zip(keys, weathers)
+            ]
+            self.precipitation.prune(time())
+            self.precipitation.save()
+
+        return list(zip(*columns))
+
+    @staticmethod
+    def state_key(labelvalues: tuple) -> str:
+        """Key of the daily precipitation total of the location with labelvalues."""
+        return "|".join(str(v) for v in labelvalues)
+
+    def set_metrics(self, labelvalues: list[tuple], weathers: list[WeatherInformation]) -> None:
+        """Set the derived metrics of the locations with labelvalues to their newest value."""
+
+        keys = [self.state_key(values) for values in labelvalues]
+        for values, row in zip(labelvalues, self.compute(keys, weathers)):
+            self.gauges.set(row, presence_bitmap(row), values)
+
+    def remove(self, labelvalues: tuple) -> None:
+        """Remove the series and state of the location with labelvalues."""
+
+        self.gauges.remove(labelvalues)
+        if self.precipitation is not None:
+            self.precipitation.forget(self.state_key(labelvalues))
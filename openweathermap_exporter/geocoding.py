@@ -0,0 +1,129 @@
+"""
+    geocoding.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Callable, NamedTuple, Optional
+
+from openweathermap import Coordinate
+
+# Geocoding results are found, not found or an error when no provider could be reached
+GEOCODING_FOUND = "found"
+GEOCODING_NOT_FOUND = "not_found"
+GEOCODING_ERROR = "error"
+
+class GeocodingResult(NamedTuple):
+    """Result of geocoding a location, with the provider which found it."""
+    status: str
+    coord: Optional[Coordinate] = None
+    provider: Optional[str] = None
+
+class Geocoder:
+    """Geocode locations by trying providers in order, caching both hits and misses.
+
+    Misses are cached for miss_ttl seconds, so a location which can not be found costs one
+    call per provider per miss_ttl. Errors are transient, so they are cached for error_ttl
+    seconds, doubled for every consecutive error of a location up to miss_ttl. Hits are
+    cached for hit_ttl seconds, or as long as the geocoder exists if hit_ttl is None. At most
+    max_entries results are kept, the least recently used result is dropped first.
+    """
+
+    providers: list[tuple[str, Callable[[str, str], Optional[Coordinate]]]]
+    hit_ttl: Optional[float]
+    miss_ttl: float
+    error_ttl: float
+    max_entries: int
+    # (location name, country code) to the monotonic expiry time, result and number of
+    # consecutive errors, least recently used first
+    cache: OrderedDict[tuple[str, str], tuple[float, GeocodingResult, int]]
+    lock: Lock
+
+    def __init__(
+        self,
+        providers: list[tuple[str, Callable[[str, str], Optional[Coordinate]]]],
+        hit_ttl: Optional[float] = None,
+        miss_ttl: float = 3600,
+        max_entries: int = 10000,
+        error_ttl: float = 60
+        ):
+        """Create a geocoder with (name, geocode function) providers, in order of preference.
+
+        A geocode function returns None if the location is not found and raises on errors.
+        """
+        self.providers = providers
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.lock = Lock()
+
+    def geocode(self, location_name: str, country_code: str) -> GeocodingResult:
+        """Geocode a location with the first provider which finds it."""
+
+        key = (location_name, country_code)
+        now = monotonic()
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        result = GeocodingResult(GEOCODING_NOT_FOUND)
+        errors = 0
+        for name, geocode in self.providers:
+            try:
+                coord = geocode(location_name, country_code)
+            # Any failure of a provider falls through to the next one
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                print(f"Geocoding {location_name},{country_code} with {name} failed: {exc}")
+                errors += 1
+                continue
+            if coord is not None:
+                result = GeocodingResult(GEOCODING_FOUND, coord, name)
+                break
+        else:
+            if errors == len(self.providers):
+                result = GeocodingResult(GEOCODING_ERROR)
+
+        consecutive_errors = 0
+        ttl = self.miss_ttl
+        if result.status == GEOCODING_FOUND:
+            ttl = float("inf") if self.hit_ttl is None else self.hit_ttl
+        elif result.status == GEOCODING_ERROR:
+            # Back off exponentially while the providers can not be reached
+            if cached is not None and cached[1].status == GEOCODING_ERROR:
+                consecutive_errors = cached[2]
+            consecutive_errors += 1
+            ttl = min(self.error_ttl * 2 ** (consecutive_errors - 1), self.miss_ttl)
+        with self.lock:
+            self.cache[key] = (now + ttl, result, consecutive_errors)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+        return result
@@ -0,0 +1,91 @@
+"""
+    lifecycle.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import sys
+from typing import Callable, Iterable, Iterator
+
+from prometheus_client.core import GaugeMetricFamily, Metric
+
+from location_sources import location_key
+
+STATE_ENTRIES_HELP: str = "Number of entries in the location state and caches"
+
+def swap_remove(items: list, index: int) -> None:
+    """Remove items[index] by moving the last item into its place.
+
+    This keeps the lists of locations in the same order as RegionalAggregates.remove_location.
+    """
+
+    items[index] = items[-1]
+    items.pop()
+
+def diff_locations(
+    current_keys: Iterable[tuple],
+    configs: list[dict]
+    ) -> tuple[list[dict], set[tuple]]:
+    """Compare the keys of the current locations with reloaded location configurations.
+
+    Returns the configurations of new locations and the keys of removed locations.
+    """
+
+    current = set(current_keys)
+    reloaded = {location_key(conf_location) for conf_location in configs}
+    added = [
+        conf_location for conf_location in configs if location_key(conf_location) not in current
+    ]
+    return added, current - reloaded
+
+class LifecycleCollector:
+    """Export the number of entries in the location state and caches of the exporter.
+
+    Together with process_resident_memory_bytes of the default process collector, this
+    shows which part of the state grows when the memory use of the exporter grows.
+    """
+
+    sizes: list[tuple[str, Callable[[], int]]]
+
+    def __init__(self):
+        self.sizes = []
+
+    def add(self, component: str, size: Callable[[], int]) -> None:
+        """Export size() as the number of entries of component."""
+        self.sizes.append((component, size))
+
+    def describe(self) -> Iterator[Metric]:
+        """Families without samples, to check for duplicate names when registering."""
+        yield GaugeMetricFamily("exporter_state_entries", STATE_ENTRIES_HELP, labels=["component"])
+        yield GaugeMetricFamily("exporter_python_allocated_blocks",
+                                "Number of memory blocks allocated by the Python interpreter")
+
+    def collect(self) -> Iterator[Metric]:
+        """Current number of entries per component and allocated memory blocks."""
+        entries = GaugeMetricFamily("exporter_state_entries", STATE_ENTRIES_HELP,
+                                    labels=["component"])
+        for component, size in self.sizes:
+            entries.add_metric([component], size())
+        yield entries
+        yield GaugeMetricFamily("exporter_python_allocated_blocks",
+                                "Number of memory blocks allocated by the Python interpreter",
+                                value=sys.getallocatedblocks())
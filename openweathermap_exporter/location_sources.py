@@ -0,0 +1,174 @@
+"""
+    location_sources.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import csv
+import json
+import re
+from typing import Iterator, Optional, TextIO
+
+# Whitespace and separators between the items of a JSON array
+ARRAY_SEPARATOR = re.compile(r"[\s,]*")
+
+def iter_json_array_items(f: TextIO, key: str, chunk_size: int = 65536) -> Iterator[dict]:
+    """Decode the objects in the array under key in a JSON document one at a time.
+
+    Only the current chunk of the file is held in memory. The first occurrence of key
+    is assumed to be the array, which holds for the "features" of a GeoJSON FeatureCollection.
+    """
+
+    decoder = json.JSONDecoder()
+    marker = f'"{key}"'
+
+    buf = ""
+    while True:
+        start = buf.find(marker)
+        if start >= 0:
+            bracket = buf.find("[", start)
+            if bracket >= 0:
+                buf = buf[bracket + 1:]
+                break
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        buf += chunk
+
+    pos = 0
+    while True:
+        pos = ARRAY_SEPARATOR.match(buf, pos).end()  # type: ignore[union-attr]
+        if buf.startswith("]", pos):
+            return
+        try:
+            obj, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield obj
+
+def iter_geojson_locations(f: TextIO) -> Iterator[dict]:
+    """Locations from the Point features of a GeoJSON FeatureCollection.
+
+    The name, cc (or country_code) and optional id are taken from the feature properties.
+    Malformed features are skipped with a warning.
+    """
+
+    for feature in iter_json_array_items(f, "features"):
+        try:
+            geometry = feature.get("geometry") or {}
+            properties = feature.get("properties") or {}
+            if geometry.get("type") != "Point":
+                continue
+            lon, lat = geometry["coordinates"][:2]
+        except (AttributeError, KeyError, TypeError, ValueError):
+            print(f"Skipping invalid location {feature}")
+            continue
+        yield {
+            "name": properties.get("name"),
+            "cc": properties.get("cc", properties.get("country_code")),
+            "lat": lat,
+            "lon": lon,
+            "id": properties.get("id")
+        }
+
+def iter_csv_locations(f: TextIO) -> Iterator[dict]:
+    """Locations from a CSV file with a header row with name, cc, lat, lon and optional id columns.
+
+    Empty lat and lon columns mean the location is geocoded by name. Rows with a lat, lon or id
+    which is not a number are skipped with a warning.
+    """
+
+    for row in csv.DictReader(f):
+        location: dict = {"name": row.get("name"), "cc": row.get("cc")}
+        try:
+            if row.get("lat") and row.get("lon"):
+                location["lat"] = float(row["lat"])
+                location["lon"] = float(row["lon"])
+            if row.get("id"):
+                location["id"] = int(row["id"])
+        except (KeyError, TypeError, ValueError):
+            print(f"Skipping invalid location {row}")
+            continue
+        yield location
+
+LOCATION_FILE_FORMATS = {
+    "csv": iter_csv_locations,
+    "geojson": iter_geojson_locations
+}
+
+def is_valid_location(location: dict) -> bool:
+    """Whether a location has a name and country code, and a coordinate within range if given."""
+
+    if not location.get("name") or not location.get("cc"):
+        return False
+    if "lat" in location or "lon" in location:
+        try:
+            return -90 <= location["lat"] <= 90 and -180 <= location["lon"] <= 180
+        except (KeyError, TypeError):
+            return False
+
+    return True
+
+def location_key(location: dict) -> tuple:
+    """Identity of a location configuration: its name, country code and coordinate if given."""
+    return (location["name"], location["cc"], location.get("lat"), location.get("lon"))
+
+def iter_location_file(path: str, file_format: Optional[str] = None) -> Iterator[dict]:
+    """Stream the locations in a CSV or GeoJSON file, the format defaults to the file extension."""
+
+    if file_format is None:
+        file_format = path.rsplit(".", 1)[-1].lower()
+        if file_format == "json":
+            file_format = "geojson"
+
+    with open(path, 'r', newline='') as f:
+        yield from LOCATION_FILE_FORMATS[file_format](f)
+
+def iter_location_configs(config: dict) -> Iterator[dict]:
+    """Stream all configured locations, both inline and from location_files.
+
+    Invalid locations are skipped with a warning and duplicates, with the same name,
+    country code and coordinate, are only returned once.
+    """
+
+    sources: list[Iterator[dict]] = [iter(config["prometheus_exporter"].get("locations") or [])]
+    for location_file in config["prometheus_exporter"].get("location_files") or []:
+        sources.append(iter_location_file(location_file["path"], location_file.get("format")))
+
+    seen: set[tuple] = set()
+    for source in sources:
+        for location in source:
+            if not is_valid_location(location):
+                print(f"Skipping invalid location {location}")
+                continue
+
+            key = location_key(location)
+            if key in seen:
+                continue
+            seen.add(key)
+
+            yield location
@@ -0,0 +1,560 @@
+"""
+    metrics.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import re
+from math import nan
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
+from prometheus_client import CollectorRegistry, Gauge
+from prometheus_client.core import GaugeMetricFamily, Metric
+
+class MetricSpec(NamedTuple):
+    """Declarative definition of one exported metric.
+
+    attr is the attribute of the parsed API response holding the value,
+    path the keys leading to the value in the JSON response and default
+    the value used when the value is missing from the response.
+    """
+    name: str
+    attr: str
+    path: tuple[str, ...]
+    unit: str
+    help: str
+    default: Optional[float] = None
+
+LABEL_NAMES: list[str] = ["latitude", "longitude", "location_country_code", "location_name"]
+
+# Labels which can be selected for the series of a location, see LabelSet
+LOCATION_LABEL_NAMES: list[str] = LABEL_NAMES + ["location_id"]
+
+EUROPEAN_AQI_HELP: str = ("European Air Quality Index (AQI) calculated for different particulate "
+    "matter and gases individually. "
+    "The consolidated european_aqi returns the maximum of all individual indices. "
+    "Ranges from 0-20 (good), 20-40 (fair), 40-60 (moderate), 60-80 (poor), 80-100 (very poor) "
+    "and exceeds 100 for extremely poor conditions.")
+
+WEATHER_METRICS: list[MetricSpec] = [
+    MetricSpec(
+        "weather_temp", "temp", ("main", "temp"), "celsius",
+        "Outside temperature in degrees Celcius provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "weather_temp_min", "temp_min", ("main", "temp_min"), "celsius",
+        "Outside minimum temperature in degrees Celcius provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "weather_temp_max", "temp_max", ("main", "temp_max"), "celsius",
+        "Outside maximum temperature in degrees Celcius provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "weather_temp_feels_like", "temp_feels_like", ("main", "feels_like"), "celsius",
+        ("Outside temperature adjusted to human perception in degrees Celcius provided by "
+        "OpenWeatherMap")
+    ),
+    MetricSpec(
+        "weather_pressure", "pressure", ("main", "pressure"), "hPa",
+        "Outside pressure in hPa provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "weather_humidity", "humidity", ("main", "humidity"), "percent",
+        "Outside relative humidity in % provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "weather_visibility", "visibility", ("visibility",), "meters",
+        ("Visibility in meters provided by OpenWeatherMap. "
+        "The maximum value of the visibility is 10km.")
+    ),
+    MetricSpec(
+        "weather_wind_speed", "wind_speed", ("wind", "speed"), "m/s",
+        "Outside wind speed in m/s provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "weather_wind_deg", "wind_deg", ("wind", "deg"), "degrees",
+        "Wind direction in degrees (meteorological) provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "weather_wind_gust", "wind_gust", ("wind", "gust"), "m/s",
+        "Wind gust in m/s"
+    ),
+    MetricSpec(
+        "weather_cloudiness", "cloudiness", ("clouds", "all"), "percent",
+        "Relative cloudiness in percentage provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "weather_rain_volume_1h", "rain_volume_1h", ("rain", "1h"), "mm",
+        "Rain volume for the last 1 hour in mm provided by OpenWeatherMap", 0
+    ),
+    MetricSpec(
+        "weather_rain_volume_3h", "rain_volume_3h", ("rain", "3h"), "mm",
+        "Rain volume for the last 3 hours in mm provided by OpenWeatherMap", 0
+    ),
+    MetricSpec(
+        "weather_snow_volume_1h", "snow_volume_1h", ("snow", "1h"), "mm",
+        "Snow volume for the last 1 hour in mm provided by OpenWeatherMap", 0
+    ),
+    MetricSpec(
+        "weather_snow_volume_3h", "snow_volume_3h", ("snow", "3h"), "mm",
+        "Snow volume for the last 3 hours in mm provided by OpenWeatherMap", 0
+    )
+]
+
+# Metrics derived from the weather values by the exporter, see derived.py. These are not
+# extracted from a response, so their path is empty.
+DERIVED_WEATHER_METRICS: list[MetricSpec] = [
+    MetricSpec(
+        "weather_dew_point", "dew_point", (), "celsius",
+        "Dew point in degrees Celcius computed from the OpenWeatherMap temperature and humidity"
+    ),
+    MetricSpec(
+        "weather_heat_index", "heat_index", (), "celsius",
+        "Heat index in degrees Celcius computed from the OpenWeatherMap temperature and humidity"
+    ),
+    MetricSpec(
+        "weather_wind_chill", "wind_chill", (), "celsius",
+        ("Wind chill temperature in degrees Celcius computed from the OpenWeatherMap temperature "
+        "and wind speed")
+    ),
+    MetricSpec(
+        "weather_absolute_humidity", "absolute_humidity", (), "g/m3",
+        "Absolute humidity in g/m3 computed from the OpenWeatherMap temperature and humidity"
+    ),
+    MetricSpec(
+        "weather_precipitation_today", "precipitation_today", (), "mm",
+        ("Rain and snow in mm since local midnight, integrated from the OpenWeatherMap "
+        "1 hour volumes")
+    )
+]
+
+# Paths are relative to the first entry of the list in the response
+AIR_POLLUTION_METRICS: list[MetricSpec] = [
+    MetricSpec(
+        "air_pollution_air_quality_index", "air_quality_index", ("main", "aqi"), "",
+        ("Air Quality Index provided by OpenWeatherMap. Possible values are: 1, 2, 3, 4, 5. "
+        "Where 1 = Good, 2 = Fair, 3 = Moderate, 4 = Poor, 5 = Very Poor.")
+    ),
+    MetricSpec(
+        "air_pollution_co", "co", ("components", "co"), "μg/m³",
+        "Concentration of CO (carbon monoxide) in μg/m3 provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "air_pollution_no", "no", ("components", "no"), "μg/m³",
+        "Concentration of NO (nitrogen monoxide) in μg/m3 provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "air_pollution_no2", "no2", ("components", "no2"), "μg/m³",
+        "Concentration of NO2 (nitrogen dioxide) in μg/m3 provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "air_pollution_o3", "o3", ("components", "o3"), "μg/m³",
+        "Concentration of O3 (ozone) in μg/m3 provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "air_pollution_so2", "so2", ("components", "so2"), "μg/m³",
+        "Concentration of SO2 (sulphur dioxide) in μg/m3 provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "air_pollution_pm2_5", "pm2_5", ("components", "pm2_5"), "μg/m³",
+        "Concentration of PM2.5 (fine particulate matter) in μg/m3 provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "air_pollution_pm10", "pm10", ("components", "pm10"), "μg/m³",
+        "Concentration of PM10 (coarse particulate matter) in μg/m3 provided by OpenWeatherMap"
+    ),
+    MetricSpec(
+        "air_pollution_nh3", "nh3", ("components", "nh3"), "μg/m³",
+        "Concentration of NH3 (ammonia) in μg/m3 provided by OpenWeatherMap"
+    )
+]
+
+OPEN_METEO_AIR_QUALITY_METRICS: list[MetricSpec] = [
+    MetricSpec(
+        "open_meteo_air_quality_pm10", "pm10", ("hourly", "pm10"), "μg/m³",
+        ("Particulate matter with diameter smaller than 10 µm (PM10) close to surface "
+        "(10 meter above ground) in μg/m³.")
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_pm2_5", "pm2_5", ("hourly", "pm2_5"), "μg/m³",
+        ("Particulate matter with diameter smaller than 2.5 µm (PM2.5) close to surface "
+        "(10 meter above ground) in μg/m³")
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_co", "co", ("hourly", "carbon_monoxide"), "μg/m³",
+        "Carbon monoxide concentration in μg/m³ close to the surface (10 meter above ground)"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_no2", "no2", ("hourly", "nitrogen_dioxide"), "μg/m³",
+        "Nitrogen dioxide concentration in μg/m³ close to the surface (10 meter above ground)"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_so2", "so2", ("hourly", "sulphur_dioxide"), "μg/m³",
+        "Sulphur dioxide concentration in μg/m³ close to the surface (10 meter above ground)"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_o3", "o3", ("hourly", "ozone"), "μg/m³",
+        "Ozone concentration in μg/m³ close to the surface (10 meter above ground)"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_nh3", "nh3", ("hourly", "ammonia"), "μg/m³",
+        "Ammonia concentration in μg/m³ close to the surface (10 meter above ground)"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_aerosol_optical_depth", "aerosol_optical_depth",
+        ("hourly", "aerosol_optical_depth"), "",
+        "Aerosol optical depth at 550 nm of the entire atmosphere to indicate haze."
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_dust", "dust", ("hourly", "dust"), "μg/m³",
+        "Saharan dust particles close to surface level (10 meter above ground) in μg/m³."
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_uv_index", "uv_index", ("hourly", "uv_index"), "",
+        "UV index considering clouds, conforming to the WHO definition"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_uv_index_clear_sky", "uv_index_clear_sky",
+        ("hourly", "uv_index_clear_sky"), "",
+        "UV index considering clear sky, conforming to the WHO definition"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_alder_pollen", "alder_pollen",
+        ("hourly", "alder_pollen"), "grains/m³",
+        "Alder pollen concentration in grains/m³"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_birch_pollen", "birch_pollen",
+        ("hourly", "birch_pollen"), "grains/m³",
+        "Birch pollen concentration in grains/m³"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_grass_pollen", "grass_pollen",
+        ("hourly", "grass_pollen"), "grains/m³",
+        "Grass pollen concentration in grains/m³"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_mugwort_pollen", "mugwort_pollen",
+        ("hourly", "mugwort_pollen"), "grains/m³",
+        "Mugwort pollen concentration in grains/m³"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_olive_pollen", "olive_pollen",
+        ("hourly", "olive_pollen"), "grains/m³",
+        "Olive pollen concentration in grains/m³"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_ragweed_pollen", "ragweed_pollen",
+        ("hourly", "ragweed_pollen"), "grains/m³",
+        "Ragweed pollen concentration in grains/m³"
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_european_aqi", "european_aqi", ("hourly", "european_aqi"), "",
+        EUROPEAN_AQI_HELP
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_european_aqi_pm2_5", "european_aqi_pm2_5",
+        ("hourly", "european_aqi_pm2_5"), "",
+        EUROPEAN_AQI_HELP
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_european_aqi_pm10", "european_aqi_pm10",
+        ("hourly", "european_aqi_pm10"), "",
+        EUROPEAN_AQI_HELP
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_european_aqi_no2", "european_aqi_no2",
+        ("hourly", "european_aqi_no2"), "",
+        EUROPEAN_AQI_HELP
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_european_aqi_o3", "european_aqi_o3",
+        ("hourly", "european_aqi_o3"), "",
+        EUROPEAN_AQI_HELP
+    ),
+    MetricSpec(
+        "open_meteo_air_quality_european_aqi_so2", "european_aqi_so2",
+        ("hourly", "european_aqi_so2"), "",
+        EUROPEAN_AQI_HELP
+    )
+]
+
+# Marker to use the default of each spec in compile_extractor
+SPEC_DEFAULT: Any = object()
+
+EMPTY: dict = {}
+
+def compile_extractor(
+    specs: list[MetricSpec],
+    default: Any = SPEC_DEFAULT
+    ) -> Callable[[dict], tuple]:
+    """Generate a function extracting the values of all specs from a JSON response in one pass.
+
+    The returned function gives a tuple of values in the order of specs. Objects shared by
+    several paths are looked up once and missing keys give the default of the spec, or default
+    if given, without raising exceptions.
+    """
+
+    lines = ["def extract(obj, d=d, EMPTY=EMPTY):"]
+    variables: dict[tuple[str, ...], str] = {(): "obj"}
+    for spec in specs:
+        for depth in range(1, len(spec.path)):
+            prefix = spec.path[:depth]
+            if prefix not in variables:
+                variables[prefix] = f"_{len(variables)}"
+                parent = variables[prefix[:-1]]
+                lines.append(f"    {variables[prefix]} = {parent}.get({prefix[-1]!r}) or EMPTY")
+
+    values = [
+        f"{variables[spec.path[:-1]]}.get({spec.path[-1]!r}, d[{i}])"
+        for i, spec in enumerate(specs)
+    ]
+    lines.append(f"    return ({', '.join(values)},)")
+
+    defaults = tuple(spec.default if default is SPEC_DEFAULT else default for spec in specs)
+    namespace: dict[str, Any] = {"d": defaults, "EMPTY": EMPTY}
+    exec("\n".join(lines), namespace)  # pylint: disable=exec-used
+
+    return namespace["extract"]
+
+def format_labels(labels: dict) -> str:
+    """Format a label set in the Prometheus and OpenMetrics text formats."""
+
+    escaped = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+
+    return "{" + ",".join(escaped) + "}"
+
+def family_header(spec: MetricSpec) -> Iterator[str]:
+    """Generate the TYPE and HELP lines of a metric family."""
+
+    yield f"# TYPE {spec.name} gauge\n"
+    yield f"# HELP {spec.name} {spec.help}\n"
+
+def make_location_id(location_name: str, country_code: str) -> str:
+    """Stable identifier of a location, for example nl-formerum-terschelling."""
+    return re.sub(r"[^a-z0-9]+", "-", f"{country_code} {location_name}".lower()).strip("-")
+
+def config_location_id(conf_location: dict) -> str:
+    """location_id of a location configuration, the configured one or the default."""
+    return conf_location.get("location_id") or make_location_id(conf_location["name"],
+                                                                 conf_location["cc"])
+
+class LabelSet:
+    """The labels attached to the series of a location.
+
+    names is a selection of LOCATION_LABEL_NAMES. Coordinates are rounded to coordinate_precision
+    decimals, so that small differences in geocoding results do not create new series.
+    """
+
+    names: list[str]
+    coordinate_precision: Optional[int]
+
+    def __init__(
+        self,
+        names: Optional[list[str]] = None,
+        coordinate_precision: Optional[int] = None
+        ):
+        self.names = LABEL_NAMES if names is None else names
+        self.coordinate_precision = coordinate_precision
+
+        for name in self.names:
+            if name not in LOCATION_LABEL_NAMES:
+                raise ValueError(f"Unknown location label: {name}")
+
+    @property
+    def info_enabled(self) -> bool:
+        """Whether a location info series is needed to find the labels which are left out."""
+        return "location_id" in self.names and any(name not in self.names for name in LABEL_NAMES)
+
+    def claim_location_id(self, conf_location: dict, location_ids: set[str]) -> bool:
+        """Add the location_id of conf_location to location_ids, False if it is already in there.
+
+        The default location_id only differs by name and country code, so two places with the
+        same name in one country get the same series with location_id as a label. Without that
+        label, location ids are not checked and this is always True.
+        """
+
+        if "location_id" not in self.names:
+            return True
+
+        location_id = config_location_id(conf_location)
+        if location_id in location_ids:
+            return False
+        location_ids.add(location_id)
+        return True
+
+    def require_location_id(self, conf_location: dict, location_ids: set[str]) -> None:
+        """Claim the location_id of conf_location like claim_location_id, or raise ValueError if
+        it is already in location_ids."""
+
+        if not self.claim_location_id(conf_location, location_ids):
+            raise ValueError(f"Duplicate location_id {config_location_id(conf_location)} of "
+                             f"{conf_location['name']},{conf_location['cc']}, "
+                             "set a unique location_id for this location")
+
+    def all_labels(self, loc: Any) -> dict:
+        """Values of all LOCATION_LABEL_NAMES of loc."""
+
+        lat, lon = loc.coord.lat, loc.coord.lon
+        if self.coordinate_precision is not None:
+            lat, lon = round(lat, self.coordinate_precision), round(lon, self.coordinate_precision)
+
+        return {
+            "latitude": lat,
+            "longitude": lon,
+            "location_country_code": loc.country_code,
+            "location_name": loc.location_name,
+            "location_id": loc.location_id
+        }
+
+    def labels(self, loc: Any) -> dict:
+        """Selected labels of loc, in the order of names."""
+
+        all_labels = self.all_labels(loc)
+        return {name: all_labels[name] for name in self.names}
+
+    def values(self, loc: Any) -> tuple:
+        """Selected label values of loc, in the order of names."""
+        return tuple(self.labels(loc).values())
+
+def presence_bitmap(values: tuple) -> int:
+    """Bitmap with bit i set if values[i] is present."""
+    return sum(1 << i for i, val in enumerate(values) if val is not None)
+
+# How missing values are exported: as 0, as NaN or not at all
+MISSING_VALUES_MODES: list[str] = ["zero", "nan", "omit"]
+
+def set_or_omit(
+    gauge: Gauge,
+    labelvalues: tuple,
+    val: Optional[float],
+    missing_values: str
+    ) -> None:
+    """Set one series of gauge, handling a missing value according to missing_values."""
+
+    if val is not None:
+        gauge.labels(*labelvalues).set(val)
+    elif missing_values == "omit":
+        gauge.remove(*labelvalues)
+    else:
+        gauge.labels(*labelvalues).set(0 if missing_values == "zero" else nan)
+
+class GaugeSet:
+    """Gauge families of one spec table, built from the values tuples of parsed responses.
+
+    set() only stages the values of a label set. They become visible to scrapes when the
+    families are published in a snapshot, see SnapshotCollector. In omit mode, missing
+    values are left out of the families.
+    """
+
+    specs: list[tuple[MetricSpec, int, int]]
+    labelnames: list[str]
+    missing_values: str
+    # Label values to the values tuple and the bitmap of the values to export
+    rows: dict[tuple, tuple[tuple, int]]
+
+    def __init__(
+        self,
+        specs: list[MetricSpec],
+        labelnames: Optional[list[str]] = None,
+        attrs: Optional[set[str]] = None,
+        missing_values: str = "zero"
+        ):
+        """Create the gauge families of specs, or only those of attrs if given."""
+        if missing_values not in MISSING_VALUES_MODES:
+            raise ValueError(
+                f"missing_values must be one of {MISSING_VALUES_MODES}, got {missing_values}")
+
+        self.specs = [
+            (spec, index, 1 << index) for index, spec in enumerate(specs)
+            if attrs is None or spec.attr in attrs
+        ]
+        self.labelnames = LABEL_NAMES if labelnames is None else labelnames
+        self.missing_values = missing_values
+        self.rows = {}
+
+    def set(self, values: tuple, presence: int, labelvalues: tuple, mask: int = -1) -> None:
+        """Stage the values of the series with labelvalues of the gauges with their bit in mask."""
+
+        exported = presence & mask if self.missing_values == "omit" else mask
+        self.rows[tuple(map(str, labelvalues))] = (values, exported)
+
+    def remove(self, labelvalues: tuple) -> None:
+        """Remove the series with labelvalues from the next snapshot."""
+        self.rows.pop(tuple(map(str, labelvalues)), None)
+
+    def describe(self) -> Iterator[Metric]:
+        """Families without samples, to check for duplicate names when registering."""
+
+        for spec, _, _ in self.specs:
+            yield GaugeMetricFamily(spec.name, spec.help, labels=self.labelnames)
+
+    def families(self) -> Iterator[Metric]:
+        """Build a new family per gauge with the staged values."""
+
+        missing = 0 if self.missing_values == "zero" else nan
+        rows = list(self.rows.items())
+        for spec, index, bit in self.specs:
+            family = GaugeMetricFamily(spec.name, spec.help, labels=self.labelnames)
+            for labelvalues, (values, exported) in rows:
+                if exported & bit:
+                    val = values[index]
+                    family.add_metric(labelvalues, missing if val is None else val)
+            yield family
+
+class SnapshotCollector:
+    """Collector serving the families of the last published snapshot of gauge sets.
+
+    The next snapshot is built off to the side and published by replacing the reference to
+    the snapshot in one assignment. A scrape reads the reference once, so it always sees one
+    complete snapshot, without taking locks.
+
+    Gauges which are set one series at a time are registered in the staging registry instead
+    of the global registry. Their values are copied into the snapshot when it is published.
+    """
+
+    gauge_sets: list[GaugeSet]
+    staging: CollectorRegistry
+    snapshot: tuple[Metric, ...] = ()
+
+    def __init__(self, gauge_sets: list[GaugeSet], staging: Optional[CollectorRegistry] = None):
+        self.gauge_sets = gauge_sets
+        self.staging = CollectorRegistry() if staging is None else staging
+
+    def publish(self) -> None:
+        """Make the currently staged values of all gauge sets and gauges visible to scrapes."""
+        families = [family for gauge_set in self.gauge_sets for family in gauge_set.families()]
+        families.extend(self.staging.collect())
+        self.snapshot = tuple(families)
+
+    def describe(self) -> Iterator[Metric]:
+        """Families of all gauge sets without samples, and the staged gauges."""
+        for gauge_set in self.gauge_sets:
+            yield from gauge_set.describe()
+        yield from self.staging.collect()
+
+    def collect(self) -> Iterator[Metric]:
+        """Families of the last published snapshot."""
+        return iter(self.snapshot)
@@ -25,45 +25,133 @@
 
 import json
 from datetime import datetime, timedelta
-from functools import lru_cache
-from typing import Optional
+from math import floor
+from time import time
+from typing import Optional, Sequence
 
-import requests
-from openweathermap import Coordinate
+from openweathermap import Coordinate, GeocodingMiss, OpenWeatherMapLocation, WeatherInformation
+from metrics import (
+    OPEN_METEO_AIR_QUALITY_METRICS, compile_extractor, make_location_id, presence_bitmap
+)
+from profiler import refresh_timings
+from transport import http_get
 
 AIR_QUALITY_BASE_URL: str = "https://air-quality-api.open-meteo.com/v1/air-quality"
 GEOCODING_BASE_URL: str = "https://geocoding-api.open-meteo.com/v1/search"
+FORECAST_BASE_URL: str = "https://api.open-meteo.com/v1/forecast"
+
+EPOCH: datetime = datetime(1970, 1, 1)
+
+# TODO: Make this 3 hours configurable
+AIR_QUALITY_FORECAST_TTL: timedelta = timedelta(hours=3)
+
+# Number of coordinates per forecast request, which keeps the URL well below common length limits
+WEATHER_BATCH_SIZE: int = 100
+
+CURRENT_WEATHER_VARIABLES: list[str] = [
+    "temperature_2m", "apparent_temperature", "relative_humidity_2m", "pressure_msl", "visibility",
+    "wind_speed_10m", "wind_direction_10m", "wind_gusts_10m", "cloud_cover", "rain", "showers",
+    "snowfall", "weather_code", "is_day"
+]
+DAILY_WEATHER_VARIABLES: list[str] = [
+    "temperature_2m_min", "temperature_2m_max", "sunrise", "sunset"
+]
+
+# The OpenWeatherMap condition (id, main, description, icon without day or night suffix) closest
+# to a WMO weather code
+# https://open-meteo.com/en/docs#weathervariables and https://openweathermap.org/weather-conditions
+WMO_WEATHER_CONDITIONS: dict[int, tuple[int, str, str, str]] = {
+    0: (800, "Clear", "clear sky", "01"),
+    1: (801, "Clouds", "few clouds", "02"),
+    2: (802, "Clouds", "scattered clouds", "03"),
+    3: (804, "Clouds", "overcast clouds", "04"),
+    45: (741, "Fog", "fog", "50"),
+    48: (741, "Fog", "fog", "50"),
+    51: (300, "Drizzle", "light intensity drizzle", "09"),
+    53: (301, "Drizzle", "drizzle", "09"),
+    55: (302, "Drizzle", "heavy intensity drizzle", "09"),
+    56: (511, "Rain", "freezing rain", "13"),
+    57: (511, "Rain", "freezing rain", "13"),
+    61: (500, "Rain", "light rain", "10"),
+    63: (501, "Rain", "moderate rain", "10"),
+    65: (502, "Rain", "heavy intensity rain", "10"),
+    66: (511, "Rain", "freezing rain", "13"),
+    67: (511, "Rain", "freezing rain", "13"),
+    71: (600, "Snow", "light snow", "13"),
+    73: (601, "Snow", "snow", "13"),
+    75: (602, "Snow", "heavy snow", "13"),
+    77: (600, "Snow", "light snow", "13"),
+    80: (520, "Rain", "light intensity shower rain", "09"),
+    81: (521, "Rain", "shower rain", "09"),
+    82: (522, "Rain", "heavy intensity shower rain", "09"),
+    85: (620, "Snow", "light shower snow", "13"),
+    86: (622, "Snow", "heavy shower snow", "13"),
+    95: (211, "Thunderstorm", "thunderstorm", "11"),
+    96: (201, "Thunderstorm", "thunderstorm with rain", "11"),
+    99: (202, "Thunderstorm", "thunderstorm with heavy rain", "11")
+}
+
+# Open-Meteo snowfall is in cm of snow, 7 cm of snow is about 10 mm of water
+SNOWFALL_CM_TO_MM_WATER: float = 10 / 7
+
+# Open-Meteo uses the CAMS European model (0.1°) within its domain and the CAMS global model (0.4°)
+# elsewhere. Grid points of the European model are at odd multiples of 0.05°, those of the global
+# model at multiples of 0.4°.
+EUROPE_DOMAIN: tuple[float, float, float, float] = (30.0, 72.0, -25.0, 45.0)
+EUROPE_GRID_RESOLUTION: float = 0.1
+GLOBAL_GRID_RESOLUTION: float = 0.4
+
+# Mapping of attribute names, which are also used in the configuration, to Open-Meteo hourly
+# variables
+AIR_QUALITY_VARIABLES: dict[str, str] = {
+    spec.attr: spec.path[-1] for spec in OPEN_METEO_AIR_QUALITY_METRICS
+}
+AIR_QUALITY_ATTRS: list[str] = list(AIR_QUALITY_VARIABLES)
+
+# Variables which were not requested are left empty, the default is shared by all forecasts so it
+# must be immutable
+extract_hourly_air_quality = compile_extractor(OPEN_METEO_AIR_QUALITY_METRICS, default=())
 
 class OpenMeteoAirQualityForecast:
+    """Hourly air quality forecast of one coordinate from the Open Meteo Air Quality API."""
+
+    # The hourly values are set from the spec table, declaring them as slots keeps them explicit
+    # attributes
+    __slots__ = ("request_datetime", "utc_offset_seconds", "timestamps", *AIR_QUALITY_ATTRS,
+                 "values", "air_quality_values")
 
     request_datetime: datetime
 
+    # Timestamps are in the local time of the location, this is the offset to UTC
+    utc_offset_seconds: int
     timestamps: list[datetime]
-    pm10: list[Optional[float]]
-    pm2_5: list[Optional[float]]
-    co: list[Optional[float]]
-    no2: list[Optional[float]]
-    so2: list[Optional[float]]
-    o3: list[Optional[float]]
-    nh3: list[Optional[float]]
-    aerosol_optical_depth: list[Optional[float]]
-    dust: list[Optional[float]]
-    uv_index: list[Optional[float]]
-    uv_index_clear_sky: list[Optional[float]]
-    alder_pollen: list[Optional[float]]
-    birch_pollen: list[Optional[float]]
-    grass_pollen: list[Optional[float]]
-    mugwort_pollen: list[Optional[float]]
-    olive_pollen: list[Optional[float]]
-    ragweed_pollen: list[Optional[float]]
-    european_aqi: list[Optional[float]]
-    european_aqi_pm2_5: list[Optional[float]]
-    european_aqi_pm10: list[Optional[float]]
-    european_aqi_no2: list[Optional[float]]
-    european_aqi_o3: list[Optional[float]]
-    european_aqi_so2: list[Optional[float]]
-
-    air_quality_values: dict[str, list[Optional[float]]]
+    pm10: Sequence[Optional[float]]
+    pm2_5: Sequence[Optional[float]]
+    co: Sequence[Optional[float]]
+    no2: Sequence[Optional[float]]
+    so2: Sequence[Optional[float]]
+    o3: Sequence[Optional[float]]
+    nh3: Sequence[Optional[float]]
+    aerosol_optical_depth: Sequence[Optional[float]]
+    dust: Sequence[Optional[float]]
+    uv_index: Sequence[Optional[float]]
+    uv_index_clear_sky: Sequence[Optional[float]]
+    alder_pollen: Sequence[Optional[float]]
+    birch_pollen: Sequence[Optional[float]]
+    grass_pollen: Sequence[Optional[float]]
+    mugwort_pollen: Sequence[Optional[float]]
+    olive_pollen: Sequence[Optional[float]]
+    ragweed_pollen: Sequence[Optional[float]]
+    european_aqi: Sequence[Optional[float]]
+    european_aqi_pm2_5: Sequence[Optional[float]]
+    european_aqi_pm10: Sequence[Optional[float]]
+    european_aqi_no2: Sequence[Optional[float]]
+    european_aqi_o3: Sequence[Optional[float]]
+    european_aqi_so2: Sequence[Optional[float]]
+
+    # Hourly values in the order of OPEN_METEO_AIR_QUALITY_METRICS
+    values: tuple
+    air_quality_values: dict[str, Sequence[Optional[float]]]
 
     def __init__(self, request_datetime: datetime, obj: dict) -> None:
         """Parse air quality information based on the Open Meteo Air Quality API.
@@ -72,44 +160,65 @@ class OpenMeteoAirQualityForecast:
         """
 
         self.request_datetime = request_datetime
-        self.timestamps = [datetime.strptime(date, "%Y-%m-%dT%H:%M") for date in obj["hourly"]["time"]]
-        self.pm10 = obj["hourly"]["pm10"]
-        self.pm2_5 = obj["hourly"]["pm2_5"]
-        self.co = obj["hourly"]["carbon_monoxide"]
-        self.no2 = obj["hourly"]["nitrogen_dioxide"]
-        self.so2 = obj["hourly"]["sulphur_dioxide"]
-        self.o3 = obj["hourly"]["ozone"]
-        self.nh3 = obj["hourly"]["ammonia"]
-        self.aerosol_optical_depth = obj["hourly"]["aerosol_optical_depth"]
-        self.dust = obj["hourly"]["dust"]
-        self.uv_index = obj["hourly"]["uv_index"]
-        self.uv_index_clear_sky = obj["hourly"]["uv_index_clear_sky"]
-        self.alder_pollen = obj["hourly"]["alder_pollen"]
-        self.birch_pollen = obj["hourly"]["birch_pollen"]
-        self.grass_pollen = obj["hourly"]["grass_pollen"]
-        self.mugwort_pollen = obj["hourly"]["mugwort_pollen"]
-        self.olive_pollen = obj["hourly"]["olive_pollen"]
-        self.ragweed_pollen = obj["hourly"]["ragweed_pollen"]
-        self.european_aqi = obj["hourly"]["european_aqi"]
-        self.european_aqi_pm2_5 = obj["hourly"]["european_aqi_pm2_5"]
-        self.european_aqi_pm10 = obj["hourly"]["european_aqi_pm10"]
-        self.european_aqi_no2 = obj["hourly"]["european_aqi_no2"]
-        self.european_aqi_o3 = obj["hourly"]["european_aqi_o3"]
-        self.european_aqi_so2 = obj["hourly"]["european_aqi_so2"]
-
-        self.air_quality_values = {
-            "pm10": self.pm10,
-            "pm2_5": self.pm2_5,
-            "co": self.co,
-            "no2": self.no2,
-            "so2": self.so2,
-            "o3": self.o3,
-            "nh3": self.nh3,
-            "aerosol_optical_depth": self.aerosol_optical_depth,
-            "dust": self.dust,
-            "uv_index": self.uv_index,
-            "uv_index_clear_sky": self.uv_index_clear_sky
-        }
+        hourly = obj["hourly"]
+        self.utc_offset_seconds = obj.get("utc_offset_seconds", 0)
+        self.timestamps = [datetime.strptime(date, "%Y-%m-%dT%H:%M") for date in hourly["time"]]
+        self.values = extract_hourly_air_quality(obj)
+        self.air_quality_values = dict(zip(AIR_QUALITY_ATTRS, self.values))
+        for attr, values in self.air_quality_values.items():
+            setattr(self, attr, values)
+
+    def index_of(self, timestamp: float) -> int:
+        """Index of the hourly value covering Unix timestamp, or 0 if it is not in the forecast."""
+
+        # The timestamps are in the local time of the location, like epoch_at in reverse
+        moment = EPOCH + timedelta(seconds=timestamp + self.utc_offset_seconds)
+        # Around midnight, there is no longer a datapoint for 23:00 in the previous day
+        # TODO: Further research why this happens
+        try:
+            return self.timestamps.index(moment.replace(minute=0, second=0, microsecond=0))
+        except ValueError:
+            return 0
+
+    def epoch_at(self, index: int) -> float:
+        """Unix timestamp of the hourly value at index."""
+
+        return (self.timestamps[index] - EPOCH).total_seconds() - self.utc_offset_seconds
+
+    def horizon_values(
+        self,
+        variable: str,
+        index: int,
+        horizons: list[int]
+        ) -> list[Optional[float]]:
+        """Values of variable the given number of hours after index.
+
+        Horizons beyond the end of the forecast yield None.
+        """
+
+        values = self.air_quality_values[variable]
+        end = len(values)
+
+        return [values[index + h] if index + h < end else None for h in horizons]
+
+    def window_statistics(
+        self,
+        variable: str,
+        index: int,
+        hours: int
+        ) -> tuple[Optional[float], Optional[float]]:
+        """Maximum and mean of variable over the hours starting at index.
+
+        Missing values are skipped, if no value is present (None, None) is returned.
+        """
+
+        window = [
+            v for v in self.air_quality_values[variable][index:index + hours] if v is not None
+        ]
+        if not window:
+            return (None, None)
+
+        return (max(window), sum(window) / len(window))
 
     def __str__(self) -> str:
         return f"OpenMeteoAirQualityForecast(timestamps={self.timestamps})"
@@ -117,6 +226,8 @@ class OpenMeteoAirQualityForecast:
 class OpenMeteoCurrentAirQualityForecast:
     """Most recent forecast values for a specific datetime."""
 
+    __slots__ = (*AIR_QUALITY_ATTRS, "values", "presence", "timestamp")
+
     pm10: Optional[float]
     pm2_5: Optional[float]
     co: Optional[float]
@@ -141,121 +252,361 @@ class OpenMeteoCurrentAirQualityForecast:
     european_aqi_o3: Optional[float]
     european_aqi_so2: Optional[float]
 
+    # Values in the order of OPEN_METEO_AIR_QUALITY_METRICS, bit i of presence is set if values[i]
+    # is not None
+    values: tuple
+    presence: int
+    # Unix timestamp of the hourly forecast values, None if the forecast is empty
+    timestamp: Optional[float]
+
     def __init__(self, index: int, forecast: OpenMeteoAirQualityForecast) -> None:
-        self.pm10 = forecast.pm10[index]
-        self.pm2_5 = forecast.pm2_5[index]
-        self.co = forecast.co[index]
-        self.no2 = forecast.no2[index]
-        self.so2 = forecast.so2[index]
-        self.o3 = forecast.o3[index]
-        self.nh3 = forecast.nh3[index]
-        self.aerosol_optical_depth = forecast.aerosol_optical_depth[index]
-        self.dust = forecast.dust[index]
-        self.uv_index = forecast.uv_index[index]
-        self.uv_index_clear_sky = forecast.uv_index_clear_sky[index]
-        self.alder_pollen = forecast.alder_pollen[index]
-        self.birch_pollen = forecast.birch_pollen[index]
-        self.grass_pollen = forecast.grass_pollen[index]
-        self.mugwort_pollen = forecast.mugwort_pollen[index]
-        self.olive_pollen = forecast.olive_pollen[index]
-        self.ragweed_pollen = forecast.ragweed_pollen[index]
-        self.european_aqi = forecast.european_aqi[index]
-        self.european_aqi_pm2_5 = forecast.european_aqi_pm2_5[index]
-        self.european_aqi_pm10 = forecast.european_aqi_pm10[index]
-        self.european_aqi_no2 = forecast.european_aqi_no2[index]
-        self.european_aqi_o3 = forecast.european_aqi_o3[index]
-        self.european_aqi_so2 = forecast.european_aqi_so2[index]
+        self.values = tuple(
+            column[index] if index < len(column) else None for column in forecast.values)
+        self.presence = presence_bitmap(self.values)
+        for attr, value in zip(AIR_QUALITY_ATTRS, self.values):
+            setattr(self, attr, value)
+        self.timestamp = forecast.epoch_at(index) if index < len(forecast.timestamps) else None
 
-class OpenMeteo:
+class AirQualityGrid:
+    """Spatial index mapping coordinates to the grid cells of the air quality models.
+
+    All locations in the same grid cell get an identical forecast, so the forecast is
+    requested once per cell for the grid point and shared by all locations in that cell.
+    """
+
+    # Locations per cell, keyed by (resolution, lat index, lon index)
+    cells: dict[tuple[float, int, int], int]
+    forecasts: dict[tuple, OpenMeteoAirQualityForecast]
 
     def __init__(self):
-        pass
+        self.cells = {}
+        self.forecasts = {}
+
+    @staticmethod
+    def cell_of(coord: Coordinate) -> tuple[float, int, int]:
+        """Grid cell of the model used for coord."""
+
+        lat_min, lat_max, lon_min, lon_max = EUROPE_DOMAIN
+        if lat_min <= coord.lat < lat_max and lon_min <= coord.lon < lon_max:
+            # The small offset keeps coordinates on a cell border, like 52.3, from ending up in the
+            # cell below due to floating point rounding
+            return (EUROPE_GRID_RESOLUTION,
+                    floor(coord.lat / EUROPE_GRID_RESOLUTION + 1e-9),
+                    floor(coord.lon / EUROPE_GRID_RESOLUTION + 1e-9))
+
+        return (GLOBAL_GRID_RESOLUTION,
+                round(coord.lat / GLOBAL_GRID_RESOLUTION),
+                round(coord.lon / GLOBAL_GRID_RESOLUTION))
+
+    @staticmethod
+    def grid_point(cell: tuple[float, int, int]) -> Coordinate:
+        """Coordinate of the model grid point of cell."""
+
+        resolution, lat_index, lon_index = cell
+        if resolution == EUROPE_GRID_RESOLUTION:
+            return Coordinate(lat=round((lat_index + 0.5) * resolution, 2),
+                              lon=round((lon_index + 0.5) * resolution, 2))
+
+        return Coordinate(lat=round(lat_index * resolution, 2),
+                          lon=round(lon_index * resolution, 2))
+
+    def add(self, coord: Coordinate) -> None:
+        """Register a location at coord, to keep track of the number of occupied cells."""
+
+        cell = self.cell_of(coord)
+        self.cells[cell] = self.cells.get(cell, 0) + 1
+
+    def remove(self, coord: Coordinate) -> None:
+        """Unregister a location at coord.
+
+        The forecasts of its cell are dropped if it was the last location in the cell.
+        """
+
+        cell = self.cell_of(coord)
+        self.cells[cell] -= 1
+        if self.cells[cell] <= 0:
+            del self.cells[cell]
+            for key in [key for key in self.forecasts if key[0] == cell]:
+                del self.forecasts[key]
+
+    def get_air_quality(
+        self,
+        om: "OpenMeteo",
+        coord: Coordinate,
+        *args
+        ) -> OpenMeteoAirQualityForecast:
+        """Get the forecast of the grid cell of coord, requesting it only if there is no recent one.
+
+        The remaining arguments are passed to OpenMeteo.get_air_quality.
+        """
+
+        cell = self.cell_of(coord)
+        key = (cell, tuple(args[0]) if args and args[0] is not None else None) + tuple(args[1:])
+
+        now = datetime.now()
+        try:
+            forecast = self.forecasts[key]
+            if now - forecast.request_datetime <= AIR_QUALITY_FORECAST_TTL:
+                return forecast
+        except KeyError:
+            pass
+
+        # Drop expired forecasts, so cells which are no longer used do not keep memory
+        expired_keys = [
+            k for k, f in self.forecasts.items()
+            if now - f.request_datetime > AIR_QUALITY_FORECAST_TTL
+        ]
+        for expired in expired_keys:
+            del self.forecasts[expired]
+
+        forecast = om.get_air_quality(self.grid_point(cell), *args)
+        self.forecasts[key] = forecast
+        return forecast
+
+class OpenMeteo:
+    """Client for the Open Meteo APIs, which do not need an API key."""
+
+    grid: Optional[AirQualityGrid] = None
+
+    def __init__(self, grid: Optional[AirQualityGrid] = None):
+        """Create a client for the Open Meteo APIs.
+
+        If grid is given, air quality forecasts of OpenMeteoLocation instances are shared per grid
+        cell.
+        """
+        self.grid = grid
 
     def om_api_request(self, base_url: str, parameters: dict, timeout_time=10) -> dict:
         """Do an API request to an Open Meteo API endpoint."""
 
-        resp = requests.get(base_url, params=parameters, timeout=timeout_time)
+        with refresh_timings.phase("fetch"):
+            resp = http_get(base_url, parameters, timeout_time)
 
-        return json.loads(resp.text)
+        with refresh_timings.phase("decode"):
+            return json.loads(resp.text)
 
-    @lru_cache(maxsize=256)
-    def get_coordinate(self, location_name) -> Coordinate:
+    def geocode(
+        self,
+        location_name: str,
+        country_code: Optional[str] = None
+        ) -> Optional[Coordinate]:
         """Use Open Meteo Geocoding API to map a location_name to a coordinate.
-        
+
+        Returns None if the location is not found.
+
         https://open-meteo.com/en/docs/geocoding-api
         """
 
-        resp = self.om_api_request(
-            GEOCODING_BASE_URL,
-            {
-                "name": location_name,
-                "count": 1
-            }
-            )
+        parameters = {"name": location_name, "count": 1}
+        if country_code:
+            parameters["countryCode"] = country_code
+        resp = self.om_api_request(GEOCODING_BASE_URL, parameters)
 
+        if resp.get("error"):
+            raise RuntimeError(f"Open-Meteo geocoding failed: {resp.get('reason')}")
+        if not resp.get("results"):
+            return None
         return Coordinate(obj=resp["results"][0])
 
-    def get_air_quality(self, coord: Coordinate) -> OpenMeteoAirQualityForecast:
+    def get_coordinate(self, location_name: str, country_code: Optional[str] = None) -> Coordinate:
+        """Like geocode, but raises GeocodingMiss if the location is not found."""
+
+        coord = self.geocode(location_name, country_code)
+        if coord is None:
+            raise GeocodingMiss(f"Open-Meteo geocoding found no results for {location_name}")
+        return coord
+
+    def get_air_quality(
+        self,
+        coord: Coordinate,
+        variables: Optional[list[str]] = None,
+        forecast_days: Optional[int] = None,
+        past_days: Optional[int] = None
+        ) -> OpenMeteoAirQualityForecast:
         """Retrieve an air quality forecast from the Open Meteo API.
-        
+
+        variables is a list of keys of AIR_QUALITY_VARIABLES, by default all variables are
+        requested.
+        forecast_days and past_days are only sent if provided, otherwise the API defaults are used.
+
         https://open-meteo.com/en/docs/air-quality-api
         """
 
-        resp = self.om_api_request(
-            AIR_QUALITY_BASE_URL,
-            {
-                "latitude": coord.lat,
-                "longitude": coord.lon,
-                "hourly": [
-                    "pm10",
-                    "pm2_5",
-                    "carbon_monoxide",
-                    "nitrogen_dioxide",
-                    "sulphur_dioxide",
-                    "ozone",
-                    "ammonia",
-                    "aerosol_optical_depth",
-                    "dust",
-                    "uv_index",
-                    "uv_index_clear_sky",
-                    "alder_pollen",
-                    "birch_pollen",
-                    "grass_pollen",
-                    "mugwort_pollen",
-                    "olive_pollen",
-                    "ragweed_pollen",
-                    "european_aqi",
-                    "european_aqi_pm2_5",
-                    "european_aqi_pm10",
-                    "european_aqi_no2",
-                    "european_aqi_o3",
-                    "european_aqi_so2"
-                ],
-                #"timeformat": "unixtime",
-                "timezone": "auto",
-                "domains": "auto"
-            }
-        )
+        if variables is None:
+            variables = list(AIR_QUALITY_VARIABLES)
+
+        parameters: dict = {
+            "latitude": coord.lat,
+            "longitude": coord.lon,
+            "hourly": [AIR_QUALITY_VARIABLES[v] for v in variables],
+            #"timeformat": "unixtime",
+            "timezone": "auto",
+            "domains": "auto"
+        }
+        if forecast_days is not None:
+            parameters["forecast_days"] = forecast_days
+        if past_days is not None:
+            parameters["past_days"] = past_days
+
+        resp = self.om_api_request(AIR_QUALITY_BASE_URL, parameters)
 
         return OpenMeteoAirQualityForecast(datetime.now(), resp)
 
+def forecast_to_current_weather(coord: Coordinate, obj: dict) -> dict:
+    """Reshape the current and daily values of a forecast response to the Current Weather API
+    format.
+
+    Precipitation is summed over the current interval of Open-Meteo (15 minutes) and scaled to one
+    hour. Open-Meteo has no 3 hour volumes, so these are left out.
+
+    https://open-meteo.com/en/docs
+    """
+    current = obj["current"]
+    daily = obj.get("daily", {})
+
+    condition = WMO_WEATHER_CONDITIONS.get(current.get("weather_code"))
+    weather = []
+    if condition is not None:
+        condition_id, main, description, icon = condition
+        weather.append({"id": condition_id, "main": main, "description": description,
+                        "icon": icon + ("d" if current.get("is_day", 1) else "n")})
+
+    converted = {
+        "coord": {"lat": coord.lat, "lon": coord.lon},
+        "weather": weather,
+        "main": {
+            "temp": current["temperature_2m"],
+            "feels_like": current["apparent_temperature"],
+            "temp_min": daily.get("temperature_2m_min", [current["temperature_2m"]])[0],
+            "temp_max": daily.get("temperature_2m_max", [current["temperature_2m"]])[0],
+            "pressure": current["pressure_msl"],
+            "humidity": current["relative_humidity_2m"]
+        },
+        "wind": {
+            "speed": current["wind_speed_10m"],
+            "deg": current["wind_direction_10m"],
+            "gust": current.get("wind_gusts_10m")
+        },
+        "clouds": {"all": current["cloud_cover"]},
+        "dt": current["time"],
+        "timezone": obj.get("utc_offset_seconds", 0),
+        "sys": {"sunrise": daily.get("sunrise", [0])[0], "sunset": daily.get("sunset", [0])[0]}
+    }
+    # OpenWeatherMap reports at most 10 km
+    if current.get("visibility") is not None:
+        converted["visibility"] = min(current["visibility"], 10000)
+
+    per_hour = 3600 / current.get("interval", 900)
+    if current.get("rain") is not None:
+        converted["rain"] = {"1h": (current["rain"] + (current.get("showers") or 0)) * per_hour}
+    if current.get("snowfall") is not None:
+        converted["snow"] = {"1h": current["snowfall"] * SNOWFALL_CM_TO_MM_WATER * per_hour}
+
+    return converted
+
+class OpenMeteoWeather:
+    """Current weather of many locations from the Open-Meteo Forecast API, without an API key.
+
+    The weather of up to WEATHER_BATCH_SIZE locations is requested at once and stored in the
+    current weather cache of the locations, like the weather endpoint strategies do.
+    """
+
+    om: OpenMeteo
+
+    def __init__(self, om: Optional[OpenMeteo] = None):
+        self.om = om if om is not None else OpenMeteo()
+
+    def get_current_weather(self, coords: list[Coordinate]) -> list[WeatherInformation]:
+        """Current weather of coords, in one request."""
+
+        parameters: dict = {
+            "latitude": ",".join(str(coord.lat) for coord in coords),
+            "longitude": ",".join(str(coord.lon) for coord in coords),
+            "current": ",".join(CURRENT_WEATHER_VARIABLES),
+            "daily": ",".join(DAILY_WEATHER_VARIABLES),
+            "forecast_days": 1,
+            "wind_speed_unit": "ms",
+            "timeformat": "unixtime",
+            "timezone": "auto"
+        }
+        # Several coordinates are answered with a list of objects
+        resp: dict | list[dict] = self.om.om_api_request(FORECAST_BASE_URL, parameters)
+
+        results: list[dict]
+        if isinstance(resp, dict):
+            if resp.get("error"):
+                raise RuntimeError(f"Open-Meteo forecast request failed: {resp.get('reason')}")
+            # A single coordinate is answered with one object instead of a list
+            results = [resp]
+        else:
+            results = resp
+
+        return [WeatherInformation(forecast_to_current_weather(coord, obj))
+                for coord, obj in zip(coords, results)]
+
+    def calls_per_refresh(self, locations: list[OpenWeatherMapLocation]) -> int:
+        """Number of API calls needed to refresh all locations."""
+        return -(-len(locations) // WEATHER_BATCH_SIZE)
+
+    def refresh(self, locations: list[OpenWeatherMapLocation]) -> None:
+        """Refresh the current weather of all locations."""
+
+        for start in range(0, len(locations), WEATHER_BATCH_SIZE):
+            batch = locations[start:start + WEATHER_BATCH_SIZE]
+            for loc, weather in zip(batch, self.get_current_weather([loc.coord for loc in batch])):
+                loc.set_current_weather(weather)
+
 class OpenMeteoLocation:
+    """Location with its Open Meteo air quality forecast."""
+
     om: OpenMeteo
 
     location_name: str
     country_code: str
+    location_id: str
     coord: Coordinate
     last_air_quality_forecast: Optional[OpenMeteoAirQualityForecast] = None
 
+    variables: Optional[list[str]] = None
+    variables_mask: int = -1
+    forecast_days: Optional[int] = None
+    past_days: Optional[int] = None
+
     def __init__(self, om: OpenMeteo, **kwargs):
+        """Create a new OpenMeteoLocation instance.
+
+        location_name and country_code keyword arguments are required.
+        If lat= and lon= are provided, these values will be used for the Coordinate,
+        otherwise the Open Meteo Geocoding API will be used to get the coordinates.
+        The optional variables=, forecast_days= and past_days= keyword arguments
+        limit the air quality data requested for this location. location_id= defaults
+        to an identifier made from the location name and country code."""
         self.location_name = kwargs["location_name"]
         self.country_code = kwargs["country_code"]
+        self.location_id = (kwargs.get("location_id")
+                            or make_location_id(self.location_name, self.country_code))
         self.om = om
 
+        self.variables = kwargs.get("variables")
+        if self.variables is not None:
+            for variable in self.variables:
+                if variable not in AIR_QUALITY_VARIABLES:
+                    raise ValueError(f"Unknown Open-Meteo air quality variable: {variable}")
+        self.forecast_days = kwargs.get("forecast_days")
+        self.past_days = kwargs.get("past_days")
+
+        # Bitmap of the requested variables, in the order of OPEN_METEO_AIR_QUALITY_METRICS
+        self.variables_mask = -1
+        if self.variables is not None:
+            self.variables_mask = sum(1 << AIR_QUALITY_ATTRS.index(v) for v in self.variables)
+
         try:
             self.coord = Coordinate(lat=kwargs["lat"], lon=kwargs["lon"])
         except KeyError:
-            self.coord = self.om.get_coordinate(self.location_name)
+            self.coord = self.om.get_coordinate(self.location_name, self.country_code)
+
+        if self.om.grid is not None:
+            self.om.grid.add(self.coord)
 
     def __str__(self) -> str:
         return f"OpenMeteoLocation(location_name={self.location_name}, coord={self.coord})"
@@ -263,23 +614,31 @@ class OpenMeteoLocation:
     def get_current_air_quality(self) -> OpenMeteoCurrentAirQualityForecast:
         """Get current air quality forecast."""
 
+        forecast = self.get_air_quality_forecast()
+
+        return OpenMeteoCurrentAirQualityForecast(forecast.index_of(time()), forecast)
+
+    def get_air_quality_forecast(self) -> OpenMeteoAirQualityForecast:
+        """Get the full hourly air quality forecast.
+
+        The forecast is cached internally and only requested again after three hours,
+        so current values and forecast horizons are all taken from the same download.
+        """
+
         if self.last_air_quality_forecast is None:
-            self.last_air_quality_forecast = self.om.get_air_quality(self.coord)
+            self.last_air_quality_forecast = self._request_air_quality()
         else:
-            time_since_last_update = datetime.now() - self.last_air_quality_forecast.request_datetime
-            # TODO: Make this 3 hours configurable
-            if time_since_last_update > timedelta(hours=3):
-                self.last_air_quality_forecast = self.om.get_air_quality(self.coord)
+            request_datetime = self.last_air_quality_forecast.request_datetime
+            time_since_last_update = datetime.now() - request_datetime
+            if time_since_last_update > AIR_QUALITY_FORECAST_TTL:
+                self.last_air_quality_forecast = self._request_air_quality()
 
-        now: datetime = datetime.now()
-        now_hour = now.replace(minute=0, second=0, microsecond=0)
+        return self.last_air_quality_forecast
 
-        # Around midnight, there is no longer a datapoint for 23:00 in the previous day
-        # TODO: Further research why this happens
-        index: int
-        try:
-            index = self.last_air_quality_forecast.timestamps.index(now_hour)
-        except ValueError:
-            index = 0
+    def _request_air_quality(self) -> OpenMeteoAirQualityForecast:
+        if self.om.grid is not None:
+            return self.om.grid.get_air_quality(
+                self.om, self.coord, self.variables, self.forecast_days, self.past_days)
 
-        return OpenMeteoCurrentAirQualityForecast(index, self.last_air_quality_forecast)
+        return self.om.get_air_quality(
+            self.coord, self.variables, self.forecast_days, self.past_days)
@@ -24,14 +24,35 @@
 """
 
 from datetime import datetime, timedelta
-from functools import lru_cache
 import json
-from typing import Optional
-import requests
+from sys import intern
+from typing import Iterator, Optional
+
+from api_keys import KEY_FAILURE_COOLDOWN_SECONDS, ApiKey, ApiKeyPool
+from metrics import (
+    AIR_POLLUTION_METRICS, WEATHER_METRICS, compile_extractor, make_location_id, presence_bitmap
+)
+from profiler import refresh_timings
+from transport import http_get
 
 GEOCODING_API_BASE_URL="http://api.openweathermap.org/geo/1.0/direct"
 CURRENT_WEATHER_API_BASE_URL="https://api.openweathermap.org/data/2.5/weather"
 CURRENT_AIR_POLLUTION_API_BASE_URL="http://api.openweathermap.org/data/2.5/air_pollution"
+AIR_POLLUTION_HISTORY_API_BASE_URL="http://api.openweathermap.org/data/2.5/air_pollution/history"
+ONE_CALL_API_BASE_URL="https://api.openweathermap.org/data/3.0/onecall"
+GROUP_WEATHER_API_BASE_URL="https://api.openweathermap.org/data/2.5/group"
+
+# Backends of the current weather of a location: the OpenWeatherMap weather endpoints, or the
+# Open-Meteo Forecast API (see openmeteo.OpenMeteoWeather)
+WEATHER_BACKENDS: list[str] = ["owm", "open_meteo"]
+
+extract_weather = compile_extractor(WEATHER_METRICS)
+WEATHER_ATTRS: list[str] = [spec.attr for spec in WEATHER_METRICS]
+extract_air_pollution = compile_extractor(AIR_POLLUTION_METRICS)
+AIR_POLLUTION_ATTRS: list[str] = [spec.attr for spec in AIR_POLLUTION_METRICS]
+
+# Maximum number of city IDs in one request to the group endpoint
+GROUP_WEATHER_MAX_IDS = 20
 
 class Coordinate:
     """Class representing a coordinate defined by latitude and longitude."""
@@ -55,6 +76,9 @@ class Coordinate:
     def __str__(self):
         return f"Coordinate(lat={self.lat}, lon={self.lon})"
 
+class GeocodingMiss(LookupError):
+    """Raised when a location can not be found by geocoding."""
+
 class WeatherCondition:
     """Class representing one weather condition as provided by the OpenWeatherMap API.
 
@@ -67,20 +91,22 @@ class WeatherCondition:
     icon_id: str
 
     def __init__(self, obj: dict):
+        # The strings are interned, as they are used as label values and only a few different ones
+        # exist
         try:
             self.id = obj["id"]
         except:
             self.id = -999
         try:
-            self.main = obj["main"]
+            self.main = intern(obj["main"])
         except:
             self.main = "Weather condition main not found"
         try:
-            self.description = obj["description"]
+            self.description = intern(obj["description"])
         except:
             self.description = "Weather condititon description not found"
         try:
-            self.icon_id = obj["icon"]
+            self.icon_id = intern(obj["icon"])
         except:
             self.icon_id = "Weather condition icon id not found"
 
@@ -90,8 +116,14 @@ class WeatherCondition:
 
 class WeatherInformation:
     """Class representing weather information as provided by the OpenWeatherMap API."""
+
+    # The metric attributes are set from the spec table, declaring them as slots keeps them
+    # explicit attributes
+    __slots__ = ("coord", "weather_conditions", *WEATHER_ATTRS, "timestamp", "sunrise", "sunset",
+                 "utc_offset_seconds", "values", "presence")
+
     coord: Coordinate
-    weather_conditions: list[WeatherCondition] = []
+    weather_conditions: list[WeatherCondition]
     temp: float
     temp_feels_like: float
     temp_min: float
@@ -110,6 +142,12 @@ class WeatherInformation:
     timestamp: datetime
     sunrise: datetime
     sunset: datetime
+    # Shift of the local time of the location from UTC in seconds
+    utc_offset_seconds: int
+
+    # Values in the order of WEATHER_METRICS, bit i of presence is set if values[i] is not None
+    values: tuple
+    presence: int
 
     def __init__(self, obj: dict):
         """
@@ -120,49 +158,65 @@ class WeatherInformation:
         """
         self.coord = Coordinate(obj=obj["coord"])
 
-        for weather_condition_obj in obj["weather"]:
-            self.weather_conditions.append(WeatherCondition(weather_condition_obj))
-
-        self.temp = obj["main"]["temp"]
-        self.temp_feels_like = obj["main"]["feels_like"]
-        self.temp_max = obj["main"]["temp_max"]
-        self.temp_min = obj["main"]["temp_min"]
-        self.pressure = obj["main"]["pressure"]
-        self.humidity = obj["main"]["humidity"]
-        self.visibility = obj["visibility"]
-        self.wind_deg = obj["wind"]["deg"]
-        try:
-            self.wind_gust = obj["wind"]["gust"]
-        except KeyError:
-            self.wind_gust = None
-        self.wind_speed = obj["wind"]["speed"]
-        self.cloudiness = obj["clouds"]["all"]
-        try:
-            self.rain_volume_1h = obj["rain"]["1h"]
-        except KeyError:
-            self.rain_volume_1h = 0
-        try:
-            self.rain_volume_3h = obj["rain"]["3h"]
-        except KeyError:
-            self.rain_volume_3h = 0
-        try:
-            self.snow_volume_1h = obj["snow"]["1h"]
-        except KeyError:
-            self.snow_volume_1h = 0
-        try:
-            self.snow_volume_3h = obj["snow"]["3h"]
-        except KeyError:
-            self.snow_volume_3h = 0
+        self.weather_conditions = [
+            WeatherCondition(weather_condition_obj) for weather_condition_obj in obj["weather"]
+        ]
+
+        self.values = extract_weather(obj)
+        self.presence = presence_bitmap(self.values)
+        for attr, value in zip(WEATHER_ATTRS, self.values):
+            setattr(self, attr, value)
         self.timestamp = datetime.fromtimestamp(obj["dt"])
         self.sunrise = datetime.fromtimestamp(obj["sys"]["sunrise"])
         self.sunset = datetime.fromtimestamp(obj["sys"]["sunset"])
+        self.utc_offset_seconds = obj.get("timezone", 0)
 
     def __str__(self):
         return (f"WeatherInformation(temp={self.temp}, humidity={self.humidity},"
                 f"timestamp={self.timestamp}, coord={self.coord})")
 
+def one_call_to_current_weather(obj: dict) -> dict:
+    """Reshape a One Call API 3.0 response to the Current Weather API format.
+
+    Values which are not in the response are left out, so they are missing like in a Current
+    Weather response without them.
+    https://openweathermap.org/api/one-call-3
+    """
+    current = obj["current"]
+    converted = {
+        "coord": {"lat": obj["lat"], "lon": obj["lon"]},
+        "weather": current.get("weather", []),
+        "main": {
+            "temp": current["temp"],
+            "feels_like": current["feels_like"],
+            "pressure": current["pressure"],
+            "humidity": current["humidity"]
+        },
+        "wind": {"speed": current["wind_speed"], "deg": current["wind_deg"]},
+        "clouds": {"all": current["clouds"]},
+        "dt": current["dt"],
+        "timezone": obj.get("timezone_offset", 0),
+        "sys": {"sunrise": current["sunrise"], "sunset": current["sunset"]}
+    }
+    if "visibility" in current:
+        converted["visibility"] = current["visibility"]
+    if "wind_gust" in current:
+        converted["wind"]["gust"] = current["wind_gust"]
+    for precipitation in ["rain", "snow"]:
+        if precipitation in current:
+            converted[precipitation] = current[precipitation]
+    # One Call only has a minimum and maximum temperature for the whole day
+    if obj.get("daily"):
+        converted["main"]["temp_min"] = obj["daily"][0]["temp"]["min"]
+        converted["main"]["temp_max"] = obj["daily"][0]["temp"]["max"]
+
+    return converted
+
 class AirPollutionInformation:
     """Class representing air pollution information as provided by the OpenWeatherMap API."""
+
+    __slots__ = ("coord", "timestamp", *AIR_POLLUTION_ATTRS, "values", "presence")
+
     coord: Coordinate
     timestamp: datetime
 
@@ -178,6 +232,11 @@ class AirPollutionInformation:
     pm10: float
     nh3: float
 
+    # Values in the order of AIR_POLLUTION_METRICS, bit i of presence is set if values[i] is not
+    # None
+    values: tuple
+    presence: int
+
     def __init__(self, obj: dict):
         """Parse air pollution information from the OpenWeatherMap Air Pollution API.
 
@@ -187,15 +246,10 @@ class AirPollutionInformation:
         self.coord = Coordinate(obj=obj["coord"])
         res_obj = obj["list"][0]
         self.timestamp = datetime.fromtimestamp(res_obj["dt"])
-        self.air_quality_index = res_obj["main"]["aqi"]
-        self.co = res_obj["components"]["co"]
-        self.no = res_obj["components"]["no"]
-        self.no2 = res_obj["components"]["no2"]
-        self.o3 = res_obj["components"]["o3"]
-        self.so2 = res_obj["components"]["so2"]
-        self.pm2_5 = res_obj["components"]["pm2_5"]
-        self.pm10 = res_obj["components"]["pm10"]
-        self.nh3 = res_obj["components"]["nh3"]
+        self.values = extract_air_pollution(res_obj)
+        self.presence = presence_bitmap(self.values)
+        for attr, value in zip(AIR_POLLUTION_ATTRS, self.values):
+            setattr(self, attr, value)
 
     def __str__(self):
         return (f"AirPollutionInformation(timestamp={self.timestamp},"
@@ -206,36 +260,65 @@ class AirPollutionInformation:
 class OpenWeatherMap:
     """Basic wrapper around the OpenWeatherMap APIs."""
 
-    api_key: str
+    keys: ApiKeyPool
     api_calls_count: int = 0
 
-    def __init__(self, api_key: str):
-        self.api_key = api_key
+    def __init__(self, api_key: str | ApiKeyPool):
+        """Create a client using one API key or a pool of keys."""
+        if isinstance(api_key, ApiKeyPool):
+            self.keys = api_key
+        else:
+            self.keys = ApiKeyPool([ApiKey(api_key)])
 
-    # TODO: Add request self-limiting
     def owm_api_request(self, base_url: str, parameters: dict, timeout_time=10) -> dict:
-        """Do a request to an OpenWeatherMap API endpoint."""
+        """Do a request to an OpenWeatherMap API endpoint.
 
-        self.api_calls_count += 1
+        The request is done with the key of the pool with the most remaining quota. If the key is
+        rejected with 401 or 429, the request is tried again with another key while one is
+        available.
+        """
 
-        parameters["appid"] = self.api_key
+        for _ in self.keys.keys:
+            key = self.keys.acquire()
+            self.api_calls_count += 1
+            parameters["appid"] = key.key
 
-        resp = requests.get(base_url, params=parameters, timeout=timeout_time)
+            with refresh_timings.phase("fetch"):
+                resp = http_get(base_url, parameters, timeout_time)
+            self.keys.report(key, resp.status_code)
+            if resp.status_code not in KEY_FAILURE_COOLDOWN_SECONDS:
+                break
 
-        return json.loads(resp.text)
+        with refresh_timings.phase("decode"):
+            return json.loads(resp.text)
 
-    @lru_cache(maxsize=256)
-    def get_coordinate(self, location_name: str, country_code: str) -> Coordinate:
+    def geocode(self, location_name: str, country_code: str) -> Optional[Coordinate]:
         """Use Geocoding API to map a location_name and country_code to a coordinate.
 
+        Returns None if the location is not found.
+
         https://openweathermap.org/api/geocoding-api
         """
 
         parameters = {"q" : f"{location_name},{country_code}", "limit": 1}
 
-        resp = self.owm_api_request(GEOCODING_API_BASE_URL, parameters)[0]
+        resp = self.owm_api_request(GEOCODING_API_BASE_URL, parameters)
+
+        # Errors are returned as an object instead of a list of results
+        if isinstance(resp, dict):
+            raise RuntimeError(f"OpenWeatherMap geocoding failed: {resp.get('message')}")
+        if not resp:
+            return None
+        return Coordinate(obj=resp[0])
+
+    def get_coordinate(self, location_name: str, country_code: str) -> Coordinate:
+        """Like geocode, but raises GeocodingMiss if the location is not found."""
 
-        return Coordinate(obj=resp)
+        coord = self.geocode(location_name, country_code)
+        if coord is None:
+            raise GeocodingMiss(
+                f"OpenWeatherMap geocoding found no results for {location_name},{country_code}")
+        return coord
 
     def get_current_weather(self, coord: Coordinate, units="metric") -> WeatherInformation:
         """Use Current Weather API to get current weather information.
@@ -249,6 +332,39 @@ class OpenWeatherMap:
 
         return WeatherInformation(resp)
 
+    def get_one_call_weather(self, coord: Coordinate, units="metric") -> WeatherInformation:
+        """Use One Call API 3.0 to get current weather information.
+
+        This requires a One Call subscription.
+        https://openweathermap.org/api/one-call-3
+        """
+
+        parameters = {"lat": coord.lat, "lon": coord.lon, "units": units,
+                      "exclude": "minutely,alerts"}
+
+        resp = self.owm_api_request(ONE_CALL_API_BASE_URL, parameters)
+
+        return WeatherInformation(one_call_to_current_weather(resp))
+
+    def get_group_weather(
+        self,
+        city_ids: list[int],
+        units="metric"
+        ) -> dict[int, WeatherInformation]:
+        """Use the group endpoint to get current weather information of up to 20 cities in one call.
+
+        Returns a mapping from city ID to the weather information.
+        """
+
+        if len(city_ids) > GROUP_WEATHER_MAX_IDS:
+            raise ValueError(f"At most {GROUP_WEATHER_MAX_IDS} city IDs can be requested at once")
+
+        parameters = {"id": ",".join(str(i) for i in city_ids), "units": units}
+
+        resp = self.owm_api_request(GROUP_WEATHER_API_BASE_URL, parameters)
+
+        return {city["id"]: WeatherInformation(city) for city in resp["list"]}
+
     def get_current_air_pollution(self, coord: Coordinate) -> AirPollutionInformation:
         """Use Current Air Pollution API to get current air pollution information.
 
@@ -261,6 +377,34 @@ class OpenWeatherMap:
 
         return AirPollutionInformation(resp)
 
+    def iter_air_pollution_history(
+        self,
+        coord: Coordinate,
+        start: datetime,
+        end: datetime,
+        chunk=timedelta(days=1)
+        ) -> Iterator[AirPollutionInformation]:
+        """Use Air Pollution History API to get hourly air pollution information between start and
+        end.
+
+        The history is requested in chunks, so only one chunk is held in memory at a time.
+        https://openweathermap.org/api/air-pollution#history
+        """
+
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(chunk_start + chunk, end)
+            parameters = {"lat": coord.lat, "lon": coord.lon,
+                          "start": int(chunk_start.timestamp()), "end": int(chunk_end.timestamp())}
+
+            resp = self.owm_api_request(AIR_POLLUTION_HISTORY_API_BASE_URL, parameters)
+
+            for entry in resp["list"]:
+                # The end of a chunk is inclusive, skip it to avoid duplicates with the next chunk
+                if entry["dt"] < int(chunk_end.timestamp()) or chunk_end == end:
+                    yield AirPollutionInformation({"coord": resp["coord"], "list": [entry]})
+            chunk_start = chunk_end
+
 class OpenWeatherMapLocation:
     """A location about which weather information can be requested via the OpenWeatherMap API."""
 
@@ -268,10 +412,17 @@ class OpenWeatherMapLocation:
 
     location_name: str
     country_code: str
+    location_id: str
 
     coord: Coordinate
 
+    city_id: Optional[int] = None
+    # Backend of the current weather, one of WEATHER_BACKENDS
+    weather_backend: str = "owm"
+
     last_current_weather: Optional[WeatherInformation] = None
+    # When last_current_weather was fetched, its observation time can be much older
+    last_current_weather_fetched: Optional[datetime] = None
     last_current_air_pollution: Optional[AirPollutionInformation] = None
 
     def __init__(self, owm: OpenWeatherMap, **kwargs):
@@ -279,10 +430,18 @@ class OpenWeatherMapLocation:
 
         location_name and country_code keyword arguments are required.
         If lat= and lon= are provided, these values will be used for the Coordinate,
-        otherwise the OpenWeatherMap Geocode API will be used to get the coordinates."""
+        otherwise the OpenWeatherMap Geocode API will be used to get the coordinates.
+        The optional city_id= is the OpenWeatherMap city ID, which allows requesting
+        the weather of multiple locations in one call. location_id= defaults to an
+        identifier made from the location name and country code. weather_backend= selects
+        the backend of the current weather, see WEATHER_BACKENDS."""
         self.location_name = kwargs["location_name"]
         self.country_code = kwargs["country_code"]
+        self.location_id = (kwargs.get("location_id")
+                            or make_location_id(self.location_name, self.country_code))
         self.owm = owm
+        self.city_id = kwargs.get("city_id")
+        self.weather_backend = kwargs.get("weather_backend") or "owm"
 
         try:
             self.coord = Coordinate(lat=kwargs["lat"], lon=kwargs["lon"])
@@ -300,17 +459,37 @@ class OpenWeatherMapLocation:
         will not be called more than once per location per ten minutes, since that
         is the internal update frequency of OpenWeatherMap.
             For more information, see https://openweathermap.org/appid#apicare.
+
+        With the open_meteo weather backend, the weather is only refreshed by OpenMeteoWeather.
         """
 
-        if self.last_current_weather is None:
-            self.last_current_weather = self.owm.get_current_weather(self.coord)
-        else:
-            time_since_last_update = datetime.now() - self.last_current_weather.timestamp
-            if time_since_last_update > timedelta(minutes=10):
-                self.last_current_weather = self.owm.get_current_weather(self.coord)
+        if self.weather_backend == "owm" and self.current_weather_is_stale():
+            self.set_current_weather(self.owm.get_current_weather(self.coord))
 
+        if self.last_current_weather is None:
+            raise RuntimeError(f"No current weather of {self.location_name},{self.country_code} "
+                               f"from the {self.weather_backend} backend")
         return self.last_current_weather
 
+    def set_current_weather(self, weather: WeatherInformation) -> None:
+        """Cache weather, which was fetched just now, as the current weather."""
+
+        self.last_current_weather = weather
+        self.last_current_weather_fetched = datetime.now()
+
+    def current_weather_is_stale(self) -> bool:
+        """Whether the cached current weather information should be requested again.
+
+        This is measured from when the weather was fetched, not from its observation time, which
+        can already be more than ten minutes old when it is fetched.
+        """
+
+        if self.last_current_weather_fetched is None:
+            return True
+
+        time_since_last_update = datetime.now() - self.last_current_weather_fetched
+        return time_since_last_update > timedelta(minutes=10)
+
     def get_current_air_pollution(self) -> AirPollutionInformation:
         """Get current air pollution information for this location.
 
@@ -328,3 +507,85 @@ class OpenWeatherMapLocation:
                 self.last_current_air_pollution = self.owm.get_current_air_pollution(self.coord)
 
         return self.last_current_air_pollution
+
+class WeatherEndpointStrategy:
+    """Strategy to refresh the current weather of a list of locations.
+
+    Strategies fill the cache of stale locations, so that OpenWeatherMapLocation.get_current_weather
+    returns the refreshed information without an additional API call.
+    """
+
+    name: str = "current"
+
+    def calls_per_refresh(self, locations: list[OpenWeatherMapLocation]) -> int:
+        """Number of API calls needed to refresh all locations."""
+        return len(locations)
+
+    def refresh(self, owm: OpenWeatherMap, locations: list[OpenWeatherMapLocation]) -> None:
+        """Refresh the current weather of all stale locations.
+
+        The Current Weather API is called per location by get_current_weather, so nothing is done
+        here.
+        """
+
+class OneCallStrategy(WeatherEndpointStrategy):
+    """Use the One Call API 3.0 per location."""
+
+    name = "onecall"
+
+    def refresh(self, owm: OpenWeatherMap, locations: list[OpenWeatherMapLocation]) -> None:
+        """Refresh the current weather of all stale locations with one call per location."""
+        for loc in locations:
+            if loc.current_weather_is_stale():
+                loc.set_current_weather(owm.get_one_call_weather(loc.coord))
+
+class GroupStrategy(WeatherEndpointStrategy):
+    """Use the group endpoint for locations with a city ID, in batches of up to 20 cities.
+
+    Locations without a city ID fall back to the Current Weather API.
+    """
+
+    name = "group"
+
+    def calls_per_refresh(self, locations: list[OpenWeatherMapLocation]) -> int:
+        """One call per batch of locations with a city ID, and one per location without."""
+        with_id = len([loc for loc in locations if loc.city_id is not None])
+        batches = -(-with_id // GROUP_WEATHER_MAX_IDS)
+        return batches + len(locations) - with_id
+
+    def refresh(self, owm: OpenWeatherMap, locations: list[OpenWeatherMapLocation]) -> None:
+        """Refresh the stale locations with a city ID with one call per batch."""
+        stale = [
+            (loc.city_id, loc) for loc in locations
+            if loc.city_id is not None and loc.current_weather_is_stale()
+        ]
+
+        for start in range(0, len(stale), GROUP_WEATHER_MAX_IDS):
+            batch = stale[start:start + GROUP_WEATHER_MAX_IDS]
+            weather = owm.get_group_weather([city_id for city_id, _ in batch])
+            for city_id, loc in batch:
+                try:
+                    loc.set_current_weather(weather[city_id])
+                except KeyError:
+                    pass
+
+WEATHER_ENDPOINT_STRATEGIES: dict[str, WeatherEndpointStrategy] = {
+    strategy.name: strategy
+    for strategy in [WeatherEndpointStrategy(), OneCallStrategy(), GroupStrategy()]
+}
+
+def choose_weather_strategy(
+    names: list[str],
+    locations: list[OpenWeatherMapLocation]
+    ) -> WeatherEndpointStrategy:
+    """Choose the strategy with the fewest API calls per refresh out of the given strategy names.
+
+    Ties are broken by the order of names. The One Call API takes as many calls as the Current
+    Weather API, but is billed by its own subscription, so onecall is used whenever it is given.
+    """
+
+    if OneCallStrategy.name in names:
+        return WEATHER_ENDPOINT_STRATEGIES[OneCallStrategy.name]
+
+    candidates = [WEATHER_ENDPOINT_STRATEGIES[name] for name in names]
+    return min(candidates, key=lambda strategy: strategy.calls_per_refresh(locations))
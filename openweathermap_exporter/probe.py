@@ -0,0 +1,236 @@
+"""
+    probe.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+from collections import OrderedDict
+from math import isfinite
+from threading import Event, Lock
+from time import monotonic, time
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
+
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+
+from metrics import (
+    AIR_POLLUTION_METRICS, OPEN_METEO_AIR_QUALITY_METRICS, WEATHER_METRICS, MetricSpec,
+    family_header
+)
+from openmeteo import OpenMeteo, OpenMeteoCurrentAirQualityForecast
+from geocoding import Geocoder
+from openweathermap import Coordinate, GeocodingMiss, OpenWeatherMap
+
+if TYPE_CHECKING:
+    # Not imported at runtime, importing server registers the exporter_ready gauge
+    from server import ExporterHandler
+
+class Flight:
+    """A fetch in progress, which concurrent requests for the same key wait for."""
+
+    done: Event
+    result: Optional[bytes] = None
+    error: Optional[Exception] = None
+
+    def __init__(self):
+        self.done = Event()
+
+class ProbeCache:
+    """Least recently used cache of probe results, bounded in size and age.
+
+    Concurrent requests for a key which is not cached collapse into one fetch.
+    Failed fetches are not cached.
+    """
+
+    max_entries: int
+    ttl: float
+    # Key to the monotonic expiry time and the result, least recently used first
+    entries: OrderedDict[tuple, tuple[float, bytes]]
+    flights: dict[tuple, Flight]
+    lock: Lock
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.flights = {}
+        self.lock = Lock()
+
+    def get(self, key: tuple, fetch: Callable[[], bytes]) -> bytes:
+        """Get the cached result for key, or fetch it if it is missing or expired."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self.entries.move_to_end(key)
+                return entry[1]
+
+            flight = self.flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            assert flight.result is not None
+            return flight.result
+
+        try:
+            flight.result = fetch()
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self.lock:
+                if flight.result is not None:
+                    self.entries[key] = (monotonic() + self.ttl, flight.result)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+                del self.flights[key]
+            flight.done.set()
+
+        return flight.result
+
+def iter_probe_lines(specs: list[MetricSpec], values: tuple, missing_values: str) -> Iterator[str]:
+    """Generate text format lines without labels for the values of specs."""
+
+    for spec, val in zip(specs, values):
+        if val is None:
+            if missing_values == "omit":
+                continue
+            val = 0 if missing_values == "zero" else float("nan")
+        yield from family_header(spec)
+        yield f"{spec.name} {float(val)}\n"
+
+class Prober:
+    """On demand metrics of a coordinate or location, in the style of the blackbox exporter.
+
+    The metrics have no labels, Prometheus adds the labels of the probed target.
+    Results are cached per coordinate rounded to coordinate_precision decimals and the
+    data is requested for that rounded coordinate.
+    """
+
+    owm: OpenWeatherMap
+    om: Optional[OpenMeteo]
+    geocoder: Geocoder
+    cache: ProbeCache
+    coordinate_precision: int
+    missing_values: str
+
+    def __init__(self, owm: OpenWeatherMap, om: Optional[OpenMeteo] = None, **kwargs):
+        """Create a prober using owm, and om for the Open-Meteo air quality if given.
+
+        Accepted keyword arguments:
+        cache_size: int, maximum number of cached coordinates, defaults to 1000
+        ttl: float, seconds a result is cached, defaults to 600
+        coordinate_precision: int, decimals of the cache key, defaults to 2
+        missing_values: str, mode for missing values, see GaugeSet
+        geocoder: Geocoder, for probes by name, defaults to the OpenWeatherMap geocoder
+        """
+        self.owm = owm
+        self.om = om
+        self.geocoder = kwargs.get("geocoder") or Geocoder([("owm", owm.geocode)])
+        self.cache = ProbeCache(kwargs.get("cache_size", 1000), kwargs.get("ttl", 600))
+        self.coordinate_precision = kwargs.get("coordinate_precision", 2)
+        self.missing_values = kwargs.get("missing_values", "zero")
+
+    def coordinate_of(self, params: dict[str, list[str]]) -> Coordinate:
+        """The coordinate of lat= and lon=, or of the geocoded name= and cc= query parameters.
+
+        Raises ValueError for invalid parameters and GeocodingMiss if the location is not found.
+        """
+
+        try:
+            lat, lon = float(params["lat"][0]), float(params["lon"][0])
+        except KeyError:
+            pass
+        else:
+            # float() also accepts nan and inf
+            if not (isfinite(lat) and isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+                raise ValueError("lat must be between -90 and 90 and lon between -180 and 180")
+            return Coordinate(lat=lat, lon=lon)
+        try:
+            location_name, country_code = params["name"][0], params["cc"][0]
+        except KeyError:
+            raise ValueError("Either lat and lon or name and cc are required") from None
+
+        result = self.geocoder.geocode(location_name, country_code)
+        if result.coord is None:
+            raise GeocodingMiss(
+                f"{location_name},{country_code} could not be geocoded: {result.status}")
+        return result.coord
+
+    def fetch(self, coord: Coordinate) -> bytes:
+        """Request all data for coord and render it in the text format."""
+
+        weather = self.owm.get_current_weather(coord)
+        air_pollution = self.owm.get_current_air_pollution(coord)
+        lines = list(iter_probe_lines(WEATHER_METRICS, weather.values, self.missing_values))
+        lines += iter_probe_lines(AIR_POLLUTION_METRICS, air_pollution.values, self.missing_values)
+
+        if self.om is not None:
+            forecast = self.om.get_air_quality(coord)
+            air_quality = OpenMeteoCurrentAirQualityForecast(
+                forecast.index_of(time()), forecast)
+            lines += iter_probe_lines(
+                OPEN_METEO_AIR_QUALITY_METRICS, air_quality.values, self.missing_values)
+
+        return "".join(lines).encode("utf-8")
+
+    def probe(self, coord: Coordinate) -> bytes:
+        """Metrics of coord, from the cache if possible."""
+
+        key = (round(coord.lat, self.coordinate_precision),
+               round(coord.lon, self.coordinate_precision))
+        return self.cache.get(key, lambda: self.fetch(Coordinate(lat=key[0], lon=key[1])))
+
+    def route(self, handler: "ExporterHandler", params: dict[str, list[str]]) -> None:
+        """Serve /probe, failed probes are answered with probe_success 0."""
+
+        start = monotonic()
+        success = 1
+        body = ""
+        try:
+            coord = self.coordinate_of(params)
+        except ValueError as exc:
+            handler.send_text(400, f"{exc}\n")
+            return
+        except GeocodingMiss as exc:
+            print(f"Probe failed, {exc}")
+            success = 0
+        else:
+            try:
+                body = self.probe(coord).decode("utf-8")
+            # Any failure is reported as probe_success 0, like a failed scrape
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                print(f"Probe of {coord} failed: {exc}")
+                success = 0
+
+        body += ("# TYPE probe_success gauge\n"
+                 "# HELP probe_success Whether the probe succeeded\n"
+                 f"probe_success {success}\n"
+                 "# TYPE probe_duration_seconds gauge\n"
+                 "# HELP probe_duration_seconds Duration of the probe in seconds\n"
+                 f"probe_duration_seconds {monotonic() - start}\n")
+        handler.send_text(200, body, CONTENT_TYPE_LATEST)
@@ -0,0 +1,229 @@
+"""
+    profiler.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import json
+import sys
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from os import makedirs, path
+from threading import Lock, Thread, enumerate as enumerate_threads, get_ident, local
+from time import perf_counter, sleep
+from typing import TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    # Not imported at runtime, importing server registers the exporter_ready gauge
+    from server import ExporterHandler
+
+REFRESH_PHASES: list[str] = ["fetch", "decode", "parse", "publish"]
+
+MAX_PROFILE_SECONDS: float = 300
+DEFAULT_SAMPLE_INTERVAL: float = 0.01
+
+class RefreshTimings:
+    """Time spent per phase of the last refreshes.
+
+    Phases only count on a thread between start() and finish(), so API requests of
+    probes on the server threads are not added to the refresh. Phases can be nested;
+    the time of a nested phase is not counted in the enclosing phase.
+    """
+
+    history: deque
+    lock: Lock
+
+    def __init__(self, history_size: int = 10):
+        self.history = deque(maxlen=history_size)
+        self.lock = Lock()
+        self.local = local()
+
+    def start(self) -> None:
+        """Start timing a refresh on the current thread."""
+
+        self.local.refresh = {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "phases": dict.fromkeys(REFRESH_PHASES, 0.0)
+        }
+        self.local.start = perf_counter()
+        self.local.stack = []
+
+    def finish(self) -> None:
+        """Finish the refresh of the current thread and add it to the history."""
+
+        refresh = getattr(self.local, "refresh", None)
+        if refresh is None:
+            return
+        refresh["duration_seconds"] = perf_counter() - self.local.start
+        self.local.refresh = None
+        with self.lock:
+            self.history.append(refresh)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the time spent in the block to phase name of the current refresh."""
+
+        refresh = getattr(self.local, "refresh", None)
+        if refresh is None:
+            yield
+            return
+
+        stack = self.local.stack
+        stack.append(0.0)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            nested = stack.pop()
+            refresh["phases"][name] = refresh["phases"].get(name, 0.0) + elapsed - nested
+            if stack:
+                stack[-1] += elapsed
+
+    def to_json(self) -> str:
+        """The history of refreshes, oldest first, as JSON."""
+
+        with self.lock:
+            return json.dumps(list(self.history), indent=2)
+
+refresh_timings = RefreshTimings()
+
+def frame_stack(frame) -> list[str]:
+    """Names of the functions on the stack of frame, outermost first."""
+
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+def sample_once(samples: Counter, own_ident: int) -> None:
+    """Add one sample of the stacks of all threads but own_ident to samples.
+
+    The frames are only referenced while sampling, so they are not kept alive in between.
+    """
+
+    names = {thread.ident: thread.name for thread in enumerate_threads()}
+    for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+        if ident == own_ident:
+            continue
+        stack = [names.get(ident, str(ident))] + frame_stack(frame)
+        samples[";".join(stack)] += 1
+
+def sample_stacks(seconds: float, interval: float = DEFAULT_SAMPLE_INTERVAL) -> Counter:
+    """Sample the stacks of all other threads every interval for seconds.
+
+    Returns the number of samples per collapsed stack, which starts with the thread name.
+    Sampling only reads sys._current_frames(), so the sampled threads are not slowed down
+    besides holding the GIL while a sample is taken.
+    """
+
+    samples: Counter = Counter()
+    own_ident = get_ident()
+    end = perf_counter() + seconds
+
+    while perf_counter() < end:
+        sample_once(samples, own_ident)
+        sleep(interval)
+
+    return samples
+
+def format_collapsed(samples: Counter) -> str:
+    """Format samples as collapsed stacks, as read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+class Profiler:
+    """Serve sampling profiles and refresh timings, and write a profile on a signal.
+
+    Only one profile is taken at a time.
+    """
+
+    directory: Optional[str]
+    signal_seconds: float
+    lock: Lock
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        signal_seconds: float = 30,
+        timings: RefreshTimings = refresh_timings
+        ):
+        self.directory = directory
+        self.signal_seconds = signal_seconds
+        self.timings = timings
+        self.lock = Lock()
+
+    def profile(self, seconds: float, interval: float = DEFAULT_SAMPLE_INTERVAL) -> Optional[str]:
+        """Collapsed stacks of a profile of seconds, None if a profile is already running."""
+
+        if not self.lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return None
+        try:
+            return format_collapsed(sample_stacks(seconds, interval))
+        finally:
+            self.lock.release()
+
+    def write_profile(self) -> None:
+        """Write a profile of signal_seconds to a file in directory."""
+
+        result = self.profile(self.signal_seconds)
+        if result is None:
+            print("Profile already running, ignoring signal")
+            return
+
+        makedirs(self.directory or ".", exist_ok=True)
+        filename = path.join(self.directory or ".",
+                             f"profile-{datetime.now():%Y%m%dT%H%M%S}.collapsed")
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(result)
+        print(f"Wrote profile to {filename}")
+
+    def handle_signal(self, _signum, _frame) -> None:
+        """Signal handler, which profiles on another thread so the interrupted thread continues."""
+        Thread(target=self.write_profile, daemon=True).start()
+
+    def profile_route(self, handler: "ExporterHandler", params: dict[str, list[str]]) -> None:
+        """Answer with the collapsed stacks of a profile of ?seconds=N (default 10)."""
+
+        try:
+            seconds = float(params.get("seconds", ["10"])[0])
+            interval = float(params.get("interval", [str(DEFAULT_SAMPLE_INTERVAL)])[0])
+        except ValueError:
+            handler.send_text(400, "seconds and interval must be numbers\n")
+            return
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or not 0 < interval <= seconds:
+            handler.send_text(400, f"seconds must be between 0 and {MAX_PROFILE_SECONDS}, "
+                                   "interval between 0 and seconds\n")
+            return
+
+        result = self.profile(seconds, interval)
+        if result is None:
+            handler.send_text(409, "profile already running\n")
+            return
+        handler.send_text(200, result)
+
+    def timings_route(self, handler: "ExporterHandler", _params: dict[str, list[str]]) -> None:
+        """Answer with the phase timings of the last refreshes as JSON."""
+        handler.send_text(200, self.timings.to_json(), "application/json")
@@ -0,0 +1,250 @@
+"""
+    remote_write.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import struct
+from math import isnan
+from queue import Full, Queue
+from threading import Thread
+from time import sleep, time
+from typing import Callable, Iterator, Optional
+
+from prometheus_client import REGISTRY, CollectorRegistry
+
+try:
+    import snappy  # type: ignore[import-not-found]
+    SNAPPY_COMPRESS: Optional[Callable[[bytes], bytes]] = snappy.compress
+except ImportError:
+    SNAPPY_COMPRESS = None
+
+REMOTE_WRITE_HEADERS: dict[str, str] = {
+    "Content-Encoding": "snappy",
+    "Content-Type": "application/x-protobuf",
+    "X-Prometheus-Remote-Write-Version": "0.1.0"
+}
+
+# Maximum literal length with a two byte length in the snappy format
+SNAPPY_MAX_LITERAL = 1 << 16
+
+def encode_varint(value: int) -> bytes:
+    """Encode an unsigned integer as a protobuf varint."""
+
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def encode_length_delimited(field: int, payload: bytes) -> bytes:
+    """Encode a length delimited protobuf field."""
+    return encode_varint(field << 3 | 2) + encode_varint(len(payload)) + payload
+
+def encode_time_series(name: str, labels: dict[str, str], value: float, timestamp_ms: int) -> bytes:
+    """Encode one prometheus.TimeSeries with a single sample.
+
+    Labels are sorted by name, with the metric name as __name__ label, as remote write requires.
+    """
+
+    all_labels = dict(labels)
+    all_labels["__name__"] = name
+
+    out = bytearray()
+    for label_name in sorted(all_labels):
+        label = (encode_length_delimited(1, label_name.encode("utf-8"))
+                 + encode_length_delimited(2, str(all_labels[label_name]).encode("utf-8")))
+        out += encode_length_delimited(1, label)
+
+    # Sample: value is a double (wire type 1), timestamp an int64 varint
+    sample = b"\x09" + struct.pack("<d", value) + b"\x10" + encode_varint(timestamp_ms)
+    out += encode_length_delimited(2, sample)
+
+    return bytes(out)
+
+def snappy_compress_literal(data: bytes) -> bytes:
+    """Encode data in the snappy block format using only literals.
+
+    This is valid snappy without compression, used when python-snappy is not installed.
+    """
+
+    out = bytearray(encode_varint(len(data)))
+    for start in range(0, len(data), SNAPPY_MAX_LITERAL):
+        literal = data[start:start + SNAPPY_MAX_LITERAL]
+        # Tag 61 << 2: literal with its length - 1 in the next two bytes
+        out += bytes([61 << 2]) + struct.pack("<H", len(literal) - 1) + literal
+
+    return bytes(out)
+
+class RemoteWriter:
+    """Push samples to a Prometheus remote write endpoint.
+
+    Only samples whose value changed since they were last sent successfully are pushed,
+    in batches of at most batch_size samples. Failed batches are retried with exponential
+    backoff, samples of batches that still fail are sent again with the next push.
+
+    Pushes requested with submit() run on a background thread, so a slow or unavailable
+    endpoint does not delay the refresh.
+    """
+
+    url: str
+    batch_size: int
+    max_retries: int
+    retry_backoff: float
+    timeout: float
+    registry: CollectorRegistry
+    compress: Callable[[bytes], bytes]
+
+    # Last value sent per series
+    sent: dict[tuple, float]
+
+    # Holds at most one pending push request, None stops the thread
+    queue: Queue
+    thread: Thread
+
+    def __init__(self, url: str, **kwargs):
+        """Create a remote writer for url.
+
+        Accepted keyword arguments:
+        batch_size: int, defaults to 500
+        max_retries: int, defaults to 3
+        retry_backoff: float, seconds before the first retry, defaults to 1
+        timeout: float, defaults to 10
+        registry: CollectorRegistry, defaults to the global registry
+        """
+        self.url = url
+        self.batch_size = kwargs.get("batch_size", 500)
+        self.max_retries = kwargs.get("max_retries", 3)
+        self.retry_backoff = kwargs.get("retry_backoff", 1.0)
+        self.timeout = kwargs.get("timeout", 10)
+        self.registry = kwargs.get("registry", REGISTRY)
+        self.compress = SNAPPY_COMPRESS if SNAPPY_COMPRESS is not None else snappy_compress_literal
+        self.sent = {}
+
+        self.queue = Queue(1)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self) -> None:
+        """Request a push on the background thread, without blocking.
+
+        The request is dropped if a push is still pending, as that push sends all changed samples.
+        """
+
+        try:
+            self.queue.put_nowait(True)
+        except Full:
+            pass
+
+    def close(self) -> None:
+        """Finish the pending push and stop the thread."""
+
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self) -> None:
+        """Push every time a push is requested, until close() is called."""
+
+        while self.queue.get() is not None:
+            self.push()
+
+    def changed_samples(self) -> Iterator[tuple[tuple, str, dict[str, str], float]]:
+        """Samples of the registry whose value differs from the last sent value.
+
+        The last sent values of series which are no longer in the registry are dropped.
+        """
+
+        present = set()
+        for metric in self.registry.collect():
+            for sample in metric.samples:
+                key = (sample.name, tuple(sorted(sample.labels.items())))
+                present.add(key)
+                last = self.sent.get(key)
+                # NaN never equals itself, a missing value exported as NaN is only sent once
+                if last is None or (last != sample.value
+                                    and not (isnan(last) and isnan(sample.value))):
+                    yield key, sample.name, sample.labels, sample.value
+
+        for key in self.sent.keys() - present:
+            del self.sent[key]
+
+    def push(self) -> int:
+        """Push all changed samples, returns the number of samples sent successfully.
+
+        The push stops at the first batch that fails, so an unavailable endpoint costs the
+        retries of one batch. The remaining samples are sent with the next push.
+        """
+
+        timestamp_ms = int(time() * 1000)
+        sent_count = 0
+        batch: list[tuple[tuple, bytes, float]] = []
+
+        for key, name, labels, value in self.changed_samples():
+            batch.append((key, encode_time_series(name, labels, value, timestamp_ms), value))
+            if len(batch) >= self.batch_size:
+                if not self.send_batch(batch):
+                    return sent_count
+                sent_count += len(batch)
+                batch = []
+        if batch and self.send_batch(batch):
+            sent_count += len(batch)
+
+        return sent_count
+
+    def send_batch(self, batch: list[tuple[tuple, bytes, float]]) -> bool:
+        """Send one WriteRequest, returns whether it was sent successfully."""
+
+        write_request = b"".join(encode_length_delimited(1, series) for _, series, _ in batch)
+        if self.post(self.compress(write_request)):
+            for key, _, value in batch:
+                self.sent[key] = value
+            return True
+
+        return False
+
+    def post(self, body: bytes) -> bool:
+        """POST body, retrying on connection errors, 429 and 5xx responses."""
+
+        # Imported here, since importing requests is a large part of the startup time
+        import requests  # pylint: disable=import-outside-toplevel
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                resp = requests.post(self.url, data=body, headers=REMOTE_WRITE_HEADERS,
+                                     timeout=self.timeout)
+            except requests.RequestException as exc:
+                print(f"Remote write to {self.url} failed: {exc}")
+                continue
+
+            if resp.status_code < 300:
+                return True
+            print(f"Remote write to {self.url} failed with status {resp.status_code}")
+            if resp.status_code != 429 and resp.status_code < 500:
+                return False
+
+        return False
@@ -0,0 +1,103 @@
+"""
+    server.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+from http.server import ThreadingHTTPServer
+from threading import Event, Thread
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+
+from prometheus_client import Gauge
+from prometheus_client.exposition import MetricsHandler
+
+gauge_exporter_ready = Gauge(
+    "exporter_ready",
+    "Whether the exporter has geocoded all locations and finished the first refresh, 1 if ready"
+)
+
+ready = Event()
+
+def set_ready() -> None:
+    """Mark the exporter as ready, after the first refresh of all locations."""
+    ready.set()
+    gauge_exporter_ready.set(1)
+
+class ExporterHandler(MetricsHandler):
+    """HTTP handler serving the metrics and the additional exporter endpoints.
+
+    Requests for paths without a registered route are answered with the metrics.
+    """
+
+    routes: dict[str, Callable[["ExporterHandler", dict[str, list[str]]], None]] = {}
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        try:
+            route = self.routes[url.path]
+        except KeyError:
+            super().do_GET()
+            return
+
+        route(self, parse_qs(url.query))
+
+    def send_text(
+        self,
+        status: int,
+        body: str,
+        content_type: str = "text/plain; charset=utf-8"
+        ) -> None:
+        """Send a complete response with the given body."""
+
+        output = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+def register_route(
+    path: str,
+    route: Callable[[ExporterHandler, dict[str, list[str]]], None]
+    ) -> None:
+    """Serve path with route, which gets the handler and the parsed query parameters."""
+    ExporterHandler.routes[path] = route
+
+def readiness_route(handler: ExporterHandler, _params: dict[str, list[str]]) -> None:
+    """Answer 200 once the exporter is ready, 503 before."""
+
+    if ready.is_set():
+        handler.send_text(200, "ready\n")
+    else:
+        handler.send_text(503, "not ready\n")
+
+register_route("/ready", readiness_route)
+
+def start_server(port: int, host: str) -> ThreadingHTTPServer:
+    """Start the HTTP server in a daemon thread."""
+
+    httpd = ThreadingHTTPServer((host, port), ExporterHandler)
+    httpd.daemon_threads = True
+    Thread(target=httpd.serve_forever, daemon=True).start()
+
+    return httpd
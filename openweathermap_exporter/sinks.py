@@ -0,0 +1,308 @@
+"""
+    sinks.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import json
+from datetime import datetime, timezone
+from os import makedirs, path
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import monotonic
+from typing import Any, NamedTuple, Optional, TextIO
+
+from openweathermap import AIR_POLLUTION_ATTRS, WEATHER_ATTRS, OpenWeatherMapLocation
+from openmeteo import AIR_QUALITY_ATTRS, OpenMeteoLocation
+
+class Observation(NamedTuple):
+    """One parsed observation of a location from one source."""
+    source: str
+    timestamp: float
+    tags: dict[str, str]
+    fields: dict[str, float]
+
+def make_observation(
+    source: str,
+    timestamp: float,
+    tags: dict,
+    attrs: list[str],
+    values: tuple
+    ) -> Observation:
+    """Observation with the present values of a values tuple as fields named after attrs."""
+
+    return Observation(
+        source,
+        timestamp,
+        {name: str(value) for name, value in tags.items()},
+        {attr: float(val) for attr, val in zip(attrs, values) if val is not None}
+    )
+
+def location_observations(
+    owml: OpenWeatherMapLocation,
+    oml: Optional[OpenMeteoLocation],
+    tags: dict
+    ) -> list[Observation]:
+    """Observations of the last refresh of a location.
+
+    The current Open-Meteo air quality is left out when it has no timestamp."""
+
+    weather = owml.get_current_weather()
+    air_pollution = owml.get_current_air_pollution()
+    observations = [
+        make_observation("weather", weather.timestamp.timestamp(), tags,
+                         WEATHER_ATTRS, weather.values),
+        make_observation("air_pollution", air_pollution.timestamp.timestamp(), tags,
+                         AIR_POLLUTION_ATTRS, air_pollution.values)
+    ]
+    if oml is not None:
+        air_quality = oml.get_current_air_quality()
+        if air_quality.timestamp is not None:
+            observations.append(make_observation("open_meteo_air_quality", air_quality.timestamp,
+                                                 tags, AIR_QUALITY_ATTRS, air_quality.values))
+    return observations
+
+def format_jsonl(observation: Observation) -> str:
+    """Format an observation as one JSON line."""
+
+    return json.dumps({
+        "source": observation.source,
+        "time": observation.timestamp,
+        "tags": observation.tags,
+        "fields": observation.fields
+    }) + "\n"
+
+def escape_line_protocol(value: str) -> str:
+    """Escape a measurement, tag key or tag value for the InfluxDB line protocol."""
+    return value.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+def format_line_protocol(observation: Observation) -> str:
+    """Format an observation in the InfluxDB line protocol with a nanosecond timestamp.
+
+    Observations without fields can not be written in the line protocol and give an empty string.
+    """
+
+    if not observation.fields:
+        return ""
+
+    tags = "".join(
+        f",{escape_line_protocol(name)}={escape_line_protocol(value)}"
+        for name, value in sorted(observation.tags.items()) if value != ""
+    )
+    fields = ",".join(
+        f"{escape_line_protocol(name)}={value!r}" for name, value in observation.fields.items())
+    timestamp_ns = int(observation.timestamp * 1e9)
+    return f"{escape_line_protocol(observation.source)}{tags} {fields} {timestamp_ns}\n"
+
+TEXT_FORMATS = {
+    "jsonl": format_jsonl,
+    "line_protocol": format_line_protocol
+}
+FILE_EXTENSIONS = {
+    "jsonl": "jsonl",
+    "line_protocol": "lp",
+    "parquet": "parquet"
+}
+
+class TextFile:
+    """Append formatted observations to a text file."""
+
+    f: TextIO
+    size: int = 0
+
+    def __init__(self, filename: str, format_name: str):
+        # The file stays open for all writes until close() is called
+        self.f = open(filename, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.format = TEXT_FORMATS[format_name]
+
+    def write(self, observations: list[Observation]) -> None:
+        """Append observations and flush them to the file."""
+        data = "".join(self.format(observation) for observation in observations)
+        self.f.write(data)
+        self.f.flush()
+        self.size += len(data.encode("utf-8"))
+
+    def close(self) -> None:
+        """Close the file."""
+        self.f.close()
+
+class ParquetFile:
+    """Write observations to a Parquet file, one row group per write.
+
+    Tags and fields are stored as maps, so all sources share one schema.
+    """
+
+    size: int = 0
+
+    def __init__(self, filename: str, _format_name: str):
+        try:
+            # Optional dependency, only needed for the parquet format
+            import pyarrow  # pylint: disable=import-outside-toplevel
+            import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            raise RuntimeError("The parquet sink format requires pyarrow, "
+                               "install it with pip install pyarrow") from None
+
+        self.pa = pyarrow
+        self.filename = filename
+        self.schema = pyarrow.schema([
+            ("source", pyarrow.string()),
+            ("time", pyarrow.timestamp("ms", tz="UTC")),
+            ("tags", pyarrow.map_(pyarrow.string(), pyarrow.string())),
+            ("fields", pyarrow.map_(pyarrow.string(), pyarrow.float64()))
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema)
+
+    def write(self, observations: list[Observation]) -> None:
+        """Write observations as one row group."""
+        table = self.pa.Table.from_pydict({
+            "source": [o.source for o in observations],
+            "time": [datetime.fromtimestamp(o.timestamp, timezone.utc) for o in observations],
+            "tags": [list(o.tags.items()) for o in observations],
+            "fields": [list(o.fields.items()) for o in observations]
+        }, schema=self.schema)
+        self.writer.write_table(table)
+        self.size = path.getsize(self.filename)
+
+    def close(self) -> None:
+        """Write the footer and close the file, which can only be read after closing."""
+        self.writer.close()
+
+class ObservationSink:
+    """Append observations to rotating files on a background thread.
+
+    submit() never blocks: observations are queued and, if the queue is full, dropped.
+    The thread buffers observations and writes them when flush_records are buffered or
+    flush_interval seconds passed. A new file is started after rotate_seconds or when
+    the file reaches rotate_bytes.
+    """
+
+    format_name: str
+    directory: str
+    flush_records: int
+    flush_interval: float
+    rotate_bytes: int
+    rotate_seconds: float
+    dropped: int = 0
+
+    queue: Queue
+    thread: Thread
+    file: Optional[Any] = None
+    file_opened: float = 0
+
+    def __init__(self, directory: str, **kwargs):
+        """Create a sink writing to files in directory.
+
+        Accepted keyword arguments:
+        format: str, jsonl, line_protocol or parquet, defaults to jsonl
+        flush_records: int, defaults to 1000
+        flush_interval: float, seconds, defaults to 60
+        rotate_bytes: int, defaults to 100 MiB
+        rotate_seconds: float, defaults to one day
+        queue_size: int, maximum number of queued batches, defaults to 100
+        """
+        self.format_name = kwargs.get("format", "jsonl")
+        if self.format_name not in FILE_EXTENSIONS:
+            raise ValueError(f"Unknown sink format: {self.format_name}")
+        self.directory = directory
+        self.flush_records = kwargs.get("flush_records", 1000)
+        self.flush_interval = kwargs.get("flush_interval", 60)
+        self.rotate_bytes = kwargs.get("rotate_bytes", 100 * 1024 * 1024)
+        self.rotate_seconds = kwargs.get("rotate_seconds", 86400)
+        self.queue = Queue(kwargs.get("queue_size", 100))
+
+        makedirs(directory, exist_ok=True)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, observations: list[Observation]) -> None:
+        """Queue observations for writing, without blocking."""
+
+        try:
+            self.queue.put_nowait(observations)
+        except Full:
+            self.dropped += len(observations)
+            print(f"Observation sink queue is full, dropped {len(observations)} observations")
+
+    def close(self) -> None:
+        """Write all queued observations and stop the thread."""
+
+        self.queue.put(None)
+        self.thread.join()
+
+    def new_filename(self) -> str:
+        """Name of the next file, after the current UTC time."""
+
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        extension = FILE_EXTENSIONS[self.format_name]
+        filename = path.join(self.directory, f"observations-{stamp}.{extension}")
+        count = 1
+        while path.exists(filename):
+            filename = path.join(self.directory, f"observations-{stamp}-{count}.{extension}")
+            count += 1
+        return filename
+
+    def write(self, observations: list[Observation]) -> None:
+        """Write observations to the current file, rotating it first if needed."""
+
+        if self.file is not None and (self.file.size >= self.rotate_bytes
+                                      or monotonic() - self.file_opened >= self.rotate_seconds):
+            self.file.close()
+            self.file = None
+        if self.file is None:
+            file_class = ParquetFile if self.format_name == "parquet" else TextFile
+            self.file = file_class(self.new_filename(), self.format_name)
+            self.file_opened = monotonic()
+
+        self.file.write(observations)
+
+    def run(self) -> None:
+        """Buffer and write queued observations until close() is called."""
+
+        buffer: list[Observation] = []
+        deadline = monotonic() + self.flush_interval
+        stopping = False
+
+        while not stopping:
+            try:
+                observations = self.queue.get(timeout=max(deadline - monotonic(), 0))
+                if observations is None:
+                    stopping = True
+                else:
+                    buffer.extend(observations)
+            except Empty:
+                pass
+
+            flush_due = stopping or len(buffer) >= self.flush_records or monotonic() >= deadline
+            if buffer and flush_due:
+                try:
+                    self.write(buffer)
+                # Any failure drops the buffer, the thread keeps running for the next writes
+                except Exception as exc:  # pylint: disable=broad-exception-caught
+                    print(f"Writing {len(buffer)} observations failed: {exc}")
+                buffer = []
+            if monotonic() >= deadline:
+                deadline = monotonic() + self.flush_interval
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
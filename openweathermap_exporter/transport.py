@@ -0,0 +1,187 @@
+"""
+    transport.py
+
+    Copyright (c) 2023 Martijn <martijn [at] mrtijn.nl>
+
+    https://github.com/m-rtijn/openweathermap-exporter
+
+    This file is part of openweathermap-exporter.
+
+    openweathermap-exporter is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    openweathermap-exporter is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with openweathermap-exporter. If not, see <https://www.gnu.org/licenses/>.
+
+    SPDX-License-Identifier: AGPL-3.0-or-later
+"""
+
+import gzip
+import json
+from collections import deque
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+from typing import Any, Callable, NamedTuple
+from urllib.parse import urlencode
+
+# Query parameters which are never written to a recording
+REDACTED_PARAMETERS: frozenset[str] = frozenset(["appid"])
+
+class RecordedResponse(NamedTuple):
+    """The part of a response which the API clients use."""
+    status_code: int
+    text: str
+
+class ReplayMiss(LookupError):
+    """A request which is not in the recording being replayed."""
+
+def request_key(url: str, parameters: dict) -> str:
+    """Identify a request by its URL and parameters, without the redacted parameters."""
+
+    query = urlencode(sorted((name, str(value)) for name, value in parameters.items()
+                             if name not in REDACTED_PARAMETERS))
+    return f"{url}?{query}"
+
+class HttpTransport:
+    """Send requests to the APIs."""
+
+    def get(self, url: str, parameters: dict, timeout: float) -> Any:
+        """GET url with parameters, returns the requests response."""
+
+        # Imported here, since importing requests is a large part of the startup time
+        import requests  # pylint: disable=import-outside-toplevel
+
+        return requests.get(url, params=parameters, timeout=timeout)
+
+class RecordingTransport:
+    """Send requests with another transport and append them to a gzip compressed JSON lines file.
+
+    Every line holds the URL, the parameters without API keys, the status, the body and the
+    latency in seconds of one request. Every flush ends a compressed block, so the file is
+    flushed after flush_records requests or flush_interval seconds, and on close(). The
+    requests up to the last flush stay readable when the exporter is killed.
+    """
+
+    flush_records: int
+    flush_interval: float
+    unflushed: int = 0
+    last_flush: float
+
+    def __init__(
+        self,
+        filename: str,
+        inner: Any = None,
+        flush_records: int = 100,
+        flush_interval: float = 60
+        ):
+        self.inner = inner if inner is not None else HttpTransport()
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        # The file stays open for all requests until close() is called
+        self.file = gzip.open(filename, "at", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.lock = Lock()
+        self.last_flush = monotonic()
+
+    def get(self, url: str, parameters: dict, timeout: float) -> Any:
+        """Send the request with the inner transport and append it to the recording."""
+
+        start = perf_counter()
+        resp = self.inner.get(url, parameters, timeout)
+        elapsed = perf_counter() - start
+
+        line = json.dumps({
+            "url": url,
+            "parameters": {name: value for name, value in parameters.items()
+                           if name not in REDACTED_PARAMETERS},
+            "status": resp.status_code,
+            "elapsed": round(elapsed, 6),
+            "body": resp.text
+        })
+        with self.lock:
+            self.file.write(line + "\n")
+            self.unflushed += 1
+            if (self.unflushed >= self.flush_records
+                    or monotonic() - self.last_flush >= self.flush_interval):
+                self.file.flush()
+                self.unflushed = 0
+                self.last_flush = monotonic()
+
+        return resp
+
+    def close(self) -> None:
+        """Write the remaining requests and close the recording."""
+
+        with self.lock:
+            self.file.close()
+
+class ReplayTransport:
+    """Answer requests from a recording of RecordingTransport, without sending them.
+
+    Requests are matched on URL and parameters. If a request was recorded more than once,
+    the responses are returned in the recorded order and start over after the last one.
+    Every response is delayed by its recorded latency times latency_scale.
+    """
+
+    responses: dict[str, deque]
+
+    def __init__(
+        self,
+        filename: str,
+        latency_scale: float = 1.0,
+        delay: Callable[[float], None] = sleep
+        ):
+        self.latency_scale = latency_scale
+        self.delay = delay
+        self.lock = Lock()
+        self.responses = {}
+
+        with gzip.open(filename, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if not line.endswith("\n"):
+                        continue
+                    record = json.loads(line)
+                    key = request_key(record["url"], record["parameters"])
+                    self.responses.setdefault(key, deque()).append(
+                        (RecordedResponse(record["status"], record["body"]), record["elapsed"]))
+            except EOFError:
+                # The recording of a killed exporter has no gzip trailer, all flushed lines are
+                # complete
+                pass
+
+    def get(self, url: str, parameters: dict, timeout: float) -> RecordedResponse:
+        """The next recorded response of the request, raises ReplayMiss if it was not recorded."""
+
+        key = request_key(url, parameters)
+        with self.lock:
+            try:
+                recorded = self.responses[key]
+            except KeyError:
+                raise ReplayMiss(f"Request not in recording: {key}") from None
+            resp, elapsed = recorded[0]
+            recorded.rotate(-1)
+
+        if self.latency_scale > 0:
+            self.delay(min(elapsed * self.latency_scale, timeout))
+        return resp
+
+# The transport used by the API clients
+transport: Any = HttpTransport()
+
+def set_transport(new_transport: Any) -> None:
+    """Use new_transport for all following API requests."""
+    global transport  # pylint: disable=global-statement
+    transport = new_transport
+
+def http_get(url: str, parameters: dict, timeout: float) -> Any:
+    """Do a GET request with the current transport.
+
+    Returns an object with status_code and text, like a requests response."""
+    return transport.get(url, parameters, timeout)
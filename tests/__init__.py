@@ -0,0 +1,6 @@
+import sys
+from os import path
+
+# The exporter modules import each other as top-level modules, like they are
+# when the exporter is started with `python openweathermap_exporter`.
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "openweathermap_exporter"))
@@ -0,0 +1,86 @@
+import re
+import unittest
+from math import isnan
+from os import path
+
+import yaml
+from prometheus_client import CollectorRegistry
+
+from openweathermap_exporter import aggregates
+from openweathermap_exporter.metrics import WEATHER_METRICS
+
+TEMP = [spec.name for spec in WEATHER_METRICS].index("weather_temp")
+
+def weather_values(temp):
+    values = [None] * len(WEATHER_METRICS)
+    values[TEMP] = temp
+    return tuple(values)
+
+class AggregatesTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.aggregates = aggregates.RegionalAggregates(
+            {"statistics": ["min", "max", "mean", "p50"], "groups": {"randstad": ["Utrecht", "Delft"]}},
+            [("NL", "Utrecht"), ("NL", "Delft"), ("NL", "Groningen"), ("BE", "Gent")],
+            missing_values="nan",
+            registry=self.registry
+        )
+
+    def value(self, aggregate_by, group, statistic):
+        return self.registry.get_sample_value(
+            "weather_temp_aggregate", {"aggregate_by": aggregate_by, "group": group, "statistic": statistic})
+
+    def test_aggregates(self):
+        for slot, temp in enumerate([10.0, 12.0, 5.0, None]):
+            self.aggregates.update("weather", slot, weather_values(temp))
+        self.aggregates.set_metrics()
+
+        self.assertEqual(self.value("country", "NL", "min"), 5.0)
+        self.assertEqual(self.value("country", "NL", "max"), 12.0)
+        self.assertEqual(self.value("country", "NL", "mean"), 9.0)
+        self.assertEqual(self.value("country", "NL", "p50"), 10.0)
+        self.assertEqual(self.value("region", "randstad", "p50"), 11.0)
+        self.assertTrue(isnan(self.value("country", "BE", "mean")))
+
+        # Only groups with a changed member are computed again
+        self.aggregates.update("weather", 2, weather_values(5.0))
+        self.aggregates.update("air_pollution", 2, ())
+        self.assertEqual(self.aggregates.dirty, set())
+        self.aggregates.update("weather", 3, weather_values(8.0))
+        self.assertEqual(self.aggregates.dirty, {("country", "BE")})
+        self.aggregates.set_metrics()
+        self.assertEqual(self.value("country", "BE", "mean"), 8.0)
+
+    def test_remove_location(self):
+        for slot, temp in enumerate([10.0, 12.0, 5.0, 8.0]):
+            self.aggregates.update("weather", slot, weather_values(temp))
+        self.aggregates.set_metrics()
+
+        # Gent moves into the slot of Delft, and is removed from it next
+        self.aggregates.remove_location(1)
+        self.aggregates.remove_location(1)
+        self.aggregates.set_metrics()
+
+        self.assertEqual(self.value("country", "NL", "max"), 10.0)
+        self.assertEqual(self.value("region", "randstad", "max"), 10.0)
+        self.assertIsNone(self.value("country", "BE", "max"))
+        self.assertNotIn(("country", "BE"), self.aggregates.groups)
+        self.assertEqual(len(self.aggregates.values["weather_temp"]), 2)
+
+    def test_readme_example(self):
+        with open(path.join(path.dirname(__file__), "..", "README.md"), encoding="utf-8") as f:
+            readme = f.read()
+        section = readme[readme.index("# Regional aggregates"):]
+        example = yaml.safe_load(re.search(r"```yaml\n(.*?)```", section, re.DOTALL).group(1))
+
+        conf = example["prometheus_exporter"]["aggregates"]
+        regional = aggregates.RegionalAggregates(
+            conf, [("NL", "Utrecht"), ("NL", "Delft"), ("NL", "Leiden")], registry=CollectorRegistry())
+        self.assertEqual(regional.metrics, conf["metrics"])
+
+    def test_percentile(self):
+        self.assertEqual(aggregates.percentile([1.0, 2.0, 3.0, 4.0], 90), 3.7)
+        self.assertEqual(aggregates.percentile([1.0], 50), 1.0)
+        with self.assertRaises(ValueError):
+            aggregates.validate_statistic("p101")
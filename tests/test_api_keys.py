@@ -0,0 +1,54 @@
+import unittest
+
+from prometheus_client import CollectorRegistry
+
+from openweathermap_exporter.api_keys import ApiKey, ApiKeyPool, ApiKeyPoolExhausted
+
+class Clock:
+    def __init__(self, now: float = 1700000000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+class ApiKeyPoolTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.pool = ApiKeyPool([
+            ApiKey("secret-a", name="a", calls_per_minute=2),
+            ApiKey("secret-b", name="b", calls_per_minute=4)
+        ], max_wait=0, clock=self.clock)
+
+    def test_spread_by_remaining_quota(self):
+        names = [self.pool.acquire().name for _ in range(6)]
+        self.assertEqual(sorted(names), ["a", "a", "b", "b", "b", "b"])
+        with self.assertRaises(ApiKeyPoolExhausted):
+            self.pool.acquire()
+
+        # A new minute resets the quota
+        self.clock.now += 60
+        self.assertIn(self.pool.acquire().name, ["a", "b"])
+
+    def test_cooldown(self):
+        key = self.pool.acquire()
+        self.pool.report(key, 429)
+        other = [self.pool.acquire().name for _ in range(2)]
+        self.assertNotIn(key.name, other)
+
+        self.clock.now += 61
+        self.pool.report(self.pool.acquire(), 200)
+        self.assertEqual(key.available_at(self.clock.now), self.clock.now)
+
+    def test_metrics_do_not_expose_keys(self):
+        key = self.pool.acquire()
+        self.pool.report(key, 200)
+        registry = CollectorRegistry()
+        registry.register(self.pool)
+
+        self.assertEqual(registry.get_sample_value(
+            "openweathermap_api_key_responses_total", {"key": key.name, "status": "200"}), 1)
+        self.assertEqual(registry.get_sample_value("openweathermap_api_key_available", {"key": "a"}), 1)
+        for metric in registry.collect():
+            for sample in metric.samples:
+                self.assertNotIn("secret", str(sample.labels))
@@ -0,0 +1,68 @@
+import unittest
+from datetime import datetime
+
+from openweathermap_exporter.backfill import (
+    backfill_filename, format_labels, iter_air_pollution_openmetrics, iter_open_meteo_openmetrics
+)
+from openweathermap_exporter.openmeteo import OpenMeteoAirQualityForecast
+from openweathermap_exporter.openweathermap import AirPollutionInformation, Coordinate
+
+def air_pollution(dt: int, missing: tuple = ()) -> AirPollutionInformation:
+    components = {"co": 1.0, "no": 2.0, "no2": 3.0, "o3": 4.0, "so2": 5.0, "pm2_5": 6.0, "pm10": 7.0, "nh3": 8.0}
+    for name in missing:
+        del components[name]
+    return AirPollutionInformation({
+        "coord": {"lat": 52.0, "lon": 5.0},
+        "list": [{"dt": dt, "main": {"aqi": 1}, "components": components}]
+    })
+
+class BackfillTestCases(unittest.TestCase):
+
+    def test_format_labels(self):
+        self.assertEqual(format_labels({"a": 'x"y', "b": 1.5}), '{a="x\\"y",b="1.5"}')
+
+    def test_air_pollution_families_are_grouped(self):
+        lines = list(iter_air_pollution_openmetrics({"location_name": "A"}, iter([air_pollution(3600), air_pollution(7200)])))
+        self.assertEqual(lines[0], "# TYPE air_pollution_air_quality_index gauge\n")
+        self.assertEqual(lines[2:4], [
+            'air_pollution_air_quality_index{location_name="A"} 1 3600\n',
+            'air_pollution_air_quality_index{location_name="A"} 1 7200\n'
+        ])
+        self.assertEqual(len(lines), 9 * 4)
+
+    def test_air_pollution_missing_values(self):
+        lines = list(iter_air_pollution_openmetrics({}, iter([air_pollution(3600, missing=("nh3",)), air_pollution(7200)])))
+        self.assertNotIn("air_pollution_nh3{} None 3600\n", lines)
+        self.assertEqual(lines[-1:], ["air_pollution_nh3{} 8.0 7200\n"])
+        self.assertEqual(len(lines), 9 * 4 - 1)
+
+    def test_filename(self):
+        # Places with the same name in one country get their own file
+        self.assertEqual(backfill_filename("nl-hengelo", Coordinate(lat=52.2658, lon=6.7931)),
+                         "nl-hengelo_52.2658_6.7931.om")
+        self.assertNotEqual(backfill_filename("nl-hengelo", Coordinate(lat=52.2658, lon=6.7931)),
+                            backfill_filename("nl-hengelo", Coordinate(lat=52.0492, lon=6.3013)))
+
+    def test_long_history_is_spooled(self):
+        # Enough samples to spool every family to a temporary file
+        history = (air_pollution(3600 * i) for i in range(1, 2001))
+        lines = list(iter_air_pollution_openmetrics({"location_name": "A"}, history))
+        self.assertEqual(len(lines), 9 * 2002)
+        names = [line.split("{")[0] for line in lines if not line.startswith("#")]
+        # Every family is written in one piece
+        self.assertEqual(len([n for i, n in enumerate(names) if i == 0 or names[i - 1] != n]), 9)
+        self.assertEqual(lines[-1], 'air_pollution_nh3{location_name="A"} 8.0 7200000\n')
+
+    def test_open_meteo_window_and_missing_values(self):
+        forecast = OpenMeteoAirQualityForecast(datetime(2023, 6, 1), {
+            "utc_offset_seconds": 3600,
+            "hourly": {
+                "time": ["2023-06-01T01:00", "2023-06-01T02:00", "2023-06-01T03:00"],
+                "pm10": [1.0, None, 3.0]
+            }
+        })
+        start = datetime.fromtimestamp(forecast.epoch_at(0))
+        end = datetime.fromtimestamp(forecast.epoch_at(1))
+        lines = list(iter_open_meteo_openmetrics({}, forecast, start, end))
+        self.assertEqual(lines[0], "# TYPE open_meteo_air_quality_pm10 gauge\n")
+        self.assertEqual(lines[2:], ["open_meteo_air_quality_pm10{} 1.0 1685577600\n"])
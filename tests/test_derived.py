@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from openweathermap_exporter import derived
+
+MIDNIGHT = 1700006400  # 2023-11-15T00:00:00Z
+
+class DerivedTestCases(unittest.TestCase):
+
+    def test_formulas(self):
+        self.assertAlmostEqual(derived.dew_point(20.0, 50), 9.26, places=2)
+        self.assertIsNone(derived.dew_point(20.0, 0))
+        self.assertAlmostEqual(derived.heat_index(32.2, 70), 41.1, delta=0.2)
+        self.assertAlmostEqual(derived.heat_index(20.0, 50), 19.4, places=1)
+        self.assertAlmostEqual(derived.wind_chill(-10.0, 20 / 3.6), -17.9, places=1)
+        self.assertEqual(derived.wind_chill(15.0, 10.0), 15.0)
+        self.assertAlmostEqual(derived.absolute_humidity(20.0, 50), 8.64, places=2)
+
+    def test_daily_precipitation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_file = os.path.join(tmp, "state.json")
+            precipitation = derived.DailyPrecipitation(state_file)
+
+            self.assertEqual(precipitation.update("a", MIDNIGHT - 3600, 0, 2.0), 0.0)
+            # Same observation again is not counted twice
+            self.assertEqual(precipitation.update("a", MIDNIGHT - 3600, 0, 2.0), 0.0)
+            self.assertAlmostEqual(precipitation.update("a", MIDNIGHT - 1800, 0, 4.0), 1.5)
+            precipitation.save()
+
+            # After a restart, only the part after midnight counts for the new day
+            precipitation = derived.DailyPrecipitation(state_file)
+            self.assertAlmostEqual(precipitation.update("a", MIDNIGHT + 1800, 0, 4.0), 2.0)
+
+            # Gaps longer than MAX_INTEGRATION_SECONDS are not integrated
+            self.assertAlmostEqual(precipitation.update("a", MIDNIGHT + 6 * 3600, 0, 4.0), 2.0)
+
+    def test_local_midnight(self):
+        precipitation = derived.DailyPrecipitation()
+        # At UTC+2, MIDNIGHT - 1800 is already 01:30 local time of the next day
+        precipitation.update("a", MIDNIGHT - 3 * 3600, 7200, 1.0)
+        self.assertAlmostEqual(precipitation.update("a", MIDNIGHT - 1800, 7200, 1.0), 1.5)
@@ -0,0 +1,81 @@
+import unittest
+
+from openweathermap_exporter import geocoding
+from openweathermap_exporter.openweathermap import Coordinate
+
+class Provider:
+    def __init__(self, coords=None, error=None):
+        self.coords = coords or {}
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, location_name, country_code):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.coords.get(location_name)
+
+class GeocoderTestCases(unittest.TestCase):
+
+    def test_fallback_order(self):
+        first = Provider({"Utrecht": Coordinate(lat=52.09, lon=5.12)})
+        second = Provider({"Formerum": Coordinate(lat=53.39, lon=5.27)})
+        geocoder = geocoding.Geocoder([("first", first), ("second", second)])
+
+        self.assertEqual(geocoder.geocode("Utrecht", "NL").provider, "first")
+        result = geocoder.geocode("Formerum", "NL")
+        self.assertEqual((result.status, result.provider, result.coord.lat), ("found", "second", 53.39))
+        self.assertEqual(second.calls, 1)
+
+        # Hits are cached
+        geocoder.geocode("Formerum", "NL")
+        self.assertEqual((first.calls, second.calls), (2, 1))
+
+    def test_negative_cache(self):
+        provider = Provider()
+        geocoder = geocoding.Geocoder([("owm", provider)], miss_ttl=3600)
+        for _ in range(3):
+            self.assertEqual(geocoder.geocode("Nowhere", "NL").status, geocoding.GEOCODING_NOT_FOUND)
+        self.assertEqual(provider.calls, 1)
+
+        geocoder = geocoding.Geocoder([("owm", provider)], miss_ttl=0)
+        geocoder.geocode("Nowhere", "NL")
+        geocoder.geocode("Nowhere", "NL")
+        self.assertEqual(provider.calls, 3)
+
+    def test_errors(self):
+        geocoder = geocoding.Geocoder([("owm", Provider(error=ConnectionError("timeout")))])
+        self.assertEqual(geocoder.geocode("Utrecht", "NL").status, geocoding.GEOCODING_ERROR)
+
+        geocoder = geocoding.Geocoder([("owm", Provider(error=ConnectionError("timeout"))), ("open_meteo", Provider())])
+        self.assertEqual(geocoder.geocode("Utrecht", "NL").status, geocoding.GEOCODING_NOT_FOUND)
+
+    def test_error_backoff(self):
+        provider = Provider(error=ConnectionError("timeout"))
+        geocoder = geocoding.Geocoder([("owm", provider)], miss_ttl=300, error_ttl=60)
+        ttls = []
+        for _ in range(5):
+            geocoder.geocode("Utrecht", "NL")
+            expiry, result, errors = geocoder.cache[("Utrecht", "NL")]
+            ttls.append(round(expiry - geocoding.monotonic()))
+            # Expire the error to retry the providers
+            geocoder.cache[("Utrecht", "NL")] = (0, result, errors)
+        # Errors are not cached for miss_ttl, but back off up to it
+        self.assertEqual(ttls, [60, 120, 240, 300, 300])
+        self.assertEqual(provider.calls, 5)
+
+        # A miss ends the backoff
+        provider.error = None
+        geocoder.geocode("Utrecht", "NL")
+        self.assertEqual(geocoder.cache[("Utrecht", "NL")][2], 0)
+
+    def test_capacity(self):
+        provider = Provider({"Utrecht": Coordinate(lat=52.09, lon=5.12)})
+        geocoder = geocoding.Geocoder([("owm", provider)], max_entries=2)
+        geocoder.geocode("Utrecht", "NL")
+        geocoder.geocode("Nowhere", "NL")
+        geocoder.geocode("Utrecht", "NL")
+        geocoder.geocode("Elsewhere", "NL")
+
+        # The least recently used result is dropped
+        self.assertEqual(list(geocoder.cache), [("Utrecht", "NL"), ("Elsewhere", "NL")])
@@ -0,0 +1,141 @@
+import gc
+import tempfile
+import tracemalloc
+import unittest
+from datetime import datetime
+from os import path
+from time import time
+
+from prometheus_client import CollectorRegistry
+
+from openweathermap_exporter import lifecycle
+from openweathermap_exporter.aggregates import RegionalAggregates
+from openweathermap_exporter.derived import DerivedWeatherMetrics
+from openweathermap_exporter.geocoding import Geocoder
+from openweathermap_exporter.metrics import WEATHER_METRICS, GaugeSet, SnapshotCollector, presence_bitmap
+from openweathermap_exporter.openmeteo import AirQualityGrid
+from openweathermap_exporter.openweathermap import Coordinate
+
+WEATHER_VALUES = tuple(float(i) for i in range(len(WEATHER_METRICS)))
+
+class FakeWeather:
+    timestamp = None
+    utc_offset_seconds = 0
+    temp = 12.5
+    humidity = 80
+    wind_speed = 4.1
+    rain_volume_1h = 0.4
+    snow_volume_1h = 0.0
+
+class LifecycleTestCases(unittest.TestCase):
+
+    def test_diff_locations(self):
+        current = [("Utrecht", "NL", None, None), ("Gent", "BE", 51.05, 3.72)]
+        configs = [{"name": "Gent", "cc": "BE", "lat": 51.05, "lon": 3.72}, {"name": "Brugge", "cc": "BE"}]
+        added, removed = lifecycle.diff_locations(current, configs)
+        self.assertEqual(added, [{"name": "Brugge", "cc": "BE"}])
+        self.assertEqual(removed, {("Utrecht", "NL", None, None)})
+
+    def test_swap_remove(self):
+        items = ["a", "b", "c", "d"]
+        lifecycle.swap_remove(items, 1)
+        self.assertEqual(items, ["a", "d", "c"])
+        lifecycle.swap_remove(items, 2)
+        self.assertEqual(items, ["a", "d"])
+
+    def test_collector(self):
+        registry = CollectorRegistry()
+        collector = lifecycle.LifecycleCollector()
+        collector.add("locations", lambda: 3)
+        registry.register(collector)
+        self.assertEqual(registry.get_sample_value("exporter_state_entries", {"component": "locations"}), 3)
+        self.assertGreater(registry.get_sample_value("exporter_python_allocated_blocks"), 0)
+
+class SoakTestCases(unittest.TestCase):
+    """Churn the locations through all per location state and check that memory stays flat."""
+
+    live = 100
+    churn = 20
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.gauges = GaugeSet(WEATHER_METRICS, ["location_name"])
+        self.snapshot = SnapshotCollector([self.gauges])
+        self.derived = DerivedWeatherMetrics(
+            {"metrics": ["dew_point", "precipitation_today"],
+             "state_file": path.join(self.directory.name, "state.json")},
+            labelnames=["location_name"])
+        self.aggregates = RegionalAggregates({"metrics": ["weather_temp"]}, [], registry=CollectorRegistry())
+        self.grid = AirQualityGrid()
+        self.geocoder = Geocoder([("fake", lambda name, cc: Coordinate(lat=50.0, lon=5.0))], max_entries=self.live)
+        # (name, coordinate) per slot, like the location lists of the exporter
+        self.locations = []
+        self.start = int(time()) - 3600
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add(self, n):
+        name = f"location-{n}"
+        coord = Coordinate(lat=-60 + (n % 1200) / 10, lon=(n % 3600) / 10 - 180)
+        self.geocoder.geocode(name, f"C{n % 7}")
+        self.grid.add(coord)
+        # Every location has its own country, so groups are created and removed all the time
+        self.aggregates.add_location(f"X{n}", name)
+        self.locations.append((name, coord))
+
+    def remove(self, slot):
+        name, coord = self.locations[slot]
+        self.gauges.remove((name,))
+        self.derived.remove((name,))
+        self.aggregates.remove_location(slot)
+        self.grid.remove(coord)
+        lifecycle.swap_remove(self.locations, slot)
+
+    def refresh(self, cycle):
+        weather = FakeWeather()
+        for slot, (name, _) in enumerate(self.locations):
+            self.gauges.set(WEATHER_VALUES, presence_bitmap(WEATHER_VALUES), (name,))
+            self.aggregates.update("weather", slot, WEATHER_VALUES)
+        self.aggregates.set_metrics()
+        self.snapshot.publish()
+
+        weather.timestamp = datetime.fromtimestamp(self.start + cycle * 600)
+        self.derived.set_metrics([(name,) for name, _ in self.locations], [weather] * len(self.locations))
+
+    def run_cycles(self, start, cycles):
+        for cycle in range(start, start + cycles):
+            for _ in range(self.churn):
+                self.remove(0)
+            for i in range(self.churn):
+                self.add(self.live + cycle * self.churn + i)
+            self.refresh(cycle)
+
+    def test_memory_stays_flat(self):
+        # Memory allocated before tracing starts is not tracked, so trace the warm up as well
+        tracemalloc.start()
+        try:
+            for n in range(self.live):
+                self.add(n)
+            self.run_cycles(0, 30)
+            gc.collect()
+            before = tracemalloc.take_snapshot()
+
+            self.run_cycles(30, 150)
+            gc.collect()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        growth = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+        self.assertLess(growth, 64 * 1024)
+
+        self.assertEqual(len(self.gauges.rows), self.live)
+        self.assertEqual(len(self.derived.gauges.rows), self.live)
+        self.assertEqual(len(self.derived.precipitation.totals), self.live)
+        self.assertEqual(len(self.aggregates.groups), self.live)
+        self.assertLessEqual(len(self.geocoder.cache), self.live)
+        self.assertLessEqual(sum(self.grid.cells.values()), self.live)
+
+if __name__ == "__main__":
+    unittest.main()
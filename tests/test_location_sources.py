@@ -0,0 +1,62 @@
+import io
+import json
+import unittest
+
+from openweathermap_exporter.location_sources import (
+    iter_csv_locations, iter_geojson_locations, iter_json_array_items, iter_location_configs
+)
+
+def feature(name: str, lat: float, lon: float) -> dict:
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": {"name": name, "country_code": "NL"}
+    }
+
+class LocationSourcesTestCases(unittest.TestCase):
+
+    def test_json_array_items_across_chunks(self):
+        doc = json.dumps({"type": "FeatureCollection", "features": [feature(f"L{i}", 52.0, 5.0) for i in range(50)]})
+        items = list(iter_json_array_items(io.StringIO(doc), "features", chunk_size=7))
+        self.assertEqual([item["properties"]["name"] for item in items], [f"L{i}" for i in range(50)])
+
+    def test_geojson_locations(self):
+        doc = json.dumps({"type": "FeatureCollection", "features": [
+            feature("Utrecht", 52.09, 5.12),
+            {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": []}, "properties": {}}
+        ]})
+        self.assertEqual(list(iter_geojson_locations(io.StringIO(doc))), [
+            {"name": "Utrecht", "cc": "NL", "lat": 52.09, "lon": 5.12, "id": None}
+        ])
+
+    def test_csv_locations(self):
+        doc = "name,cc,lat,lon,id\nUtrecht,NL,52.09,5.12,2745912\nDe Bilt,NL,,,\n"
+        self.assertEqual(list(iter_csv_locations(io.StringIO(doc))), [
+            {"name": "Utrecht", "cc": "NL", "lat": 52.09, "lon": 5.12, "id": 2745912},
+            {"name": "De Bilt", "cc": "NL"}
+        ])
+
+    def test_malformed_records_are_skipped(self):
+        doc = "name,cc,lat,lon,id\nUtrecht,NL,north,5.12,\nDelft,NL,,,x\nBreda,NL,51.59,4.78,\n"
+        self.assertEqual(list(iter_csv_locations(io.StringIO(doc))), [
+            {"name": "Breda", "cc": "NL", "lat": 51.59, "lon": 4.78}
+        ])
+
+        doc = json.dumps({"type": "FeatureCollection", "features": [
+            {"type": "Feature", "geometry": {"type": "Point"}, "properties": {}},
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [5.12]}},
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": None}},
+            "Utrecht",
+            feature("Breda", 51.59, 4.78)
+        ]})
+        self.assertEqual([location["name"] for location in iter_geojson_locations(io.StringIO(doc))],
+                         ["Breda"])
+
+    def test_validation_and_deduplication(self):
+        config = {"prometheus_exporter": {"locations": [
+            {"name": "Utrecht", "cc": "NL"},
+            {"name": "Utrecht", "cc": "NL"},
+            {"name": "Nowhere", "cc": "NL", "lat": 91, "lon": 0},
+            {"name": "", "cc": "NL"}
+        ]}}
+        self.assertEqual(list(iter_location_configs(config)), [{"name": "Utrecht", "cc": "NL"}])
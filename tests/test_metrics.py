@@ -0,0 +1,151 @@
+import math
+import unittest
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from openweathermap_exporter.metrics import (
+    MetricSpec, WEATHER_METRICS, GaugeSet, LabelSet, SnapshotCollector, compile_extractor, make_location_id,
+    presence_bitmap
+)
+from openweathermap_exporter.openweathermap import OpenWeatherMap, OpenWeatherMapLocation
+
+specs = [
+    MetricSpec("a", "a", ("main", "a"), "", "A"),
+    MetricSpec("b", "b", ("main", "b"), "", "B", 0),
+    MetricSpec("c", "c", ("c",), "", "C"),
+    MetricSpec("d", "d", ("rain", "1h"), "", "D", 0)
+]
+
+class MetricSpecTestCases(unittest.TestCase):
+
+    def test_extract(self):
+        extract = compile_extractor(specs)
+        self.assertEqual(extract({"main": {"a": 1.0, "b": 2.0}, "c": 3, "rain": {"1h": 0.5}}), (1.0, 2.0, 3, 0.5))
+
+    def test_missing_values_get_default(self):
+        self.assertEqual(compile_extractor(specs)({"main": {"a": 1.0}}), (1.0, 0, None, 0))
+        self.assertEqual(compile_extractor(specs, default=[])({}), ([], [], [], []))
+
+    def test_spec_names_are_unique(self):
+        self.assertEqual(len({spec.name for spec in WEATHER_METRICS}), len(WEATHER_METRICS))
+
+class GaugeSetTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.labels = (52.0, 5.0, "NL", "Utrecht")
+
+    def get(self, name):
+        return self.registry.get_sample_value(name, dict(zip(
+            ["latitude", "longitude", "location_country_code", "location_name"], map(str, self.labels))))
+
+    def register(self, gauges):
+        snapshot = SnapshotCollector([gauges])
+        self.registry.register(snapshot)
+        return snapshot
+
+    def test_staged_gauges_are_published(self):
+        gauges = GaugeSet(specs)
+        staging = CollectorRegistry()
+        condition = Gauge("weather_condition_id", "Condition", ["location_name"], registry=staging)
+        snapshot = SnapshotCollector([gauges], staging)
+        self.registry.register(snapshot)
+
+        condition.labels("Utrecht").set(800)
+        self.assertIsNone(self.registry.get_sample_value("weather_condition_id", {"location_name": "Utrecht"}))
+        snapshot.publish()
+        condition.labels("Utrecht").set(500)
+        self.assertEqual(self.registry.get_sample_value("weather_condition_id", {"location_name": "Utrecht"}), 800)
+
+        # Staged gauges are checked for duplicate names when the snapshot is registered
+        with self.assertRaises(ValueError):
+            self.registry.register(SnapshotCollector([], staging))
+
+    def test_zero_and_nan(self):
+        gauges = GaugeSet(specs, missing_values="nan")
+        snapshot = self.register(gauges)
+        values = (1.0, None, 3, None)
+        gauges.set(values, presence_bitmap(values), self.labels)
+        snapshot.publish()
+        self.assertEqual(self.get("a"), 1.0)
+        self.assertTrue(math.isnan(self.get("b")))
+
+    def test_omit(self):
+        gauges = GaugeSet(specs, missing_values="omit")
+        snapshot = self.register(gauges)
+        values = (1.0, 2.0, 3, None)
+        gauges.set(values, presence_bitmap(values), self.labels)
+        snapshot.publish()
+        self.assertEqual(self.get("b"), 2.0)
+        self.assertIsNone(self.get("d"))
+
+        values = (1.0, None, 3, None)
+        gauges.set(values, presence_bitmap(values), self.labels, mask=0b0111)
+        snapshot.publish()
+        self.assertIsNone(self.get("b"))
+        self.assertEqual(self.get("c"), 3)
+
+    def test_values_are_only_visible_after_publish(self):
+        gauges = GaugeSet(specs, attrs={"a", "b"})
+        snapshot = self.register(gauges)
+        gauges.set((1.0, 2.0, 3, 4), 0b1111, self.labels)
+        self.assertIsNone(self.get("a"))
+
+        snapshot.publish()
+        published = snapshot.snapshot
+        gauges.set((5.0, 6.0, 7, 8), 0b1111, self.labels)
+        self.assertEqual(self.get("a"), 1.0)
+        self.assertIs(snapshot.snapshot, published)
+        self.assertIsNone(self.get("c"))
+
+        gauges.remove(self.labels)
+        snapshot.publish()
+        self.assertIsNone(self.get("a"))
+
+    def test_duplicate_names_are_detected(self):
+        self.register(GaugeSet(specs))
+        with self.assertRaises(ValueError):
+            self.register(GaugeSet(specs))
+
+class LabelSetTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.loc = OpenWeatherMapLocation(OpenWeatherMap("API_KEY"), location_name="Formerum, Terschelling",
+                                          country_code="NL", lat=53.3963726, lon=5.2717206)
+
+    def test_default(self):
+        label_set = LabelSet()
+        self.assertEqual(label_set.values(self.loc), (53.3963726, 5.2717206, "NL", "Formerum, Terschelling"))
+        self.assertFalse(label_set.info_enabled)
+
+    def test_location_id_and_precision(self):
+        self.assertEqual(make_location_id("Formerum, Terschelling", "NL"), "nl-formerum-terschelling")
+
+        label_set = LabelSet(["location_id"], coordinate_precision=2)
+        self.assertEqual(label_set.labels(self.loc), {"location_id": "nl-formerum-terschelling"})
+        self.assertTrue(label_set.info_enabled)
+        self.assertEqual(label_set.all_labels(self.loc)["latitude"], 53.4)
+
+        with self.assertRaises(ValueError):
+            LabelSet(["city"])
+
+    def test_claim_location_id(self):
+        bergen_nh = {"name": "Bergen", "cc": "NL", "lat": 52.67, "lon": 4.70}
+        bergen_l = {"name": "Bergen", "cc": "NL", "lat": 53.26, "lon": 6.00}
+
+        label_set = LabelSet(["location_id"])
+        location_ids: set = set()
+        self.assertTrue(label_set.claim_location_id(bergen_nh, location_ids))
+        self.assertFalse(label_set.claim_location_id(bergen_l, location_ids))
+        self.assertTrue(label_set.claim_location_id(dict(bergen_l, location_id="nl-bergen-l"), location_ids))
+        self.assertEqual(location_ids, {"nl-bergen", "nl-bergen-l"})
+
+        # The coordinates tell them apart without the location_id label
+        self.assertTrue(LabelSet().claim_location_id(bergen_l, {"nl-bergen"}))
+
+    def test_require_location_id(self):
+        label_set = LabelSet(["location_id"])
+        location_ids: set = set()
+        label_set.require_location_id({"name": "Bergen", "cc": "NL"}, location_ids)
+        with self.assertRaisesRegex(ValueError, "Duplicate location_id nl-bergen of Bergen,NL"):
+            label_set.require_location_id({"name": "Bergen", "cc": "NL"}, location_ids)
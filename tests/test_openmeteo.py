@@ -0,0 +1,147 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from openweathermap_exporter.openmeteo import (
+    AirQualityGrid, OpenMeteoAirQualityForecast, OpenMeteoCurrentAirQualityForecast, OpenMeteoWeather
+)
+from openweathermap_exporter.openweathermap import Coordinate, OpenWeatherMapLocation
+
+HOURLY_VARIABLES = [
+    "pm10", "pm2_5", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "ozone", "ammonia",
+    "aerosol_optical_depth", "dust", "uv_index", "uv_index_clear_sky", "alder_pollen", "birch_pollen",
+    "grass_pollen", "mugwort_pollen", "olive_pollen", "ragweed_pollen", "european_aqi",
+    "european_aqi_pm2_5", "european_aqi_pm10", "european_aqi_no2", "european_aqi_o3", "european_aqi_so2"
+]
+
+start = datetime(2023, 6, 1, 0, 0)
+hours = 48
+
+def make_response(values: dict) -> dict:
+    hourly: dict = {"time": [(start + timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M") for h in range(hours)]}
+    for variable in HOURLY_VARIABLES:
+        hourly[variable] = values.get(variable, [None] * hours)
+    return {"hourly": hourly}
+
+class OpenMeteoAirQualityForecastTestCases(unittest.TestCase):
+
+    def setUp(self):
+        pm2_5 = [float(h) for h in range(hours)]
+        pm2_5[5] = None
+        self.forecast = OpenMeteoAirQualityForecast(start, make_response({"pm2_5": pm2_5}))
+
+    def test_index_of(self):
+        start_epoch = start.replace(tzinfo=timezone.utc).timestamp()
+        self.assertEqual(self.forecast.index_of(start_epoch + 3 * 3600 + 1200), 3)
+        self.assertEqual(self.forecast.index_of(start_epoch - 86400), 0)
+
+        # The timestamps are in the local time of the location, 03:20 local is 01:20 UTC
+        response = make_response({})
+        response["utc_offset_seconds"] = 7200
+        forecast = OpenMeteoAirQualityForecast(start, response)
+        self.assertEqual(forecast.index_of(start_epoch + 3600 + 1200), 3)
+        self.assertEqual(forecast.epoch_at(3), start_epoch + 3600)
+
+    def test_current(self):
+        current = OpenMeteoCurrentAirQualityForecast(2, self.forecast)
+        self.assertEqual(current.pm2_5, 2.0)
+        self.assertIsNone(current.olive_pollen)
+
+    def test_horizon_values(self):
+        self.assertEqual(self.forecast.horizon_values("pm2_5", 2, [1, 3, 100]), [3.0, None, None])
+
+    def test_window_statistics(self):
+        self.assertEqual(self.forecast.window_statistics("pm2_5", 4, 3), (6.0, 5.0))
+        self.assertEqual(self.forecast.window_statistics("olive_pollen", 0, 24), (None, None))
+
+    def test_unrequested_variables(self):
+        forecast = OpenMeteoAirQualityForecast(start, {"hourly": {
+            "time": [start.strftime("%Y-%m-%dT%H:%M")],
+            "pm10": [4.0]
+        }})
+        current = OpenMeteoCurrentAirQualityForecast(0, forecast)
+        self.assertEqual(current.pm10, 4.0)
+        self.assertIsNone(current.dust)
+        # The empty default is shared by all forecasts and cannot be modified
+        self.assertEqual(forecast.dust, ())
+        with self.assertRaises(AttributeError):
+            forecast.unknown = 1
+
+class FakeOpenMeteo:
+
+    def __init__(self):
+        self.requested = []
+
+    def get_air_quality(self, coord, *args):
+        self.requested.append((coord.lat, coord.lon))
+        return OpenMeteoAirQualityForecast(datetime.now(), make_response({}))
+
+class AirQualityGridTestCases(unittest.TestCase):
+
+    def test_cells(self):
+        self.assertEqual(AirQualityGrid.cell_of(Coordinate(lat=52.091, lon=5.121)),
+                         AirQualityGrid.cell_of(Coordinate(lat=52.099, lon=5.129)))
+        self.assertNotEqual(AirQualityGrid.cell_of(Coordinate(lat=52.091, lon=5.121)),
+                            AirQualityGrid.cell_of(Coordinate(lat=52.101, lon=5.121)))
+        point = AirQualityGrid.grid_point(AirQualityGrid.cell_of(Coordinate(lat=52.091, lon=5.121)))
+        self.assertEqual((point.lat, point.lon), (52.05, 5.15))
+        point = AirQualityGrid.grid_point(AirQualityGrid.cell_of(Coordinate(lat=-33.9, lon=18.5)))
+        self.assertEqual((point.lat, point.lon), (-34.0, 18.4))
+
+    def test_one_request_per_cell(self):
+        grid = AirQualityGrid()
+        om = FakeOpenMeteo()
+        for lat, lon in [(52.091, 5.121), (52.095, 5.125), (52.3, 5.1)]:
+            grid.add(Coordinate(lat=lat, lon=lon))
+            grid.get_air_quality(om, Coordinate(lat=lat, lon=lon), ["pm10"], None, None)
+        self.assertEqual(len(grid.cells), 2)
+        self.assertEqual(om.requested, [(52.05, 5.15), (52.35, 5.15)])
+
+def make_forecast_response(temperature: float) -> dict:
+    return {
+        "utc_offset_seconds": 7200,
+        "current": {
+            "time": 1685620800, "interval": 900, "temperature_2m": temperature, "apparent_temperature": 17.0,
+            "relative_humidity_2m": 70, "pressure_msl": 1015.2, "visibility": 24140.0, "wind_speed_10m": 3.5,
+            "wind_direction_10m": 250, "wind_gusts_10m": 7.1, "cloud_cover": 40, "rain": 0.2, "showers": 0.1,
+            "snowfall": 0.0, "weather_code": 61, "is_day": 0
+        },
+        "daily": {
+            "time": [1685570400], "temperature_2m_min": [11.0], "temperature_2m_max": [21.0],
+            "sunrise": [1685590000], "sunset": [1685650000]
+        }
+    }
+
+class FakeForecastApi:
+
+    def __init__(self):
+        self.requests = []
+
+    def om_api_request(self, base_url, parameters):
+        self.requests.append(parameters)
+        count = len(parameters["latitude"].split(","))
+        responses = [make_forecast_response(10.0 + i) for i in range(count)]
+        return responses[0] if count == 1 else responses
+
+class OpenMeteoWeatherTestCases(unittest.TestCase):
+
+    def test_weather_in_current_weather_format(self):
+        weather = OpenMeteoWeather(FakeForecastApi()).get_current_weather([Coordinate(lat=52.1, lon=5.1)])[0]
+        self.assertEqual((weather.temp, weather.temp_min, weather.temp_max), (10.0, 11.0, 21.0))
+        self.assertEqual(weather.visibility, 10000)
+        self.assertAlmostEqual(weather.rain_volume_1h, 1.2)
+        self.assertEqual(weather.wind_gust, 7.1)
+        self.assertEqual(weather.utc_offset_seconds, 7200)
+        condition = weather.weather_conditions[0]
+        self.assertEqual((condition.id, condition.main, condition.icon_id), (500, "Rain", "10n"))
+
+    def test_batched_refresh(self):
+        api = FakeForecastApi()
+        locations = [OpenWeatherMapLocation(None, location_name=f"l{i}", country_code="NL", lat=50 + i / 1000,
+                                            lon=5.0, weather_backend="open_meteo") for i in range(150)]
+        backend = OpenMeteoWeather(api)
+        self.assertEqual(backend.calls_per_refresh(locations), 2)
+
+        backend.refresh(locations)
+        self.assertEqual(len(api.requests), 2)
+        self.assertEqual(locations[0].get_current_weather().temp, 10.0)
+        self.assertEqual(locations[149].get_current_weather().temp, 59.0)
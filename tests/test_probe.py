@@ -0,0 +1,79 @@
+import threading
+import unittest
+from time import sleep
+
+from openweathermap_exporter import probe
+from openweathermap_exporter.config import get_probe_options
+from openweathermap_exporter.metrics import MetricSpec
+from openweathermap_exporter.openweathermap import OpenWeatherMap
+
+class ProbeCacheTestCases(unittest.TestCase):
+
+    def test_concurrent_requests_collapse(self):
+        cache = probe.ProbeCache()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            sleep(0.1)
+            return b"result"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get((52.09, 5.12), fetch)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b"result"] * 8)
+
+    def test_size_and_ttl(self):
+        cache = probe.ProbeCache(max_entries=2, ttl=60)
+        for key in [(1,), (2,), (1,), (3,)]:
+            cache.get(key, lambda: b"x")
+        # (2,) was the least recently used
+        self.assertEqual(list(cache.entries), [(1,), (3,)])
+
+        cache = probe.ProbeCache(ttl=0)
+        cache.get((1,), lambda: b"old")
+        self.assertEqual(cache.get((1,), lambda: b"new"), b"new")
+
+    def test_failures_are_not_cached(self):
+        cache = probe.ProbeCache()
+
+        def fail():
+            raise ConnectionError("timeout")
+
+        with self.assertRaises(ConnectionError):
+            cache.get((1,), fail)
+        self.assertEqual(cache.get((1,), lambda: b"x"), b"x")
+
+    def test_probe_lines(self):
+        specs = [MetricSpec("a", "a", ("a",), "", "A"), MetricSpec("b", "b", ("b",), "", "B")]
+        self.assertEqual(list(probe.iter_probe_lines(specs, (1, None), "omit")),
+                         ["# TYPE a gauge\n", "# HELP a A\n", "a 1.0\n"])
+
+    def test_coordinate_of(self):
+        prober = probe.Prober(OpenWeatherMap("API_KEY"))
+        coord = prober.coordinate_of({"lat": ["52.09"], "lon": ["5.12"]})
+        self.assertEqual((coord.lat, coord.lon), (52.09, 5.12))
+
+        for lat, lon in [("nan", "5.12"), ("52.09", "inf"), ("91", "5.12"), ("52.09", "-181"), ("north", "5.12")]:
+            with self.assertRaises(ValueError):
+                prober.coordinate_of({"lat": [lat], "lon": [lon]})
+        with self.assertRaises(ValueError):
+            prober.coordinate_of({"lat": ["52.09"]})
+
+    def test_probe_options(self):
+        self.assertIsNone(get_probe_options({"prometheus_exporter": {}}))
+        # An empty section enables probing with the defaults
+        self.assertEqual(get_probe_options({"prometheus_exporter": {"probe": None}}), {})
+        self.assertEqual(get_probe_options({"prometheus_exporter": {"probe": {"ttl": 60}}}), {"ttl": 60})
+        # Options the exporter passes itself are rejected too
+        for option in ["missing_values", "geocoder", "cache_sizes"]:
+            with self.assertRaises(ValueError):
+                get_probe_options({"prometheus_exporter": {"probe": {option: 1}}})
+        with self.assertRaises(ValueError):
+            get_probe_options({"prometheus_exporter": {"probe": [1000]}})
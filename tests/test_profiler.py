@@ -0,0 +1,62 @@
+import json
+import threading
+import time
+import unittest
+
+from openweathermap_exporter import profiler
+
+class TestRefreshTimings(unittest.TestCase):
+
+    def test_nested_phase_not_counted_twice(self):
+        timings = profiler.RefreshTimings()
+        timings.start()
+        with timings.phase("parse"):
+            time.sleep(0.02)
+            with timings.phase("fetch"):
+                time.sleep(0.05)
+        timings.finish()
+
+        refresh = json.loads(timings.to_json())[0]
+        self.assertGreaterEqual(refresh["phases"]["fetch"], 0.05)
+        self.assertLess(refresh["phases"]["parse"], 0.05)
+        self.assertAlmostEqual(sum(refresh["phases"].values()), refresh["duration_seconds"], delta=0.01)
+
+    def test_phases_outside_refresh_are_ignored(self):
+        timings = profiler.RefreshTimings()
+        with timings.phase("fetch"):
+            pass
+        timings.finish()
+        self.assertEqual(json.loads(timings.to_json()), [])
+
+    def test_history_is_bounded(self):
+        timings = profiler.RefreshTimings(history_size=2)
+        for _ in range(3):
+            timings.start()
+            timings.finish()
+        self.assertEqual(len(json.loads(timings.to_json())), 2)
+
+class TestSampling(unittest.TestCase):
+
+    def test_samples_other_threads(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait, name="sampled-thread")
+        thread.start()
+        try:
+            samples = profiler.sample_stacks(0.05, 0.01)
+        finally:
+            stop.set()
+            thread.join()
+
+        stacks = [stack for stack in samples if stack.startswith("sampled-thread;")]
+        self.assertTrue(stacks)
+        self.assertIn("wait (threading.py:", stacks[0])
+        self.assertFalse(any(stack.startswith(threading.current_thread().name + ";") for stack in samples))
+
+    def test_one_profile_at_a_time(self):
+        p = profiler.Profiler()
+        with p.lock:
+            self.assertIsNone(p.profile(0.01))
+        self.assertIsNotNone(p.profile(0.01))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import struct
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from openweathermap_exporter import remote_write
+
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+def decode_snappy_literals(data):
+    length, pos = read_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        assert tag & 3 == 0, "only literals expected"
+        size = struct.unpack_from("<H", data, pos + 1)[0] + 1
+        out += data[pos + 3:pos + 3 + size]
+        pos += 3 + size
+    assert len(out) == length
+    return bytes(out)
+
+def decode_fields(data):
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 2:
+            size, pos = read_varint(data, pos)
+            yield field, data[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            yield field, struct.unpack_from("<d", data, pos)[0]
+            pos += 8
+        else:
+            value, pos = read_varint(data, pos)
+            yield field, value
+
+def decode_write_request(data):
+    series = []
+    for _, ts in decode_fields(data):
+        labels, samples = {}, []
+        for field, value in decode_fields(ts):
+            if field == 1:
+                label = dict(decode_fields(value))
+                labels[label[1].decode()] = label[2].decode()
+            else:
+                samples.append(dict(decode_fields(value)))
+        series.append((labels, samples))
+    return series
+
+class Receiver(BaseHTTPRequestHandler):
+    requests: list = []
+    statuses: list = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        status = self.statuses.pop(0) if self.statuses else 204
+        if status < 300:
+            self.requests.append((dict(self.headers), decode_write_request(decode_snappy_literals(body))))
+        self.send_response(status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class RemoteWriteTestCases(unittest.TestCase):
+
+    def setUp(self):
+        Receiver.requests = []
+        Receiver.statuses = []
+        self.httpd = HTTPServer(("127.0.0.1", 0), Receiver)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+        self.registry = CollectorRegistry()
+        self.gauge = Gauge("weather_temperature", "Temperature", ["location_name"], registry=self.registry)
+        self.writer = remote_write.RemoteWriter(f"http://127.0.0.1:{self.httpd.server_address[1]}/api/v1/write",
+                                                registry=self.registry, batch_size=2, retry_backoff=0)
+        self.writer.compress = remote_write.snappy_compress_literal
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def test_push_changed_samples(self):
+        for name, value in [("Utrecht", 12.5), ("Delft", 13.0), ("Breda", 14.0)]:
+            self.gauge.labels(name).set(value)
+
+        self.assertEqual(self.writer.push(), 3)
+        # Batches of at most two samples
+        self.assertEqual([len(series) for _, series in Receiver.requests], [2, 1])
+        headers, series = Receiver.requests[0]
+        self.assertEqual(headers["Content-Encoding"], "snappy")
+        labels, samples = series[0]
+        self.assertEqual(labels, {"__name__": "weather_temperature", "location_name": "Utrecht"})
+        self.assertEqual(samples[0][1], 12.5)
+        self.assertGreater(samples[0][2], 0)
+
+        # Only the changed sample is sent again
+        self.gauge.labels("Delft").set(15.0)
+        self.assertEqual(self.writer.push(), 1)
+        self.assertEqual(Receiver.requests[-1][1][0][0]["location_name"], "Delft")
+        self.assertEqual(self.writer.push(), 0)
+
+    def test_unchanged_nan_is_not_sent_again(self):
+        self.gauge.labels("Utrecht").set(float("nan"))
+        self.assertEqual(self.writer.push(), 1)
+        self.assertEqual(self.writer.push(), 0)
+
+        self.gauge.labels("Utrecht").set(12.5)
+        self.assertEqual(self.writer.push(), 1)
+
+    def test_forget_removed_series(self):
+        self.gauge.labels("Utrecht").set(12.5)
+        self.gauge.labels("Delft").set(13.0)
+        self.writer.push()
+
+        self.gauge.remove("Delft")
+        self.writer.push()
+        self.assertEqual([dict(labels)["location_name"] for _, labels in self.writer.sent], ["Utrecht"])
+
+    def test_retry(self):
+        self.gauge.labels("Utrecht").set(1.0)
+
+        Receiver.statuses = [503, 204]
+        self.assertEqual(self.writer.push(), 1)
+
+        # Client errors are not retried, the sample is sent with the next push instead
+        self.gauge.labels("Utrecht").set(2.0)
+        Receiver.statuses = [400]
+        self.assertEqual(self.writer.push(), 0)
+        self.assertEqual(self.writer.push(), 1)
+
+    def test_stop_at_failed_batch(self):
+        for name, value in [("Utrecht", 12.5), ("Delft", 13.0), ("Breda", 14.0)]:
+            self.gauge.labels(name).set(value)
+
+        # The first batch fails after all retries, the second batch is not attempted
+        Receiver.statuses = [503] * 4 + [204]
+        self.assertEqual(self.writer.push(), 0)
+        self.assertEqual(Receiver.statuses, [204])
+        self.assertEqual(Receiver.requests, [])
+        self.assertEqual(self.writer.push(), 3)
+
+    def test_submit(self):
+        self.gauge.labels("Utrecht").set(12.5)
+        self.writer.submit()
+        self.writer.close()
+        self.assertEqual(len(Receiver.requests), 1)
+        self.assertEqual(self.writer.sent, {("weather_temperature", (("location_name", "Utrecht"),)): 12.5})
+
+    def test_snappy_literal(self):
+        data = bytes(range(256)) * 300
+        self.assertEqual(decode_snappy_literals(remote_write.snappy_compress_literal(data)), data)
@@ -0,0 +1,27 @@
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from openweathermap_exporter import server
+
+class ServerTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.httpd = server.start_server(0, "127.0.0.1")
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        server.ready.clear()
+
+    def test_ready(self):
+        with self.assertRaises(HTTPError) as ctx:
+            urlopen(f"{self.url}/ready")
+        self.assertEqual(ctx.exception.code, 503)
+
+        server.set_ready()
+        with urlopen(f"{self.url}/ready") as resp:
+            self.assertEqual(resp.status, 200)
+        with urlopen(f"{self.url}/metrics") as resp:
+            self.assertIn(b"exporter_ready 1.0", resp.read())
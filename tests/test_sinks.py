@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+import unittest
+
+from openweathermap_exporter import sinks
+
+TAGS = {"location_name": "Formerum, Terschelling", "country_code": "NL", "latitude": 53.39}
+
+class TestFormats(unittest.TestCase):
+
+    def test_make_observation_skips_missing_values(self):
+        observation = sinks.make_observation("weather", 1700000000, TAGS, ["temp", "rain"], (12.5, None))
+        self.assertEqual(observation.fields, {"temp": 12.5})
+        self.assertEqual(observation.tags["latitude"], "53.39")
+
+    def test_line_protocol_escapes_tags(self):
+        observation = sinks.make_observation("weather", 1700000000.5, TAGS, ["temp"], (12.5,))
+        self.assertEqual(
+            sinks.format_line_protocol(observation),
+            "weather,country_code=NL,latitude=53.39,location_name=Formerum\\,\\ Terschelling "
+            "temp=12.5 1700000000500000000\n")
+
+    def test_line_protocol_without_fields(self):
+        observation = sinks.make_observation("weather", 1700000000, TAGS, ["temp"], (None,))
+        self.assertEqual(sinks.format_line_protocol(observation), "")
+
+    def test_jsonl(self):
+        observation = sinks.make_observation("air_pollution", 1700000000, TAGS, ["pm2_5"], (3.0,))
+        row = json.loads(sinks.format_jsonl(observation))
+        self.assertEqual(row["source"], "air_pollution")
+        self.assertEqual(row["fields"], {"pm2_5": 3.0})
+
+class TestObservationSink(unittest.TestCase):
+
+    def test_close_flushes_buffer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sink = sinks.ObservationSink(directory, flush_interval=3600)
+            for i in range(3):
+                sink.submit([sinks.make_observation("weather", 1700000000 + i, TAGS, ["temp"], (float(i),))])
+            sink.close()
+
+            files = os.listdir(directory)
+            self.assertEqual(len(files), 1)
+            self.assertTrue(files[0].endswith(".jsonl"))
+            with open(os.path.join(directory, files[0]), encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual([row["fields"]["temp"] for row in rows], [0.0, 1.0, 2.0])
+
+    def test_rotates_on_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sink = sinks.ObservationSink(directory, format="line_protocol", flush_records=1, rotate_bytes=1)
+            for i in range(3):
+                sink.submit([sinks.make_observation("weather", 1700000000 + i, TAGS, ["temp"], (float(i),))])
+            sink.close()
+
+            self.assertEqual(len(os.listdir(directory)), 3)
+
+    def test_unknown_format(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(ValueError):
+                sinks.ObservationSink(directory, format="csv")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from openweathermap_exporter import transport
+
+class FakeTransport:
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url, parameters, timeout):
+        self.calls += 1
+        return transport.RecordedResponse(200, json.dumps({"call": self.calls}))
+
+class TransportTestCases(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "recording.jsonl.gz")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record(self, *requests):
+        recorder = transport.RecordingTransport(self.filename, FakeTransport())
+        for url, parameters in requests:
+            recorder.get(url, parameters, 10)
+        recorder.close()
+
+    def test_recording_redacts_api_key(self):
+        self.record(("https://example.org/weather", {"lat": 52.1, "appid": "secret"}))
+
+        with gzip.open(self.filename, "rt", encoding="utf-8") as f:
+            content = f.read()
+        self.assertNotIn("secret", content)
+        record = json.loads(content)
+        self.assertEqual(record["parameters"], {"lat": 52.1})
+        self.assertEqual(record["status"], 200)
+
+    def test_replay_in_recorded_order(self):
+        self.record(("https://example.org/weather", {"lat": 52.1, "appid": "a"}),
+                    ("https://example.org/weather", {"lat": 52.1, "appid": "b"}))
+
+        replay = transport.ReplayTransport(self.filename, latency_scale=0)
+        bodies = [json.loads(replay.get("https://example.org/weather", {"appid": "c", "lat": 52.1}, 10).text)
+                  for _ in range(3)]
+        self.assertEqual(bodies, [{"call": 1}, {"call": 2}, {"call": 1}])
+
+    def test_replay_scales_latency(self):
+        self.record(("https://example.org/weather", {"lat": 52.1}))
+        with gzip.open(self.filename, "rt", encoding="utf-8") as f:
+            elapsed = json.loads(f.read())["elapsed"]
+
+        delays = []
+        replay = transport.ReplayTransport(self.filename, latency_scale=2, delay=delays.append)
+        replay.get("https://example.org/weather", {"lat": 52.1}, 10)
+        self.assertEqual(delays, [elapsed * 2])
+
+    def test_recording_is_flushed_per_records(self):
+        recorder = transport.RecordingTransport(self.filename, FakeTransport(), flush_records=2,
+                                                flush_interval=3600)
+        for lat in [52.1, 52.2, 52.3]:
+            recorder.get("https://example.org/weather", {"lat": lat}, 10)
+
+        # Read before closing, like the recording of a killed exporter
+        replay = transport.ReplayTransport(self.filename, latency_scale=0)
+        self.assertEqual(len(replay.responses), 2)
+        recorder.close()
+        replay = transport.ReplayTransport(self.filename, latency_scale=0)
+        self.assertEqual(len(replay.responses), 3)
+
+    def test_replay_miss(self):
+        self.record(("https://example.org/weather", {"lat": 52.1}))
+
+        replay = transport.ReplayTransport(self.filename)
+        with self.assertRaises(transport.ReplayMiss):
+            replay.get("https://example.org/weather", {"lat": 52.2}, 10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import unittest
+from time import time
+
+from openweathermap_exporter.openweathermap import (
+    GroupStrategy, OpenWeatherMap, OpenWeatherMapLocation, WeatherEndpointStrategy, WeatherInformation,
+    choose_weather_strategy, one_call_to_current_weather
+)
+
+owm = OpenWeatherMap("API_KEY")
+
+def make_locations(count: int, with_id: int) -> list[OpenWeatherMapLocation]:
+    return [
+        OpenWeatherMapLocation(
+            owm, location_name=f"L{i}", country_code="NL", lat=52.0, lon=5.0,
+            city_id=i if i < with_id else None
+        )
+        for i in range(count)
+    ]
+
+class WeatherEndpointTestCases(unittest.TestCase):
+
+    def test_calls_per_refresh(self):
+        locations = make_locations(45, 41)
+        self.assertEqual(WeatherEndpointStrategy().calls_per_refresh(locations), 45)
+        self.assertEqual(GroupStrategy().calls_per_refresh(locations), 3 + 4)
+
+    def test_choose_weather_strategy(self):
+        self.assertEqual(choose_weather_strategy(["current", "group"], make_locations(3, 0)).name, "current")
+        self.assertEqual(choose_weather_strategy(["current", "group"], make_locations(3, 3)).name, "group")
+        # One Call is used whenever it is configured, it never takes fewer calls than current
+        self.assertEqual(choose_weather_strategy(["current", "onecall"], make_locations(3, 0)).name, "onecall")
+
+    def test_group_weather_is_fresh_after_fetch(self):
+        class GroupApi(OpenWeatherMap):
+            def get_group_weather(self, city_ids, units="metric"):
+                # Observed an hour before it is fetched
+                return {city_id: WeatherInformation({
+                    "coord": {"lat": 52.0, "lon": 5.0}, "main": {"temp": 10.0}, "weather": [],
+                    "dt": int(time()) - 3600, "sys": {"sunrise": 0, "sunset": 0}
+                }) for city_id in city_ids}
+
+            def get_current_weather(self, coord, units="metric"):
+                raise AssertionError("the group weather is requested again per location")
+
+        group_owm = GroupApi("API_KEY")
+        locations = [
+            OpenWeatherMapLocation(group_owm, location_name=f"L{i}", country_code="NL", lat=52.0, lon=5.0,
+                                   city_id=i)
+            for i in range(3)
+        ]
+        GroupStrategy().refresh(group_owm, locations)
+
+        for loc in locations:
+            self.assertFalse(loc.current_weather_is_stale())
+            self.assertEqual(loc.get_current_weather().temp, 10.0)
+
+    def test_one_call_to_current_weather(self):
+        weather = WeatherInformation(one_call_to_current_weather({
+            "lat": 52.0, "lon": 5.0,
+            "current": {
+                "dt": 1700000000, "sunrise": 1699990000, "sunset": 1700020000, "temp": 8.0, "feels_like": 6.0,
+                "pressure": 1000, "humidity": 90, "clouds": 100, "visibility": 8000, "wind_speed": 5.0,
+                "wind_deg": 180, "weather": [], "rain": {"1h": 1.5}
+            },
+            "daily": [{"temp": {"min": 4.0, "max": 9.0}}]
+        }))
+        self.assertEqual(weather.temp_min, 4.0)
+        self.assertEqual(weather.visibility, 8000)
+        self.assertEqual(weather.rain_volume_1h, 1.5)
+        self.assertIsNone(weather.wind_gust)
+
+    def test_one_call_missing_values(self):
+        weather = WeatherInformation(one_call_to_current_weather({
+            "lat": 52.0, "lon": 5.0,
+            "current": {
+                "dt": 1700000000, "sunrise": 1699990000, "sunset": 1700020000, "temp": 8.0, "feels_like": 6.0,
+                "pressure": 1000, "humidity": 90, "clouds": 100, "wind_speed": 5.0, "wind_deg": 180
+            }
+        }))
+        # Not made up from the current temperature or a default visibility
+        self.assertIsNone(weather.temp_min)
+        self.assertIsNone(weather.temp_max)
+        self.assertIsNone(weather.visibility)
+
+    def test_weather_conditions_are_not_shared(self):
+        obj = {
+            "coord": {"lat": 52.0, "lon": 5.0}, "main": {}, "dt": 1700000000,
+            "sys": {"sunrise": 1699990000, "sunset": 1700020000},
+            "weather": [{"id": 500, "main": "Rain", "description": "light rain", "icon": "10d"}]
+        }
+        first = WeatherInformation(obj)
+        # Parsed separately, so only interning makes the label values identical
+        second = WeatherInformation(json.loads(json.dumps(obj)))
+        self.assertEqual(len(second.weather_conditions), 1)
+        self.assertIsNot(first.weather_conditions, second.weather_conditions)
+        self.assertIs(first.weather_conditions[0].description, second.weather_conditions[0].description)